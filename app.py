@@ -1,5 +1,10 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+import json
+import os
+import uuid
+from collections import OrderedDict
 import plotly.express as px
 import pandas as pd
 
@@ -13,34 +18,161 @@ st.set_page_config(
 # URL de nuestro Servidor MCP
 MCP_API_URL = "http://127.0.0.1:8000"
 
+# Usuario/cuenta cuyos datos se muestran (vacío = usuario default del servidor)
+MCP_USER_ID = os.getenv("MCP_USER_ID", "")
+MCP_HEADERS = {"X-User-Id": MCP_USER_ID} if MCP_USER_ID else {}
+
+# Respuestas del servidor cuando limita las consultas al asistente de IA
+# (límite de ritmo o modelo saturado); traen {"error": mensaje}
+LIMITED_STATUS_CODES = (429, 503)
+
+# --- Capa de datos del cliente ---
+# Streamlit vuelve a ejecutar todo el script en cada interacción. Las lecturas
+# se guardan en caché por versión de los datos del servidor: mientras no
+# cambie, repetir un filtro no hace peticiones ni vuelve a parsear DataFrames.
+
+# Cada cuánto se vuelve a preguntar la versión de los datos al servidor
+CLIENT_VERSION_TTL_SECONDS = float(os.getenv("CLIENT_VERSION_TTL_SECONDS", "5"))
+# Vigencia máxima de una lectura en caché (aunque la versión no cambie)
+CLIENT_CACHE_TTL_SECONDS = float(os.getenv("CLIENT_CACHE_TTL_SECONDS", "600"))
+# Respuestas guardadas para peticiones condicionales (ETag)
+ETAG_STORE_MAX_ENTRIES = 128
+
+@st.cache_resource
+def get_http_session():
+    """Sesión HTTP compartida: reutiliza conexiones (keep-alive) entre reruns."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update(MCP_HEADERS)
+    return session
+
+@st.cache_resource
+def get_etag_store():
+    """Última respuesta (ETag y cuerpo) por URL y parámetros, para peticiones condicionales."""
+    return OrderedDict()
+
+def conditional_get(path, params=None):
+    """
+    GET condicional: manda If-None-Match con el ETag guardado y, si el
+    servidor responde 304, reutiliza el cuerpo anterior sin descargarlo.
+    """
+    store = get_etag_store()
+    key = (path, json.dumps(params, sort_keys=True, default=str))
+    cached = store.get(key)
+    headers = {"If-None-Match": cached[0]} if cached else {}
+    response = get_http_session().get(f"{MCP_API_URL}{path}", params=params, headers=headers)
+    if response.status_code == 304 and cached:
+        return cached[1]
+    response.raise_for_status() # Lanza error si la API falla
+    data = response.json()
+    if response.headers.get("ETag"):
+        store[key] = (response.headers["ETag"], data)
+        store.move_to_end(key)
+        while len(store) > ETAG_STORE_MAX_ENTRIES:
+            store.popitem(last=False)
+    return data
+
+@st.cache_data(ttl=CLIENT_VERSION_TTL_SECONDS, show_spinner=False)
+def get_data_version():
+    """Huella y versión de los datos en el servidor (se consulta a lo más cada CLIENT_VERSION_TTL_SECONDS)."""
+    response = get_http_session().get(f"{MCP_API_URL}/api/v1/data_version")
+    response.raise_for_status()
+    data = response.json()
+    return f"{data['fingerprint']}-{data['version']}"
+
+def _params_key(params):
+    return json.dumps(params or {}, sort_keys=True, default=str)
+
+@st.cache_data(ttl=CLIENT_CACHE_TTL_SECONDS, max_entries=256, show_spinner=False)
+def cached_get(path, params_key, data_version):
+    """Lectura JSON en caché; `data_version` sólo forma parte de la llave."""
+    return conditional_get(path, json.loads(params_key) or None)
+
+@st.cache_data(ttl=CLIENT_CACHE_TTL_SECONDS, max_entries=64, show_spinner=False)
+def cached_frame(path, params_key, data_version, field=None):
+    """
+    Lectura ya convertida a DataFrame (con `fecha` como datetime), para no
+    repetir pd.DataFrame/to_datetime en cada rerun.
+    """
+    data = cached_get(path, params_key, data_version)
+    records = data.get(field, []) if field else data
+    df = pd.DataFrame(records)
+    if 'fecha' in df.columns:
+        df['fecha'] = pd.to_datetime(df['fecha'])
+    return df
+
+def client_headers():
+    """
+    Identifica la sesión de Streamlit (el usuario final) ante el servidor:
+    el límite de ritmo del asistente es por sesión, no por el host de la app.
+    """
+    if "mcp_client_id" not in st.session_state:
+        st.session_state.mcp_client_id = uuid.uuid4().hex
+    return {"X-Client-Id": st.session_state.mcp_client_id}
+
 # --- Funciones para llamar a la API ---
 
 def get_api_summary():
     """Obtiene el resumen financiero del servidor MCP."""
     try:
-        response = requests.get(f"{MCP_API_URL}/api/v1/summary")
-        response.raise_for_status() # Lanza error si la API falla
-        return response.json()
+        return cached_get("/api/v1/summary", _params_key(None), get_data_version())
     except requests.exceptions.RequestException as e:
         st.error(f"Error al conectar con el Servidor MCP: {e}")
         return None
 
-def ask_api_cfo(question):
-    """Envía una pregunta al asistente de IA en el servidor MCP."""
+def stream_api_cfo(question):
+    """
+    Recibe la respuesta del asistente fragmento por fragmento (server-sent events).
+    Es un generador pensado para usarse con st.write_stream.
+    """
     try:
-        response = requests.post(f"{MCP_API_URL}/api/v1/ask", json={"question": question})
-        response.raise_for_status()
-        return response.json()["ai_answer"]
+        with get_http_session().post(
+            f"{MCP_API_URL}/api/v1/ask/stream",
+            json={"question": question},
+            headers=client_headers(),
+            stream=True
+        ) as response:
+            if response.headers.get("Content-Type", "").startswith("application/json"):
+                # El servidor respondió con un error en JSON en lugar del stream
+                # (ej. datos no cargados, usuario sin datos o límite de consultas)
+                yield response.json().get("error", "Lo siento, no puedo responder en este momento.")
+                return
+            response.raise_for_status()
+            response.encoding = "utf-8"
+            event = None
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    data = json.loads(line[len("data:"):])
+                    if event == "token":
+                        yield data["text"]
+                    elif event == "error":
+                        yield data["error"]
+                        return
+                    elif event == "done":
+                        return
     except requests.exceptions.RequestException as e:
         st.error(f"Error al contactar al Asistente: {e}")
-        return "Lo siento, no puedo responder en este momento."
+        yield "Lo siento, no puedo responder en este momento."
 
-def get_api_all_transactions():
-    """Obtiene TODAS las transacciones del servidor MCP para gráficas."""
+def get_api_timeline_options():
+    """Obtiene las descripciones y el rango de fechas para los filtros de la línea del tiempo."""
     try:
-        response = requests.get(f"{MCP_API_URL}/api/v1/all_transactions")
-        response.raise_for_status() 
-        return response.json()
+        return cached_get("/api/v1/timeline/options", _params_key(None), get_data_version())
+    except requests.exceptions.RequestException as e:
+        st.error(f"Error al cargar datos de la línea de tiempo: {e}")
+        return None
+
+def get_api_timeline(params):
+    """
+    Obtiene los totales ya agregados de la línea del tiempo para los filtros
+    dados, como DataFrame (fecha, descripcion, tipo, monto).
+    """
+    try:
+        return cached_frame("/api/v1/timeline", _params_key(params), get_data_version(), field="points")
     except requests.exceptions.RequestException as e:
         st.error(f"Error al cargar datos de la línea de tiempo: {e}")
         return None
@@ -49,7 +181,44 @@ def post_api_simulation(params):
     """Envía parámetros de simulación al servidor MCP."""
     try:
         # params será un dict, ej: {"category_to_reduce": "Restaurantes", ...}
-        response = requests.post(f"{MCP_API_URL}/api/v1/simulate", json=params)
+        response = get_http_session().post(f"{MCP_API_URL}/api/v1/simulate", json=params, headers=client_headers())
+        response.raise_for_status()
+        return response.json()
+    except requests.exceptions.RequestException as e:
+        st.error(f"Error al contactar al Simulador: {e}")
+        return None
+
+def wait_api_job(job_id):
+    """
+    Espera el resultado de un trabajo en segundo plano del servidor (ej. el
+    análisis de una simulación) por server-sent events y regresa el trabajo
+    terminado: {"status": "done", "result": ...} o {"status": "error", "error": ...}.
+    """
+    try:
+        with get_http_session().get(
+            f"{MCP_API_URL}/api/v1/jobs/{job_id}/events",
+            stream=True
+        ) as response:
+            response.raise_for_status()
+            response.encoding = "utf-8"
+            event = None
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:") and event in ("done", "error"):
+                    return json.loads(line[len("data:"):])
+    except requests.exceptions.RequestException as e:
+        return {"status": "error", "error": f"Error al contactar al Simulador: {e}"}
+    return {"status": "error", "error": "El análisis no terminó."}
+
+def post_api_simulation_sweep(params):
+    """Envía un barrido de escenarios (análisis de sensibilidad) al servidor MCP."""
+    try:
+        response = get_http_session().post(
+            f"{MCP_API_URL}/api/v1/simulate/sweep", json=params, headers=client_headers()
+        )
+        if response.status_code in LIMITED_STATUS_CODES:
+            return response.json()
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
@@ -160,19 +329,12 @@ if summary_data:
             
             st.subheader("Ganancias y Costos diarios")
 
-            timeline_data = get_api_all_transactions()
-
-            if timeline_data:
-                recientes_df = pd.DataFrame(timeline_data)
-
+            # Sólo pedimos al servidor las opciones de filtro (no las transacciones)
+            timeline_options = get_api_timeline_options()
 
-                recientes_df['fecha'] = pd.to_datetime(recientes_df['fecha'], errors='coerce')
-                recientes_df['monto'] = pd.to_numeric(recientes_df['monto'], errors='coerce')
-                recientes_df['descripcion'] = recientes_df['descripcion'].astype(str)
-                recientes_df['tipo'] = recientes_df['tipo'].astype(str)
-                
+            if timeline_options:
                 st.markdown("**Filtros**")
-                desc_options = sorted(recientes_df['descripcion'].dropna().unique().tolist())
+                desc_options = timeline_options.get("descripciones", [])
                 selected_desc = st.multiselect(
                     "Filtrar por descripción (ej: Walmart, Netflix, Farmacia)",
                     options=desc_options,
@@ -180,72 +342,70 @@ if summary_data:
                 )
                 
                 tipo_option = st.selectbox("Tipo", options=['both', 'gasto', 'ingreso'], index=0)
+
+                granularity_labels = {"day": "Diaria", "week": "Semanal", "month": "Mensual"}
+                granularity = st.selectbox(
+                    "Agrupar por",
+                    options=list(granularity_labels.keys()),
+                    format_func=granularity_labels.get,
+                    index=0
+                )
                 
                 # Date range picker with proper default values
-                min_date = None
-                max_date = None
-                if recientes_df['fecha'].notna().any():
-                    ts_min = recientes_df['fecha'].min()
-                    ts_max = recientes_df['fecha'].max()
-                    if pd.notna(ts_min) and pd.notna(ts_max):
-                        min_date = ts_min.date()
-                        max_date = ts_max.date()
-                        
-                        # Set default dates within the valid range
-                        # Use the last month of data or less if data span is shorter
-                        date_span = (max_date - min_date).days
-                        default_days = min(30, date_span)
-                        default_start = max_date - pd.Timedelta(days=default_days)
+                start_date, end_date = None, None
+                if timeline_options.get("fecha_min") and timeline_options.get("fecha_max"):
+                    min_date = pd.to_datetime(timeline_options["fecha_min"]).date()
+                    max_date = pd.to_datetime(timeline_options["fecha_max"]).date()
+                    
+                    # Set default dates within the valid range
+                    # Use the last month of data or less if data span is shorter
+                    date_span = (max_date - min_date).days
+                    default_days = min(30, date_span)
+                    default_start = max_date - pd.Timedelta(days=default_days)
+                    
+                    try:
+                        date_range = st.date_input(
+                            "Rango de fechas",
+                            value=(default_start, max_date),
+                            min_value=min_date,
+                            max_value=max_date,
+                            key="date_range_picker"
+                        )
                         
-                        try:
-                            date_range = st.date_input(
-                                "Rango de fechas",
-                                value=(default_start, max_date),
-                                min_value=min_date,
-                                max_value=max_date,
-                                key="date_range_picker"
-                            )
-                            
-                            # Handle both single date and date range returns
-                            if isinstance(date_range, tuple):
+                        # Handle both single date and date range returns
+                        if isinstance(date_range, tuple):
+                            if len(date_range) == 2:
                                 start_date, end_date = date_range
-                            else:
-                                start_date = end_date = date_range
-                        except Exception as e:
-                            st.warning(f"Error al configurar fechas: {str(e)}")
-                            start_date = min_date
-                            end_date = max_date
+                            elif date_range:
+                                start_date = end_date = date_range[0]
+                        else:
+                            start_date = end_date = date_range
+                    except Exception as e:
+                        st.warning(f"Error al configurar fechas: {str(e)}")
+                        start_date = min_date
+                        end_date = max_date
                 else:
-                    start_date, end_date = None, None
                     st.warning("No hay fechas disponibles en los datos")
                 
-                mask = pd.Series(True, index=recientes_df.index)
+                # El servidor filtra y agrega; sólo recibimos los puntos a graficar
+                timeline_params = {"granularity": granularity, "tipo": tipo_option}
                 if selected_desc:
-                    mask &= recientes_df['descripcion'].isin(selected_desc)
-                if tipo_option != 'both':
-                    mask &= recientes_df['tipo'] == tipo_option
+                    timeline_params["descripcion"] = selected_desc
                 if start_date and end_date:
-                    # compare using timestamps to match 'fecha' dtype
-                    mask &= recientes_df['fecha'].between(pd.to_datetime(start_date), pd.to_datetime(end_date))
+                    timeline_params["start"] = str(start_date)
+                    timeline_params["end"] = str(end_date)
+                totals = get_api_timeline(timeline_params)
                 
-                plot_df = recientes_df[mask].sort_values('fecha')
-                
-                if plot_df.empty:
+                if totals is None or totals.empty:
                     st.info("No hay transacciones con los filtros seleccionados.")
                 else:
-                    # Aggregate data by date and description
-                    daily_totals = (plot_df
-                        .groupby(['fecha', 'descripcion', 'tipo'])['monto']
-                        .sum()
-                        .reset_index())
-                    
                     # Create scatter plot with aggregated data
                     px_kwargs = {
                         "x": "fecha",
                         "y": "monto",
                         "color": "descripcion",
                         "symbol": "tipo",
-                        "title": "Total diario por descripción",
+                        "title": f"Total {granularity_labels[granularity].lower()} por descripción",
                         "labels": {
                             "fecha": "Fecha", 
                             "monto": "Monto Total ($)",
@@ -261,7 +421,7 @@ if summary_data:
                     }
 
                     fig = px.scatter(
-                        daily_totals,
+                        totals,
                         **px_kwargs
                     )
                     
@@ -285,9 +445,9 @@ if summary_data:
                     
                     # Show aggregated data table
                     st.divider()
-                    st.subheader("Totales Diarios")
+                    st.subheader(f"Totales ({granularity_labels[granularity]})")
                     st.dataframe(
-                        daily_totals.sort_values(['fecha', 'descripcion']),
+                        totals,
                         use_container_width=True
                     )
             else:
@@ -328,9 +488,8 @@ if summary_data:
                 st.write(prompt)
             # Add bot response
             with st.chat_message("assistant"):
-                with st.spinner("Pensando..."):
-                    response = ask_api_cfo(prompt)
-                st.write(response)
+                # Se muestra cada fragmento conforme llega del servidor
+                response = st.write_stream(stream_api_cfo(prompt))
             st.session_state.messages.append({"role": "assistant", "content": response})
 
             st.rerun()
@@ -389,17 +548,14 @@ if summary_data:
             if not sim_category and not sim_income_desc:
                 st.warning("Por favor, rellena al menos una simulación (gasto o ingreso).")
             else:
-                with st.spinner("El CFO Virtual está calculando el futuro..."):
+                with st.spinner("Calculando escenarios..."):
                     sim_response = post_api_simulation(params_to_send)
 
                 if sim_response:
                     if "error" in sim_response:
                         st.error(sim_response["error"])
                     else:
-                        st.subheader("Análisis del CFO Virtual")
-                        st.markdown(sim_response.get("ai_analysis", "No se recibió análisis."))
-
-                        st.divider()
+                        # Los números llegan de inmediato; el análisis de IA después
                         st.subheader("Comparación de Escenarios")
 
                         original_neto = sim_response.get("original_summary", {}).get("flujo_neto_total", 0)
@@ -415,5 +571,71 @@ if summary_data:
                         with st.expander("Ver detalles completos (JSON)"):
                             st.json(sim_response)
 
+                        st.divider()
+                        st.subheader("Análisis del CFO Virtual")
+                        ai_analysis = sim_response.get("ai_analysis")
+                        analysis_job = sim_response.get("analysis_job") or {}
+                        if ai_analysis is None and analysis_job.get("job_id"):
+                            with st.spinner("El CFO Virtual está analizando tu simulación..."):
+                                job = wait_api_job(analysis_job["job_id"])
+                            if job.get("status") == "done":
+                                ai_analysis = job.get("result")
+                            else:
+                                st.error(job.get("error") or "No se recibió análisis.")
+                        elif ai_analysis is None and analysis_job.get("error"):
+                            st.error(analysis_job["error"])
+                        if ai_analysis:
+                            st.markdown(ai_analysis)
+
+        st.divider()
+        st.subheader("Análisis de Sensibilidad")
+        st.caption("Evalúa muchas combinaciones de reducción de gastos en una sola consulta.")
+
+        with st.form(key="sweep_form"):
+            sweep_categories = st.multiselect(
+                "Categorías a evaluar",
+                options=categorias_gasto,
+                default=categorias_gasto[:3]
+            )
+            sweep_max_pct = st.slider("Reducción máxima (%)", 10, 100, 50, step=10)
+            sweep_target = st.number_input("Meta de tasa de ahorro (%)", value=20.0, step=5.0)
+            sweep_ai = st.checkbox("Incluir análisis del CFO Virtual", value=False)
+            sweep_button = st.form_submit_button("Evaluar Escenarios")
+
+        if sweep_button and sweep_categories:
+            sweep_params = {
+                "categories": sweep_categories,
+                "reduction_percentages": list(range(0, sweep_max_pct + 1, 5)),
+                "target_savings_rate": sweep_target,
+                "include_ai_analysis": sweep_ai
+            }
+            with st.spinner("Evaluando escenarios..."):
+                sweep_response = post_api_simulation_sweep(sweep_params)
+
+            if sweep_response:
+                if "error" in sweep_response:
+                    st.error(sweep_response["error"])
+                else:
+                    sweep = sweep_response["sweep"]
+                    # Superficie [categoria][porcentaje] sin aumento de ingreso
+                    tasa_df = pd.DataFrame(
+                        [[fila[0] for fila in superficie] for superficie in sweep["tasa_ahorro_pct"]],
+                        index=sweep["categories"],
+                        columns=sweep["reduction_percentages"]
+                    )
+                    fig = px.imshow(
+                        tasa_df,
+                        labels={"x": "Reducción (%)", "y": "Categoría", "color": "Tasa de ahorro (%)"},
+                        title="Tasa de ahorro por categoría y porcentaje de reducción",
+                        aspect="auto"
+                    )
+                    st.plotly_chart(fig, use_container_width=True)
+
+                    if sweep.get("best_scenarios"):
+                        st.markdown("**Mejores escenarios para tu meta**")
+                        st.dataframe(pd.DataFrame(sweep["best_scenarios"]), use_container_width=True)
+                    if sweep_response.get("ai_analysis"):
+                        st.markdown(sweep_response["ai_analysis"])
+
 else:
     st.error("No se pudo cargar la información financiera. Asegúrate de que el 'Servidor MCP' esté corriendo.")
\ No newline at end of file
@@ -0,0 +1,154 @@
+import asyncio
+import functools
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+from fastapi.responses import JSONResponse
+
+import metrics
+
+load_dotenv()
+
+# Peticiones que llegan al modelo por cliente: ritmo sostenido y ráfaga
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "20"))
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "5"))
+# Tope por dirección de origen, sumando todas sus sesiones (el X-Client-Id
+# lo elige el cliente: sólo reparte el tope del host, no lo amplía)
+RATE_LIMIT_HOST_PER_MINUTE = float(os.getenv("RATE_LIMIT_HOST_PER_MINUTE", "120"))
+RATE_LIMIT_HOST_BURST = int(os.getenv("RATE_LIMIT_HOST_BURST", "20"))
+# Llamadas al modelo esperando o en curso (por proceso); más allá se rechaza
+# el trabajo nuevo (los duplicados de uno en curso sí se aceptan)
+LLM_MAX_QUEUE_DEPTH = int(os.getenv("LLM_MAX_QUEUE_DEPTH", "32"))
+# Clientes de los que se recuerda el consumo (LRU)
+RATE_LIMIT_MAX_CLIENTS = 10_000
+
+REJECTED = metrics.Counter("mcp_requests_rejected", "Peticiones rechazadas para proteger al modelo, por motivo.",
+                           ("reason",))
+COALESCED = metrics.Counter("mcp_requests_coalesced",
+                            "Peticiones que se unieron a un cálculo idéntico en curso.", ("kind",))
+
+
+def client_key(request, user_id):
+    """
+    Cliente para el límite de ritmo: (host, sesión). El host es la dirección
+    de origen; la sesión es el usuario más el header X-Client-Id (ej. la
+    sesión de Streamlit, que hace todas las peticiones desde el mismo host)
+    dentro de ese host. Cambiar el header no da fichas nuevas del host.
+    """
+    host = request.client.host if request.client else "desconocido"
+    session = f"{host}/{user_id}"
+    client_id = request.headers.get("x-client-id")
+    if client_id:
+        session = f"{session}:{client_id[:64]}"
+    return host, session
+
+
+def check(client, queue_depth):
+    """
+    Admisión de una llamada nueva al modelo: None si se acepta, o (status,
+    mensaje, segundos de espera, motivo) si se rechaza. `client` es el par
+    (host, sesión) de client_key. Sólo debe llamarse cuando no hay
+    respuesta en caché ni un cálculo idéntico en curso: al aceptar se
+    consume una ficha de la sesión y una del host.
+    """
+    host, session = client
+    # La cola se revisa primero: un 503 no le cuesta una ficha al cliente
+    if queue_depth >= LLM_MAX_QUEUE_DEPTH:
+        rejected = (503, "El asistente de IA está saturado en este momento; intenta de nuevo en unos segundos.",
+                    5, "queue_full")
+    else:
+        # Primero la sesión: si ya agotó lo suyo no gasta fichas del host
+        retry_after = RATE_LIMITER.acquire(session) or HOST_RATE_LIMITER.acquire(host)
+        if not retry_after:
+            return None
+        rejected = (429, "Demasiadas consultas al asistente de IA; intenta de nuevo en unos segundos.",
+                    retry_after, "rate_limit")
+    REJECTED.inc(reason=rejected[3])
+    return rejected
+
+
+def rejection(status_code, message, retry_after=None, reason=None):
+    """Respuesta de rechazo con un mensaje claro (y Retry-After si aplica)."""
+    headers = {"Retry-After": str(max(1, math.ceil(retry_after)))} if retry_after else None
+    return JSONResponse(status_code=status_code, content={"error": message}, headers=headers)
+
+
+class RateLimiter:
+    """
+    Cubeta de fichas por cliente: `burst` peticiones seguidas y después
+    `per_minute` por minuto.
+    """
+
+    def __init__(self, per_minute=RATE_LIMIT_PER_MINUTE, burst=RATE_LIMIT_BURST,
+                 max_clients=RATE_LIMIT_MAX_CLIENTS):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()  # cliente -> (fichas, última actualización)
+        self._lock = threading.Lock()
+
+    def acquire(self, client):
+        """Regresa 0 si se permite la petición, o los segundos a esperar."""
+        if self.rate <= 0:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[client] = (tokens, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return 0 if allowed else (1 - tokens) / self.rate
+
+
+class SingleFlight:
+    """
+    Une peticiones idénticas concurrentes: la primera con una llave inicia
+    el cálculo y las demás esperan el mismo resultado (o el mismo error).
+    El cálculo sólo se cancela si todas las peticiones que lo esperan se
+    cancelan (ej. todos los clientes se desconectaron).
+    """
+
+    def __init__(self):
+        self._flights = {}  # llave -> [tarea, peticiones esperando]
+
+    def __contains__(self, key):
+        return key in self._flights
+
+    def __len__(self):
+        return len(self._flights)
+
+    def _forget(self, key, flight, *_):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    async def run(self, key, make_coro, kind="default"):
+        """Resultado de `make_coro()` para `key`, compartido con las peticiones simultáneas."""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = [asyncio.ensure_future(make_coro()), 0]
+            self._flights[key] = flight
+            flight[0].add_done_callback(functools.partial(self._forget, key, flight))
+        else:
+            COALESCED.inc(kind=kind)
+        flight[1] += 1
+        try:
+            return await asyncio.shield(flight[0])
+        finally:
+            flight[1] -= 1
+            if flight[1] == 0 and not flight[0].done():
+                # Nadie espera ya el resultado: se libera el lugar en el modelo
+                self._forget(key, flight)
+                flight[0].cancel()
+
+
+RATE_LIMITER = RateLimiter()
+HOST_RATE_LIMITER = RateLimiter(RATE_LIMIT_HOST_PER_MINUTE, RATE_LIMIT_HOST_BURST)
+FLIGHTS = SingleFlight()
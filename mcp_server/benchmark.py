@@ -0,0 +1,240 @@
+"""
+Benchmarks de los caminos críticos del servidor MCP con datos sintéticos.
+
+    python benchmark.py --sizes 100000,1000000 --repeats 5 --out bench_results.json
+    python benchmark.py --compare bench_anterior.json --out bench_results.json
+
+Para cada tamaño genera (o reutiliza) un CSV con synthetic_data, mide
+tiempo (mediana/mín/máx de `repeats` corridas) y memoria pico (una corrida
+aparte con tracemalloc) de las funciones y endpoints, con Gemini
+reemplazado por un stub. Los resultados se guardan en JSON junto con el
+commit de git, para comparar entre commits.
+"""
+import argparse
+import asyncio
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Antes de importar main: sin vigilancia de archivos, con la carga del CSV
+# default terminada antes de publicar los datos sintéticos y sin límite de
+# ritmo (mide la latencia de cada endpoint, no el límite)
+os.environ.setdefault("DATA_WATCH", "0")
+os.environ["DATA_BACKGROUND_LOAD"] = "0"
+os.environ.setdefault("RATE_LIMIT_PER_MINUTE", "0")
+
+import numpy as np
+import pandas as pd
+
+import data_loader
+import data_store
+import financial_logic
+import synthetic_data
+
+DEFAULT_SIZES = (100_000, 1_000_000)
+# Si la mediana empeora más que esto respecto a --compare, se marca
+REGRESSION_THRESHOLD = 1.2
+
+
+# Escenario de /simulate (categorías y conceptos de synthetic_data)
+SIMULATION = {
+    "category_to_reduce": "Restaurantes",
+    "reduction_percentage": 20.0,
+    "income_to_increase": "Nómina mensual",
+    "increase_amount": 1000.0,
+}
+
+
+def measure(fn, repeats):
+    """Corre `fn` `repeats` veces (tiempo) y una vez más con tracemalloc (memoria pico)."""
+    times = []
+    for _ in range(repeats):
+        gc.collect()
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "repeats": repeats,
+        "median_s": round(statistics.median(times), 6),
+        "min_s": round(min(times), 6),
+        "max_s": round(max(times), 6),
+        "peak_mb": round(peak / 1024 / 1024, 2),
+    }
+
+
+def _stub_llm():
+    """Reemplaza Gemini por el backend falso sin latencia."""
+    import gemini_client
+
+    gemini_client.use_backend(gemini_client.FakeBackend(latency=0, jitter=0, tokens_per_second=0, seed=0))
+
+
+def function_benchmarks(path, repeats):
+    """Funciones de carga y cálculo sobre el DataFrame compacto."""
+    import main
+
+    results = {}
+    snapshot_dir = data_loader.SNAPSHOT_DIR
+
+    # Carga desde el CSV (sin snapshot) y desde el snapshot binario
+    data_loader.SNAPSHOT_DIR = ""
+    results["load_user_data"] = measure(lambda: data_loader.load_user_data(path), repeats)
+    data_loader.SNAPSHOT_DIR = snapshot_dir
+    data_loader.load_user_data(path)
+    results["load_user_data_snapshot"] = measure(lambda: data_loader.load_user_data(path), repeats)
+
+    df = data_loader.load_user_data(path)
+    params = main.SimulationRequest(**SIMULATION)
+    results["get_financial_summary"] = measure(lambda: financial_logic.get_financial_summary(df), repeats)
+    results["build_snapshot"] = measure(lambda: data_store.build_snapshot(df, 1), repeats)
+    results["apply_simulation"] = measure(lambda: financial_logic.apply_simulation(df, params), repeats)
+    rollup = financial_logic.build_rollup(df)
+    results["simulate_summary"] = measure(lambda: financial_logic.simulate_summary(rollup, params), repeats)
+    results["summary_from_rollup_range"] = measure(
+        lambda: financial_logic.summary_from_rollup(rollup, start="2023-03-01", end="2024-02-29"), repeats)
+    return results, df
+
+
+def endpoint_benchmarks(df, repeats):
+    """Endpoints por ASGI (sin red), con los datos ya publicados."""
+    import httpx
+    import http_cache
+    import main
+    import response_cache
+
+    _stub_llm()
+    data_store.replace(df, {"status": "ready", "source": "benchmark"})
+    requests = {
+        "GET /summary": ("GET", "/api/v1/summary", None),
+        "GET /summary?start&end": ("GET", "/api/v1/summary?start=2023-03-01&end=2024-02-29", None),
+        "GET /all_transactions": ("GET", "/api/v1/all_transactions", None),
+        "GET /all_transactions?limit=1000": ("GET", "/api/v1/all_transactions?limit=1000&tipo=gasto", None),
+        "GET /all_transactions?format=ndjson": ("GET", "/api/v1/all_transactions?format=ndjson", None),
+        "GET /all_transactions?format=arrow": ("GET", "/api/v1/all_transactions?format=arrow", None),
+        "GET /timeline?granularity=month": ("GET", "/api/v1/timeline?granularity=month", None),
+        "POST /simulate": ("POST", "/api/v1/simulate", SIMULATION),
+        "POST /ask": ("POST", "/api/v1/ask", {"question": "¿Cuánto gasté en Walmart en marzo?"}),
+    }
+
+    loop = asyncio.new_event_loop()
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench")
+
+    def call(method, url, body, cold):
+        if cold:
+            # Sin respuestas pre-serializadas ni respuestas de IA en caché
+            http_cache.CACHE = http_cache.EncodedResponseCache()
+            response_cache.CACHE.invalidate()
+        # Los prints del servidor no se mezclan con el reporte
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = loop.run_until_complete(client.request(method, url, json=body))
+        response.raise_for_status()
+        return len(response.content)
+
+    results = {}
+    try:
+        for name, (method, url, body) in requests.items():
+            size = call(method, url, body, cold=True)
+            results[f"{name} (cold)"] = {**measure(lambda: call(method, url, body, True), repeats), "response_bytes": size}
+            results[f"{name} (warm)"] = {**measure(lambda: call(method, url, body, False), repeats), "response_bytes": size}
+    finally:
+        loop.run_until_complete(client.aclose())
+        loop.close()
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, repeats, data_dir, only=None):
+    results = []
+    for rows in sizes:
+        path = os.path.join(data_dir, f"sintetico_{rows}.csv")
+        if not os.path.exists(path):
+            print(f"Generando {rows} transacciones en {path}...")
+            synthetic_data.write_csv(path, rows)
+        print(f"--- {rows} filas ---")
+        function_results, df = function_benchmarks(path, repeats)
+        measured = {**function_results, **endpoint_benchmarks(df, repeats)}
+        for name, result in measured.items():
+            if only and not any(o in name for o in only):
+                continue
+            print(f"{name:45s} mediana {result['median_s'] * 1000:10.2f} ms  pico {result['peak_mb']:8.1f} MB")
+            results.append({"name": name, "rows": rows, **result})
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "repeats": repeats,
+        },
+        "results": results,
+    }
+
+
+def compare(old, new, threshold=REGRESSION_THRESHOLD):
+    """Imprime la razón nueva/anterior de cada mediana; regresa las regresiones."""
+    previous = {(r["name"], r["rows"]): r for r in old["results"]}
+    regressions = []
+    print(f"Comparando contra {old['meta'].get('git_commit')}")
+    for result in new["results"]:
+        before = previous.get((result["name"], result["rows"]))
+        if before is None or not before["median_s"]:
+            continue
+        ratio = result["median_s"] / before["median_s"]
+        flag = "  <-- regresión" if ratio > threshold else ""
+        print(f"{result['name']:45s} {result['rows']:>9d}  x{ratio:5.2f}{flag}")
+        if ratio > threshold:
+            regressions.append({**result, "ratio": round(ratio, 3)})
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks del servidor MCP con datos sintéticos.")
+    parser.add_argument("--sizes", default=",".join(str(s) for s in DEFAULT_SIZES),
+                        help="filas por corrida, separadas por comas (ej. 100000,1000000,10000000)")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "mcp_bench"))
+    parser.add_argument("--only", default="", help="sólo reportar los benchmarks cuyo nombre contenga alguno de estos textos")
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--compare", help="resultados anteriores (JSON) contra los cuales comparar")
+    args = parser.parse_args()
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    # Los snapshots binarios de los datos sintéticos van junto a ellos
+    data_loader.SNAPSHOT_DIR = os.path.join(args.data_dir, ".snapshots")
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    only = [o.strip() for o in args.only.split(",") if o.strip()]
+
+    report = run(sizes, args.repeats, args.data_dir, only)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Resultados guardados en {args.out}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(json.load(f), report)
+        sys.exit(1 if regressions else 0)
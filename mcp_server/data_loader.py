@@ -1,28 +1,599 @@
+import codecs
+import hashlib
+import json
+import os
+from contextlib import contextmanager
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin lock entre procesos
+    fcntl = None
 
 DATA_FILE = 'finanzas_personales.xlsx - in.csv'
 
-def load_user_data():
+# Directorio para los snapshots ya procesados del archivo de datos.
+# Vacío = siempre reparsear el CSV.
+SNAPSHOT_DIR = os.getenv("DATA_SNAPSHOT_DIR", ".snapshots")
+# Subir este número cuando cambie la limpieza de datos (invalida snapshots)
+SNAPSHOT_FORMAT_VERSION = 8
+
+# Filas por bloque al leer el CSV: la memoria pico depende de este número,
+# no del tamaño del archivo
+CSV_CHUNK_ROWS = int(os.getenv("DATA_CSV_CHUNK_ROWS", "100000"))
+# Cuántas filas rechazadas se guardan como muestra en el reporte de carga
+REJECTED_SAMPLE_SIZE = 20
+
+# Secuencias típicas de UTF-8 decodificado como latin1/cp1252 ('Ã³' en lugar de 'ó')
+_MOJIBAKE_MARKERS = ('Ã', 'Â', 'â€')
+
+def detect_encoding(path, sample_bytes=1 << 20):
+    """
+    Detecta la codificación del archivo a partir de su primer MB: UTF-8 (con
+    o sin BOM) si esa muestra es UTF-8 válido, si no latin1 (lo que exportan
+    Excel y los bancos en español). Es sólo una estimación: un archivo latin1
+    cuyo primer MB es ASCII se detecta como UTF-8 (ver iter_csv_chunks).
+    """
+    with open(path, 'rb') as f:
+        sample = f.read(sample_bytes)
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
     try:
-        # Lee el archivo CSV
-        df = pd.read_csv(DATA_FILE, encoding='latin1')
-        
-        # --- Limpieza de Datos Esencial ---
-        # Convertir 'fecha' a objetos datetime
-        df['fecha'] = pd.to_datetime(df['fecha'], dayfirst=False, errors='coerce')
-        
-        # Convertir 'monto' a numérico
-        df['monto'] = pd.to_numeric(df['monto'], errors='coerce')
-        
-        # Manejar filas con valores nulos si es necesario
-        df = df.dropna(subset=['fecha', 'monto', 'tipo'])
-        
-        # Asegurar que los gastos sean negativos (un estándar común)
-        # O podemos simplemente confiar en la columna 'tipo'
+        # Decodificador incremental: tolera un carácter cortado al final de la muestra
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'latin1'
+
+def repair_mojibake(text):
+    """
+    Repara texto UTF-8 que se decodificó como latin1/cp1252 ('NÃ³mina' ->
+    'Nómina'), incluso si pasó por eso dos veces. Si el texto no se puede
+    reinterpretar como UTF-8 válido, se regresa sin cambios.
+    """
+    if not isinstance(text, str):
+        return text
+    for _ in range(2):
+        if not any(marker in text for marker in _MOJIBAKE_MARKERS):
+            break
+        for codec in ('cp1252', 'latin1'):
+            try:
+                text = text.encode(codec).decode('utf-8')
+                break
+            except UnicodeError:
+                continue
+        else:
+            break
+    return text
+
+def _repair_text_columns(chunk):
+    for column in chunk.columns:
+        if chunk[column].dtype != object:
+            continue
+        # Sólo se revisan los valores distintos del bloque, no cada fila
+        mapping = {}
+        for value in chunk[column].dropna().unique():
+            repaired = repair_mojibake(value)
+            if repaired != value:
+                mapping[value] = repaired
+        if mapping:
+            chunk[column] = chunk[column].replace(mapping)
+    return chunk
+
+def _clean_chunk(chunk, report):
+    """Limpia un bloque del CSV y registra en `report` las filas rechazadas."""
+    chunk = _repair_text_columns(chunk)
+
+    # --- Limpieza de Datos Esencial ---
+    # Convertir 'fecha' a objetos datetime
+    fechas = pd.to_datetime(chunk['fecha'], dayfirst=False, errors='coerce')
+
+    # Convertir 'monto' a numérico
+    montos = pd.to_numeric(chunk['monto'], errors='coerce')
+
+    # Filas sin fecha, monto o tipo válidos se descartan (y se reportan)
+    motivos = pd.Series('', index=chunk.index)
+    motivos[chunk['tipo'].isna()] = 'tipo vacío'
+    motivos[montos.isna()] = 'monto inválido'
+    motivos[fechas.isna()] = 'fecha inválida'
+    rechazadas = motivos != ''
+    if rechazadas.any():
+        report['rejected_rows'] += int(rechazadas.sum())
+        for index in chunk.index[rechazadas]:
+            if len(report['rejected_sample']) >= REJECTED_SAMPLE_SIZE:
+                break
+            report['rejected_sample'].append({
+                # +2: el encabezado es la línea 1 y el índice empieza en 0
+                "linea": int(index) + 2,
+                "motivo": motivos[index],
+                "fila": {k: (None if pd.isna(v) else v) for k, v in chunk.loc[index].items()},
+            })
+
+    chunk = chunk.assign(fecha=fechas, monto=montos)[~rechazadas]
+    return compact_transactions(chunk)
+
+def iter_csv_chunks(path, report=None, chunk_rows=None):
+    """
+    Lee el CSV en bloques de `chunk_rows` filas y produce cada bloque ya
+    limpio y en el esquema compacto. Detecta la codificación, repara texto
+    mal codificado y acumula en `report` (dict) las filas leídas y rechazadas.
+
+    Si el archivo parecía UTF-8 pero más adelante trae un byte inválido (ej.
+    latin1 cuyo primer MB es ASCII), la lectura se retoma como latin1 desde
+    el bloque que falló: los bloques ya producidos eran UTF-8 válido y se
+    leen igual en latin1, así que no se reemplaza ningún carácter.
+    """
+    report = report if report is not None else {}
+    encoding = detect_encoding(path)
+    report.update({"encoding": encoding, "rows_read": 0, "rejected_rows": 0, "rejected_sample": []})
+    skipped = 0
+    while True:
+        reader = pd.read_csv(
+            path,
+            encoding=encoding,
+            dtype=str,
+            chunksize=chunk_rows or CSV_CHUNK_ROWS,
+            # Al reintentar: se saltan las filas ya producidas (la 0 es el encabezado)
+            skiprows=(lambda line: 0 < line <= skipped) if skipped else None,
+        )
+        try:
+            with reader:
+                for chunk in reader:
+                    # Índices como si se hubiera leído de corrido (para el reporte)
+                    chunk.index += skipped
+                    report['rows_read'] += len(chunk)
+                    yield _clean_chunk(chunk, report)
+            return
+        except UnicodeDecodeError:
+            if encoding == 'latin1':
+                raise
+            print(f"El archivo no es UTF-8 después de la fila {report['rows_read']}; se lee como latin1.")
+            encoding = report['encoding'] = 'latin1'
+            skipped = report['rows_read']
+
+def _parse_csv(path, report=None):
+    # Los bloques ya compactos se acumulan; el CSV nunca está completo en memoria como texto
+    chunks = list(iter_csv_chunks(path, report))
+    if not chunks:
+        return pd.DataFrame(columns=COLUMNS)
+    # Cada bloque se libera en cuanto se copia al resultado
+    return concat_transactions(chunks, release=True)
+
+def load_user_data(path=None, report=None):
+    """
+    Carga y limpia el archivo de transacciones.
+
+    Si existe un snapshot binario del mismo archivo -misma ruta, tamaño y
+    fecha de modificación- se mapea en memoria en lugar de volver a
+    parsear el CSV. Si no, se parsea por bloques y se guarda el snapshot
+    para la próxima.
+
+    report: (opcional) dict que se llena con la codificación detectada y
+    las filas leídas/rechazadas (también se guarda en el snapshot).
+    """
+    path = path or DATA_FILE
+    report = report if report is not None else {}
+    try:
+        df = _read_frame_snapshot(path, report)
+        if df is not None:
+            print(f"Datos cargados desde snapshot: {df.shape[0]} transacciones.")
+            return df
+
+        df = _parse_csv(path, report)
+        _write_frame_snapshot(path, df, report)
         
-        print(f"Datos cargados y limpios: {df.shape[0]} transacciones.")
+        print(f"Datos cargados y limpios: {df.shape[0]} transacciones "
+              f"({report['rejected_rows']} filas rechazadas, codificación {report['encoding']}).")
         return df
 
     except FileNotFoundError:
-        print(f"Error: No se encontró el archivo {DATA_FILE}")
-        return pd.DataFrame() # Retorna un DataFrame vacío en caso de error
\ No newline at end of file
+        print(f"Error: No se encontró el archivo {path}")
+        return pd.DataFrame() # Retorna un DataFrame vacío en caso de error
+
+# --- Snapshots del archivo ya procesado ---
+
+def _snapshot_prefix(path):
+    return hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:16]
+
+def _snapshot_base(path):
+    """Ruta base del snapshot: identifica ruta + tamaño + mtime del archivo fuente."""
+    if not SNAPSHOT_DIR:
+        return None
+    stat = os.stat(path)
+    version = f"{stat.st_size}-{stat.st_mtime_ns}-{SNAPSHOT_FORMAT_VERSION}"
+    digest = hashlib.sha1(version.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(SNAPSHOT_DIR, f"{_snapshot_prefix(path)}-{digest}")
+
+def _atomic_write(target, write):
+    tmp = f"{target}.tmp{os.getpid()}"
+    write(tmp)
+    try:
+        os.replace(tmp, target)
+    except PermissionError:
+        # Windows: otro proceso tiene abierto el destino. El nombre identifica
+        # el contenido, así que el archivo que ya está sirve igual.
+        os.remove(tmp)
+        if not os.path.exists(target):
+            raise
+
+def _remove_stale_snapshots(path, keep_base):
+    prefix = _snapshot_prefix(path) + "-"
+    for entry in os.scandir(SNAPSHOT_DIR):
+        if entry.name.startswith(prefix) and not entry.path.startswith(keep_base):
+            try:
+                os.remove(entry.path)
+            except PermissionError:
+                # Windows: un worker aún lo tiene abierto; se borra en la próxima carga
+                pass
+
+# Formato de los snapshots: Arrow IPC (el formato de Feather v2), sin
+# pickle: leer un snapshot nunca ejecuta código. Cada arreglo de NumPy o
+# DataFrame del objeto guardado es una columna de una tabla de una sola fila
+# (una lista; los DataFrames, una lista de structs) y el resto de la
+# estructura (dicts, listas, escalares) va como JSON en los metadatos del
+# esquema. Al leerlo con pa.memory_map, los arreglos apuntan directamente a
+# las páginas del archivo: todos los workers que mapean el mismo snapshot
+# comparten esa memoria (page cache). En Windows un archivo mapeado no se
+# puede reemplazar ni borrar, así que ahí se lee a memoria y el archivo queda
+# cerrado.
+_STRUCTURE_KEY = b'mcp_structure'
+_MAP_FILES = os.name != 'nt'
+# Tipos de arreglo que van como columna: numéricos, booleanos y fechas
+_ARRAY_KINDS = 'biufmM'
+
+
+def _encode_node(obj, columns):
+    """Estructura JSON de `obj`; sus arreglos y DataFrames se agregan a `columns`."""
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        if obj.dtype.kind not in _ARRAY_KINDS:
+            return {"list": [_encode_node(v, columns) for v in obj.tolist()]}
+        columns.append(_one_row(pa.array(obj.ravel())))
+        return {"array": len(columns) - 1, "shape": list(obj.shape)}
+    if isinstance(obj, list):
+        return [_encode_node(v, columns) for v in obj]
+    if isinstance(obj, tuple):
+        return {"tuple": [_encode_node(v, columns) for v in obj]}
+    if isinstance(obj, dict):
+        if all(isinstance(k, str) for k in obj):
+            return {"dict": {k: _encode_node(v, columns) for k, v in obj.items()}}
+        return {"items": [[_encode_node(k, columns), _encode_node(v, columns)] for k, v in obj.items()]}
+    if isinstance(obj, pd.RangeIndex):
+        return {"range": [obj.start, obj.stop, obj.step]}
+    if isinstance(obj, pd.Index):
+        return {"index": _encode_node(obj.to_numpy(), columns)}
+    if isinstance(obj, pd.DataFrame):
+        if obj.columns.empty or not obj.columns.is_unique or not all(isinstance(c, str) for c in obj.columns):
+            raise TypeError("Sólo se guardan DataFrames con columnas de texto únicas")
+        struct = pa.StructArray.from_arrays([pa.Array.from_pandas(obj[c]) for c in obj.columns],
+                                            names=list(obj.columns))
+        columns.append(_one_row(struct))
+        return {"frame": len(columns) - 1, "index": _encode_node(obj.index, columns)}
+    raise TypeError(f"Tipo no soportado en el snapshot: {type(obj).__name__}")
+
+
+def _one_row(values):
+    return pa.ListArray.from_arrays(pa.array([0, len(values)], pa.int32()), values)
+
+
+def _column_values(array):
+    """Arreglo de NumPy (o Categorical) sobre los buffers de Arrow, sin copiarlos."""
+    if pa.types.is_dictionary(array.type):
+        # Los nulos (-1 en pandas) sí obligan a copiar los códigos
+        indices = array.indices.fill_null(-1) if array.null_count else array.indices
+        return pd.Categorical.from_codes(
+            indices.to_numpy(),
+            categories=pd.Index(array.dictionary.to_pandas()),
+            ordered=array.type.ordered,
+            validate=False,
+        )
+    return array.to_numpy(zero_copy_only=False)
+
+
+def _decode_node(node, columns):
+    if not isinstance(node, (dict, list)):
+        return node
+    if isinstance(node, list):
+        return [_decode_node(v, columns) for v in node]
+    if "array" in node:
+        return _column_values(columns[node["array"]]).reshape(node["shape"])
+    if "frame" in node:
+        struct = columns[node["frame"]]
+        values = {field.name: _column_values(array) for field, array in zip(struct.type, struct.flatten())}
+        # copy=False: las columnas siguen apuntando al archivo mapeado
+        return pd.DataFrame(values, index=_decode_node(node["index"], columns), copy=False)
+    (tag, value), = node.items()
+    if tag == "list":
+        return np.array([_decode_node(v, columns) for v in value], dtype=object)
+    if tag == "tuple":
+        return tuple(_decode_node(v, columns) for v in value)
+    if tag == "dict":
+        return {k: _decode_node(v, columns) for k, v in value.items()}
+    if tag == "items":
+        return {_decode_node(k, columns): _decode_node(v, columns) for k, v in value}
+    if tag == "range":
+        return pd.RangeIndex(*value)
+    if tag == "index":
+        return pd.Index(_decode_node(value, columns))
+    raise ValueError(f"Nodo desconocido en el snapshot: {tag}")
+
+
+def _write_arrow(target, obj):
+    columns = []
+    structure = _encode_node(obj, columns)
+    table = pa.Table.from_arrays(columns, names=[str(i) for i in range(len(columns))],
+                                 metadata={_STRUCTURE_KEY: json.dumps(structure, ensure_ascii=False)})
+
+    def write(tmp):
+        with pa.OSFile(tmp, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+    _atomic_write(target, write)
+
+def _read_arrow(source):
+    """Lee (mapeado, de sólo lectura) un archivo escrito por _write_arrow y regresa el objeto."""
+    if _MAP_FILES:
+        with pa.memory_map(str(source)) as f:
+            table = pa.ipc.open_file(f).read_all()
+    else:
+        with open(source, 'rb') as f:
+            table = pa.ipc.open_file(pa.py_buffer(f.read())).read_all()
+    structure = (table.schema.metadata or {}).get(_STRUCTURE_KEY)
+    if structure is None or table.num_rows != 1:
+        raise ValueError(f"{source} no es un snapshot válido")
+    # Una sola fila: cada columna es la lista con el arreglo (o DataFrame)
+    columns = [column.chunk(0).flatten() for column in table.columns]
+    return _decode_node(json.loads(structure), columns)
+
+def _read_frame_snapshot(path, report):
+    base = _snapshot_base(path)
+    if base is None or not os.path.exists(base + ".frame"):
+        return None
+    try:
+        # Mapeado: las columnas no se copian al leer
+        snapshot = _read_arrow(base + ".frame")
+        report.update(snapshot["report"])
+        return snapshot["df"]
+    except Exception as e:
+        print(f"No se pudo leer el snapshot de datos ({e}); se reparsea el CSV.")
+        return None
+
+def _write_frame_snapshot(path, df, report):
+    base = _snapshot_base(path)
+    if base is None:
+        return
+    try:
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        _remove_stale_snapshots(path, base)
+        # El reporte de la carga viaja con el snapshot
+        _write_arrow(base + ".frame", {"df": df, "report": report})
+    except Exception as e:
+        print(f"No se pudo guardar el snapshot de datos: {e}")
+
+def read_derived_snapshot(path=None):
+    """
+    Regresa los datos derivados (rollups, resumen) guardados para la versión
+    actual del archivo, o None. Sus arreglos quedan mapeados en memoria
+    (sólo lectura).
+    """
+    path = path or DATA_FILE
+    try:
+        base = _snapshot_base(path)
+        if base is None or not os.path.exists(base + ".derived"):
+            return None
+        return _read_arrow(base + ".derived")
+    except (FileNotFoundError, OSError):
+        return None
+    except Exception as e:
+        print(f"No se pudo leer el snapshot de derivados: {e}")
+        return None
+
+def write_derived_snapshot(derived, path=None):
+    """Guarda los datos derivados junto al snapshot del DataFrame."""
+    path = path or DATA_FILE
+    try:
+        base = _snapshot_base(path)
+        if base is None:
+            return
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        _write_arrow(base + ".derived", derived)
+    except Exception as e:
+        print(f"No se pudo guardar el snapshot de derivados: {e}")
+
+@contextmanager
+def publish_lock(path=None):
+    """
+    Lock entre procesos (workers de uvicorn) sobre el archivo de datos: el
+    primero que lo toma parsea y publica los snapshots; los demás esperan y
+    luego sólo los mapean. Sin SNAPSHOT_DIR (o sin fcntl) no bloquea.
+    """
+    path = path or DATA_FILE
+    if not SNAPSHOT_DIR or fcntl is None:
+        yield
+        return
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    with open(os.path.join(SNAPSHOT_DIR, _snapshot_prefix(path) + ".lock"), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def publish_version(path=None):
+    """
+    Handle versionado de los datos publicados: un número que sube cada vez
+    que cambia el archivo fuente y que todos los workers leen igual (el
+    primero en ver una versión nueva del archivo la registra). Llamar con
+    publish_lock tomado. Regresa None si no hay SNAPSHOT_DIR.
+    """
+    path = path or DATA_FILE
+    try:
+        base = _snapshot_base(path)
+    except OSError:
+        return None
+    if base is None:
+        return None
+    handle = os.path.join(SNAPSHOT_DIR, _snapshot_prefix(path) + ".current")
+    try:
+        with open(handle, encoding='utf-8') as f:
+            current = json.load(f)
+    except (OSError, ValueError):
+        current = {"version": 0, "base": None}
+    if current["base"] == os.path.basename(base):
+        return current["version"]
+    current = {"version": current["version"] + 1, "base": os.path.basename(base)}
+
+    def write(tmp):
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(current, f)
+
+    _atomic_write(handle, write)
+    return current["version"]
+
+# Columnas del archivo de transacciones, en orden
+COLUMNS = ['fecha', 'descripcion', 'categoria', 'monto', 'tipo']
+
+# --- Representación compacta en memoria ---
+#
+# Los DataFrames de transacciones que circulan por el servidor usan:
+# - 'fecha': int32, número de día desde 1970-01-01.
+# - 'monto': int64, en centavos (totales exactos, sin error de punto flotante).
+# - 'descripcion', 'categoria', 'tipo': categóricas (códigos + diccionario),
+#   así las máscaras y los groupby comparan enteros en lugar de strings.
+# public_transactions convierte de regreso al esquema original para la API.
+
+CENTS = 100
+TEXT_COLUMNS = ['descripcion', 'categoria', 'tipo']
+_EPOCH = np.datetime64('1970-01-01', 'D')
+
+def amounts_to_cents(montos):
+    """Montos (float) a centavos int64, redondeando al centavo más cercano."""
+    return np.round(np.asarray(montos, dtype='float64') * CENTS).astype('int64')
+
+def cents_to_amounts(centavos):
+    """Centavos a montos float (escalar o arreglo)."""
+    if np.isscalar(centavos):
+        return centavos / CENTS
+    return np.asarray(centavos, dtype='int64') / CENTS
+
+def dates_to_days(fechas):
+    """Fechas (datetime64, Timestamp o date) a número de día int32."""
+    if np.isscalar(fechas) or not hasattr(fechas, '__len__'):
+        return int((np.datetime64(pd.Timestamp(fechas), 'D') - _EPOCH).astype('int64'))
+    dias = np.asarray(fechas, dtype='datetime64[ns]').astype('datetime64[D]')
+    return (dias - _EPOCH).astype('int32')
+
+def days_to_dates(dias):
+    """Números de día a datetime64[ns]."""
+    return (np.asarray(dias, dtype='int64').astype('timedelta64[D]') + _EPOCH).astype('datetime64[ns]')
+
+def format_days(dias):
+    """Números de día a strings 'YYYY-MM-DD' (escalar o arreglo)."""
+    if np.isscalar(dias):
+        return str(_EPOCH + np.timedelta64(int(dias), 'D'))
+    return np.datetime_as_string(np.asarray(dias, dtype='int64').astype('timedelta64[D]') + _EPOCH, unit='D')
+
+def compact_transactions(df):
+    """Convierte un DataFrame de transacciones ya limpio al esquema compacto."""
+    df = df.copy()
+    df['fecha'] = dates_to_days(df['fecha'])
+    df['monto'] = amounts_to_cents(df['monto'])
+    for column in TEXT_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype('category')
+    return df
+
+def public_transactions(df):
+    """
+    Convierte (una parte de) el DataFrame compacto al esquema original:
+    fecha datetime64, monto float y texto como strings. Sólo toca las
+    columnas presentes, así que sirve para proyecciones.
+    """
+    df = df.copy()
+    if 'fecha' in df.columns:
+        df['fecha'] = days_to_dates(df['fecha'])
+    if 'monto' in df.columns:
+        df['monto'] = cents_to_amounts(df['monto'])
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype(object)
+    return df
+
+def _codes_dtype(n_categories):
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_categories < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+def concat_transactions(frames, release=False):
+    """
+    Concatena DataFrames compactos conservando las columnas categóricas
+    (pd.concat las degrada a object si los diccionarios difieren). Las
+    categorías unidas quedan ordenadas, igual que las de astype('category').
+
+    Cada columna se escribe una sola vez en su arreglo final (los códigos
+    categóricos se traducen al diccionario unido), sin copias intermedias.
+    Con `release=True` se vacía la lista `frames` y cada bloque se suelta en
+    cuanto se copia: si quien llama no guarda otras referencias, la memoria
+    pico es el resultado más un bloque.
+    """
+    parts = [f for f in frames if f is not None]
+    if release:
+        frames.clear()
+    if len(parts) == 1:
+        return parts[0]
+    total = sum(len(p) for p in parts)
+
+    categories, outputs = {}, {}
+    for column in parts[0].columns:
+        if all(isinstance(p[column].dtype, pd.CategoricalDtype) for p in parts):
+            categories[column] = pd.api.types.union_categoricals(
+                [pd.Categorical([], categories=p[column].cat.categories) for p in parts], ignore_order=True
+            ).categories.sort_values()
+            outputs[column] = np.empty(total, dtype=_codes_dtype(len(categories[column])))
+        else:
+            dtypes = [p[column].dtype for p in parts]
+            dtype = np.result_type(*dtypes) if all(isinstance(d, np.dtype) for d in dtypes) else object
+            outputs[column] = np.empty(total, dtype=dtype)
+    if all(isinstance(p.index, pd.RangeIndex) and p.index.step == 1 for p in parts) and all(
+            a.index.stop == b.index.start for a, b in zip(parts, parts[1:])):
+        index = pd.RangeIndex(parts[0].index.start, parts[-1].index.stop)
+    else:
+        index = parts[0].index.append([p.index for p in parts[1:]])
+
+    position = 0
+    while parts:
+        part = parts.pop(0)
+        end = position + len(part)
+        for column, output in outputs.items():
+            values = part[column]
+            if column in categories:
+                # Código del bloque -> código en el diccionario unido (-1 = nulo)
+                mapping = np.append(categories[column].get_indexer(values.cat.categories), -1)
+                output[position:end] = mapping[values.cat.codes.to_numpy()]
+            else:
+                output[position:end] = values.to_numpy()
+        position = end
+        del part
+
+    columns = {
+        column: pd.Categorical.from_codes(output, dtype=pd.CategoricalDtype(categories[column]), validate=False)
+        if column in categories else output
+        for column, output in outputs.items()
+    }
+    return pd.DataFrame(columns, index=index, copy=False)
+
+def transactions_from_records(records):
+    """
+    Construye un DataFrame con el mismo esquema (compacto) que load_user_data
+    a partir de registros ya validados (dicts con las llaves de COLUMNS).
+    """
+    df = pd.DataFrame.from_records(records, columns=COLUMNS)
+    df['fecha'] = pd.to_datetime(df['fecha'])
+    df['monto'] = pd.to_numeric(df['monto'])
+    return compact_transactions(df)
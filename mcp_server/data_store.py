@@ -0,0 +1,324 @@
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+
+import pandas as pd
+from dotenv import load_dotenv
+
+import data_loader
+import financial_logic
+import metrics
+import response_cache
+import user_store
+
+load_dotenv()
+
+# Cuántas filas ingeridas se acumulan antes de consolidarlas en el DataFrame base
+INGEST_COMPACT_ROWS = 50_000
+
+# Usuario que se sirve desde el archivo de datos (DATA_FILE) cuando la
+# petición no indica otro. Los demás usuarios viven en user_store (SQLite).
+DEFAULT_USER_ID = os.getenv("DEFAULT_USER_ID", "default")
+# Cuántos usuarios (además del default) se mantienen en memoria (LRU)
+DATA_HOT_USERS = int(os.getenv("DATA_HOT_USERS", "32"))
+# Cada cuántos segundos se revisa si otro worker escribió en la partición
+# de un usuario que está en memoria
+DATA_VERSION_CHECK_SECONDS = float(os.getenv("DATA_VERSION_CHECK_SECONDS", "2"))
+
+
+@dataclass
+class Snapshot:
+    """
+    Versión inmutable de los datos que ven las peticiones.
+
+    Nunca se modifica en sitio: cada carga o ingesta construye un Snapshot
+    nuevo y lo publica de golpe, así que una petición que tomó el snapshot
+    al inicio ve datos consistentes hasta el final, aunque llegue otro.
+
+    Las filas ingeridas recientemente se guardan aparte (`tail`) para no
+    copiar todo el historial en cada ingesta; `df` las une bajo demanda.
+    """
+    base_df: pd.DataFrame = None
+    tail: tuple = ()
+    rollup: dict = None
+    context: dict = None
+    timeline: dict = None
+    version: int = 0
+    meta: dict = field(default_factory=dict)
+    user_id: str = DEFAULT_USER_ID
+
+    @functools.cached_property
+    def df(self):
+        if self.base_df is None or not self.tail:
+            return self.base_df
+        return data_loader.concat_transactions([self.base_df, *self.tail])
+
+    @property
+    def loaded(self):
+        return self.base_df is not None
+
+    @property
+    def has_data(self):
+        """Hay al menos una transacción (ni cargando ni partición vacía)."""
+        return self.loaded and (len(self.base_df) > 0 or bool(self.tail))
+
+    @functools.cached_property
+    def fingerprint(self):
+        """Huella del contexto: distingue snapshots con el mismo número de versión."""
+        return response_cache.context_fingerprint(self.context)
+
+
+_lock = threading.Lock()
+# Snapshot del usuario default (archivo de datos): siempre en memoria
+_current = Snapshot(context={"error": "Los datos no están cargados."}, meta={"status": "loading"})
+# Snapshots de los demás usuarios, del menos al más recientemente usado
+_hot = OrderedDict()
+# Un lock por usuario: una sola carga/escritura a la vez por partición
+_user_locks = {}
+# Última vez (time.monotonic) que se confirmó la versión de cada usuario en memoria
+_checked_at = {}
+
+
+def _is_default(user_id):
+    return user_id is None or user_id == DEFAULT_USER_ID
+
+
+def _user_lock(user_id):
+    with _lock:
+        return _user_locks.setdefault(user_id, threading.Lock())
+
+
+def cached(user_id=None):
+    """
+    Snapshot del usuario si ya está en memoria y su versión se confirmó
+    hace poco (sin tocar la base), o None.
+    """
+    if _is_default(user_id):
+        return _current
+    with _lock:
+        snapshot = _hot.get(user_id)
+        if snapshot is None:
+            return None
+        if time.monotonic() - _checked_at.get(user_id, 0) > DATA_VERSION_CHECK_SECONDS:
+            return None
+        _hot.move_to_end(user_id)
+        return snapshot
+
+
+def current(user_id=None):
+    """
+    Snapshot vigente del usuario. Las peticiones deben leerlo UNA vez y usar
+    esa referencia. Si el usuario no está en memoria se carga sólo su
+    partición y se agrega al LRU (puede tardar: llamar fuera del event loop).
+    """
+    snapshot = cached(user_id)
+    if snapshot is not None:
+        return snapshot
+    if not _is_default(user_id) and user_store.version(user_id) == 0:
+        # Usuario sin transacciones (ej. un user_id que no existe): no ocupa
+        # lugar en el LRU ni se le crea un lock
+        return Snapshot(context={"error": "No hay datos"}, meta={"status": "empty"}, user_id=user_id)
+    with _user_lock(user_id):
+        # Otra petición pudo haberlo cargado mientras esperábamos
+        snapshot = cached(user_id)
+        if snapshot is not None:
+            return snapshot
+        with _lock:
+            snapshot = _hot.get(user_id)
+        if snapshot is not None and snapshot.loaded:
+            # Con varios workers, otro proceso pudo agregar transacciones:
+            # sólo se leen las filas nuevas
+            version = user_store.version(user_id)
+            if version == snapshot.version:
+                _checked_at[user_id] = time.monotonic()
+                return snapshot
+            new_df, version = user_store.load_partition(user_id, after_id=_last_index(snapshot))
+            if not new_df.empty:
+                return _publish(_appended(snapshot, new_df, version))
+        return _publish(_load_partition(user_id))
+
+
+def _last_index(snapshot):
+    if snapshot.tail:
+        return snapshot.tail[-1].index[-1]
+    return snapshot.base_df.index.max() if len(snapshot.base_df) else -1
+
+
+def _load_partition(user_id):
+    """Construye el snapshot de un usuario desde su partición (llamar con su lock tomado)."""
+    started = time.perf_counter()
+    with metrics.span("data_load"):
+        df, version = user_store.load_partition(user_id)
+    return build_snapshot(df, version, user_id=user_id, meta={
+        "status": "ready",
+        "source": user_store.USER_DB_PATH,
+        "loaded_at": datetime.now().isoformat(timespec='seconds'),
+        "load_seconds": round(time.perf_counter() - started, 3),
+    })
+
+
+def _publish(snapshot):
+    global _current
+    if _is_default(snapshot.user_id):
+        _current = snapshot
+        return snapshot
+    with _lock:
+        _hot[snapshot.user_id] = snapshot
+        _hot.move_to_end(snapshot.user_id)
+        _checked_at[snapshot.user_id] = time.monotonic()
+        # La memoria crece con los usuarios activos, no con los totales
+        while len(_hot) > DATA_HOT_USERS:
+            evicted, _ = _hot.popitem(last=False)
+            _checked_at.pop(evicted, None)
+    return snapshot
+
+
+def stats():
+    with _lock:
+        return {"default_user": DEFAULT_USER_ID, "hot_users": len(_hot), "max_hot_users": DATA_HOT_USERS}
+
+
+def build_snapshot(df, version, meta=None, user_id=DEFAULT_USER_ID):
+    """Calcula rollups, resumen y línea del tiempo para un DataFrame completo."""
+    # Rollup calculado en una pasada: el resumen, los rangos de fechas y
+    # las simulaciones se derivan de él sin volver a recorrer las filas
+    with metrics.span("summary"):
+        rollup = financial_logic.build_rollup(df)
+        context = financial_logic.summary_from_rollup(rollup)
+        # Rollups diarios/semanales/mensuales para la línea del tiempo
+        timeline = financial_logic.build_timeline_rollups(df)
+    return Snapshot(
+        base_df=df,
+        rollup=rollup,
+        context=context,
+        timeline=timeline,
+        version=version,
+        meta=meta or {},
+        user_id=user_id,
+    )
+
+
+def replace(df, meta=None):
+    """Publica un DataFrame completo como nueva versión de los datos del usuario default."""
+    with _user_lock(DEFAULT_USER_ID):
+        return _publish(build_snapshot(df, _current.version + 1, meta))
+
+
+def fail(message):
+    """Publica un snapshot vacío con un mensaje de error (usuario default)."""
+    with _user_lock(DEFAULT_USER_ID):
+        return _publish(Snapshot(
+            context={"error": message},
+            version=_current.version + 1,
+            meta={"status": "error", "error": message},
+        ))
+
+
+def load_file(path=None):
+    """
+    Carga el archivo de datos y publica el snapshot resultante como los
+    datos del usuario default.
+
+    Si el cargador tiene guardados los derivados (rollups, resumen, línea del
+    tiempo) de esta misma versión del archivo, se reutilizan y el arranque
+    no recorre las filas; si no, se calculan y se guardan para la próxima.
+
+    Con varios workers, sólo el primero parsea y publica (lock entre
+    procesos); los demás mapean los mismos archivos y comparten su memoria.
+    """
+    started = time.perf_counter()
+    with data_loader.publish_lock(path):
+        snapshot, meta = _load_file_locked(path)
+        published = data_loader.publish_version(path)
+
+    meta["load_seconds"] = round(time.perf_counter() - started, 3)
+    with _user_lock(DEFAULT_USER_ID):
+        # La versión publicada es la misma en todos los workers
+        if published is not None and published > _current.version:
+            snapshot.version = published
+        else:
+            snapshot.version = _current.version + 1
+        snapshot.meta = meta
+        return _publish(snapshot)
+
+
+def _load_file_locked(path):
+    report = {}
+    with metrics.span("data_load"):
+        df = data_loader.load_user_data(path, report)
+        derived = data_loader.read_derived_snapshot(path)
+
+    meta = {
+        "status": "ready",
+        "source": path or data_loader.DATA_FILE,
+        "loaded_at": datetime.now().isoformat(timespec='seconds'),
+        "from_snapshot": derived is not None,
+        # Codificación detectada y filas rechazadas al parsear el CSV
+        "ingest": report,
+    }
+    if derived is not None and derived.get("conteo") == len(df):
+        snapshot = Snapshot(
+            base_df=df,
+            rollup=derived["rollup"],
+            context=derived["context"],
+            timeline=derived["timeline"],
+        )
+    else:
+        meta["from_snapshot"] = False
+        snapshot = build_snapshot(df, 0)
+        if not df.empty:
+            data_loader.write_derived_snapshot({
+                "conteo": len(df),
+                "rollup": snapshot.rollup,
+                "context": snapshot.context,
+                "timeline": snapshot.timeline,
+            }, path)
+    return snapshot, meta
+
+
+def append(new_df, user_id):
+    """
+    Agrega transacciones ya validadas a la partición del usuario (en
+    user_store, compartida por todos los workers) y publica un snapshot
+    nuevo, ajustando sumas, conteos, categorías, fechas y recientes de forma
+    incremental (costo proporcional a las filas nuevas y al tamaño de los
+    rollups, no al historial).
+
+    El usuario default no acepta ingestas: sus datos son el archivo.
+    """
+    if _is_default(user_id):
+        raise ValueError("El usuario default se sirve desde el archivo de datos.")
+
+    # El lock del usuario mantiene la partición y su snapshot en el mismo orden
+    with _user_lock(user_id):
+        new_df, version = user_store.append(user_id, new_df)
+        with _lock:
+            old = _hot.get(user_id)
+        if old is None or not old.loaded or version != old.version + 1:
+            # No estaba en memoria, estaba vacío u otro worker escribió antes:
+            # se carga la partición (ya con las filas nuevas)
+            return _publish(_load_partition(user_id))
+        return _publish(_appended(old, new_df, version))
+
+
+def _appended(old, new_df, version):
+    """Snapshot nuevo con `new_df` (ya con su índice final) agregado a `old`."""
+    base_df, tail = old.base_df, old.tail + (new_df,)
+    if sum(len(t) for t in tail) >= INGEST_COMPACT_ROWS:
+        base_df, tail = data_loader.concat_transactions([base_df, *tail]), ()
+
+    rollup = financial_logic.update_rollup(old.rollup, new_df)
+    return Snapshot(
+        base_df=base_df,
+        tail=tail,
+        rollup=rollup,
+        context=financial_logic.summary_from_rollup(rollup),
+        timeline=financial_logic.update_timeline_rollups(old.timeline, new_df),
+        version=version,
+        meta=old.meta,
+        user_id=old.user_id,
+    )
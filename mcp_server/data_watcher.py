@@ -0,0 +1,106 @@
+import os
+import threading
+import time
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Segundos sin nuevos eventos antes de recargar (agrupa ráfagas de escrituras)
+DATA_RELOAD_DEBOUNCE_SECONDS = float(os.getenv("DATA_RELOAD_DEBOUNCE_SECONDS", "1.0"))
+
+# Eventos de watchdog que implican que el contenido cambió
+_WRITE_EVENTS = {"modified", "created", "moved", "closed"}
+
+
+class DataFileWatcher:
+    """
+    Vigila el archivo de datos y llama a `reload_fn` cuando cambia.
+
+    - Usa watchdog sobre el directorio del archivo (así detecta también
+      reemplazos atómicos por rename).
+    - Espera `debounce` segundos sin eventos antes de recargar, para que una
+      ráfaga de escrituras produzca una sola recarga.
+    - La recarga corre en el hilo del timer, fuera del camino de las
+      peticiones; `reload_fn` es responsable de publicar el snapshot nuevo
+      de forma atómica.
+    """
+
+    def __init__(self, path, reload_fn, debounce=DATA_RELOAD_DEBOUNCE_SECONDS):
+        self.path = os.path.abspath(path)
+        self.reload_fn = reload_fn
+        self.debounce = debounce
+        self._timer = None
+        self._timer_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._observer = None
+        self.reload_count = 0
+        self.last_event_at = None
+        self.last_reload_at = None
+        self.last_reload_seconds = None
+        self.last_error = None
+
+    def start(self):
+        from watchdog.events import FileSystemEventHandler
+        from watchdog.observers import Observer
+
+        watcher = self
+
+        class _Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                # Abrir/leer el archivo (incluida nuestra propia recarga) no cuenta
+                if event.event_type not in _WRITE_EVENTS:
+                    return
+                paths = {getattr(event, 'src_path', None), getattr(event, 'dest_path', None)}
+                if watcher.path in {os.path.abspath(p) for p in paths if p}:
+                    watcher._schedule()
+
+        self._observer = Observer()
+        self._observer.schedule(_Handler(), os.path.dirname(self.path), recursive=False)
+        self._observer.daemon = True
+        self._observer.start()
+        print(f"Vigilando cambios en {self.path}")
+
+    def stop(self):
+        with self._timer_lock:
+            if self._timer is not None:
+                self._timer.cancel()
+        if self._observer is not None:
+            self._observer.stop()
+
+    def _schedule(self):
+        self.last_event_at = datetime.now().isoformat(timespec='seconds')
+        with self._timer_lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.debounce, self._reload)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _reload(self):
+        # Nunca dos recargas a la vez
+        with self._reload_lock:
+            print("Cambio detectado en el archivo de datos; recargando...")
+            started = time.perf_counter()
+            try:
+                self.reload_fn()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Error al recargar datos: {e}")
+            self.reload_count += 1
+            self.last_reload_at = datetime.now().isoformat(timespec='seconds')
+            self.last_reload_seconds = round(time.perf_counter() - started, 3)
+
+    def status(self):
+        return {
+            "watching": self._observer is not None and self._observer.is_alive(),
+            "path": self.path,
+            "debounce_seconds": self.debounce,
+            "reload_count": self.reload_count,
+            "last_event_at": self.last_event_at,
+            "last_reload_at": self.last_reload_at,
+            "last_reload_seconds": self.last_reload_seconds,
+            "last_error": self.last_error,
+        }
@@ -1,41 +1,695 @@
+import bisect
+from datetime import date
+from typing import Literal, Optional
+
+import numpy as np
 import pandas as pd
 
-def get_financial_summary(df):
-    
-    if df.empty:
-        return {"error": "No hay datos"}
+import data_loader
+from data_loader import cents_to_amounts, dates_to_days, format_days
 
-    # Filtrar por tipo
-    ingresos_df = df[df['tipo'] == 'ingreso']
-    gastos_df = df[df['tipo'] == 'gasto']
+def get_financial_summary(df):
+    """
+    Resumen financiero de todo el historial (`df` en el esquema compacto de
+    data_loader). Equivale a construir el rollup
+    y derivar el resumen de él; quien ya tiene el rollup (ej. main.py) debe
+    usar summary_from_rollup directamente.
+    """
+    return summary_from_rollup(build_rollup(df))
 
-    total_ingresos = ingresos_df['monto'].sum()
-    total_gastos = gastos_df['monto'].sum()
+def _build_summary(total_ingresos, total_gastos, gastos_por_categoria, conteo,
+                   fecha_primera, fecha_ultima, recientes):
+    """Arma el diccionario de resumen a partir de totales ya calculados."""
     flujo_neto = total_ingresos - total_gastos
     
     # Tasa de ahorro (respecto al ingreso)
     tasa_ahorro = (flujo_neto / total_ingresos) * 100 if total_ingresos > 0 else 0
 
-    # Resumen de gastos por categoría
-    gastos_por_categoria = gastos_df.groupby('categoria')['monto'].sum().sort_values(ascending=False)
-    
-    # Transacciones recientes
-    transacciones_recientes = df.sort_values('fecha', ascending=False).head(5).copy()
-    transacciones_recientes['fecha'] = transacciones_recientes['fecha'].dt.strftime('%Y-%m-%d')
-
     summary = {
         "total_ingresos": round(total_ingresos, 2),
         "total_gastos": round(total_gastos, 2),
         "flujo_neto_total": round(flujo_neto, 2),
         "tasa_ahorro_promedio_pct": round(tasa_ahorro, 2),
-        "top_gastos_categoria": gastos_por_categoria.to_dict(),
-        "conteo_transacciones": df.shape[0],
-        "fecha_primera_transaccion": df['fecha'].min().strftime('%Y-%m-%d'),
-        "fecha_ultima_transaccion": df['fecha'].max().strftime('%Y-%m-%d'),
-        "transacciones_recientes_sample": transacciones_recientes[['fecha', 'descripcion', 'monto', 'tipo']].to_dict('records')
+        "top_gastos_categoria": gastos_por_categoria,
+        "conteo_transacciones": conteo,
+        "fecha_primera_transaccion": fecha_primera,
+        "fecha_ultima_transaccion": fecha_ultima,
+        "transacciones_recientes_sample": recientes
     }
     return summary
 
+RECENT_SAMPLE_SIZE = 5
+
+def _amounts_by_key(cents_by_key):
+    return {key: cents_to_amounts(cents) for key, cents in cents_by_key.items()}
+
+def build_rollup(df):
+    """
+    Precalcula (una sola vez, al cargar los datos) todo lo que necesitan el
+    resumen y la simulación, para no volver a recorrer las filas. Trabaja
+    sobre el esquema compacto (códigos categóricos, centavos, números de
+    día) y guarda los montos en centavos enteros:
+
+    - Totales por tipo y sumas/conteos por (tipo, categoria) y (tipo, descripcion).
+    - "cubo": monto y conteo por día × tipo × categoria (los totales por mes
+      o por cualquier rango de fechas se derivan de aquí).
+    - Fechas mínima/máxima y conteo total.
+    - Las 5 transacciones más recientes de cada día ("recientes_por_dia"),
+      suficientes para la muestra de recientes de cualquier rango.
+    - "indice": sumas acumuladas por día para resumir cualquier rango con
+      búsqueda binaria (ver _build_range_index).
+    """
+    if df.empty:
+        return None
+
+    def sums_and_counts(column):
+        grouped = df.groupby(['tipo', column], observed=True)['monto'].agg(['sum', 'count'])
+        return {key: (int(row['sum']), int(row['count'])) for key, row in grouped.iterrows()}
+
+    gastos_df = df[df['tipo'] == 'gasto']
+    gastos_por_categoria = gastos_df.groupby('categoria', observed=True)['monto'].sum().sort_values(ascending=False)
+
+    # 'fecha' ya es el número de día: no hace falta normalizar
+    cubo = (df.groupby(['fecha', 'tipo', 'categoria'], observed=True, dropna=False)['monto']
+            .agg(monto='sum', conteo='count')
+            .reset_index())
+
+    # Orden descendente por fecha (mismo criterio que la muestra original)
+    ordenado = df.sort_values('fecha', ascending=False)
+    recientes = ordenado.groupby('fecha', sort=False).head(RECENT_SAMPLE_SIZE)
+    recientes = data_loader.public_transactions(recientes[data_loader.COLUMNS])
+    recientes['fecha'] = recientes['fecha'].dt.strftime('%Y-%m-%d')
+    recientes_por_dia = {
+        dia: rows.to_dict('records')
+        for dia, rows in recientes.groupby('fecha', sort=False)
+    }
+
+    return {
+        "total_ingresos": int(df.loc[df['tipo'] == 'ingreso', 'monto'].sum()),
+        "total_gastos": int(gastos_df['monto'].sum()),
+        "gastos_por_categoria": {categoria: int(suma) for categoria, suma in gastos_por_categoria.items()},
+        "por_categoria": sums_and_counts('categoria'),
+        "por_descripcion": sums_and_counts('descripcion'),
+        "cubo": cubo,
+        "indice": _build_range_index(cubo),
+        "conteo": df.shape[0],
+        "fecha_primera": format_days(df['fecha'].min()),
+        "fecha_ultima": format_days(df['fecha'].max()),
+        "recientes_por_dia": recientes_por_dia,
+        "dias_con_recientes": sorted(recientes_por_dia),
+        # Incluye 'categoria' para poder simular sobre estas filas
+        "recientes": _recent_sample(recientes_por_dia, sorted(recientes_por_dia)),
+    }
+
+def update_rollup(rollup, new_df):
+    """
+    Regresa un rollup NUEVO que incluye las transacciones de `new_df`.
+    Ajusta totales, conteos, categorías, fechas y recientes de forma
+    incremental; el rollup original no se modifica (puede seguir en uso).
+    """
+    if rollup is None:
+        return build_rollup(new_df)
+    if new_df.empty:
+        return rollup
+
+    delta = build_rollup(new_df)
+
+    def merge_sums_and_counts(old, new):
+        merged = dict(old)
+        for key, (suma, conteo) in new.items():
+            old_suma, old_conteo = merged.get(key, (0, 0))
+            merged[key] = (old_suma + suma, old_conteo + conteo)
+        return merged
+
+    gastos_por_categoria = dict(rollup["gastos_por_categoria"])
+    for categoria, suma in delta["gastos_por_categoria"].items():
+        gastos_por_categoria[categoria] = gastos_por_categoria.get(categoria, 0) + suma
+
+    cubo = (data_loader.concat_transactions([rollup["cubo"], delta["cubo"]])
+            .groupby(['fecha', 'tipo', 'categoria'], observed=True, dropna=False)[['monto', 'conteo']]
+            .sum()
+            .reset_index())
+
+    # Las filas recién ingeridas van primero dentro de su día
+    recientes_por_dia = dict(rollup["recientes_por_dia"])
+    for dia, rows in delta["recientes_por_dia"].items():
+        recientes_por_dia[dia] = (rows + recientes_por_dia.get(dia, []))[:RECENT_SAMPLE_SIZE]
+    dias = sorted(recientes_por_dia)
+
+    return {
+        "total_ingresos": rollup["total_ingresos"] + delta["total_ingresos"],
+        "total_gastos": rollup["total_gastos"] + delta["total_gastos"],
+        "gastos_por_categoria": dict(sorted(gastos_por_categoria.items(), key=lambda item: item[1], reverse=True)),
+        "por_categoria": merge_sums_and_counts(rollup["por_categoria"], delta["por_categoria"]),
+        "por_descripcion": merge_sums_and_counts(rollup["por_descripcion"], delta["por_descripcion"]),
+        "cubo": cubo,
+        # Se reconstruye del cubo (tamaño días × categorías, no filas)
+        "indice": _build_range_index(cubo),
+        "conteo": rollup["conteo"] + delta["conteo"],
+        "fecha_primera": min(rollup["fecha_primera"], delta["fecha_primera"]),
+        "fecha_ultima": max(rollup["fecha_ultima"], delta["fecha_ultima"]),
+        "recientes_por_dia": recientes_por_dia,
+        "dias_con_recientes": dias,
+        "recientes": _recent_sample(recientes_por_dia, dias),
+    }
+
+def _build_range_index(cubo):
+    """
+    Índice de rangos de fechas: los días con datos ordenados una vez y, para
+    cada uno, las sumas acumuladas (en centavos) de ingresos, gastos, gastos
+    por categoría y conteos. El total de cualquier rango [start, end] es la
+    diferencia de dos filas, encontradas con búsqueda binaria.
+    """
+    dias, dia_idx = np.unique(cubo['fecha'].to_numpy(), return_inverse=True)
+    es_gasto = (cubo['tipo'] == 'gasto').to_numpy()
+    es_ingreso = (cubo['tipo'] == 'ingreso').to_numpy()
+    montos = cubo['monto'].to_numpy(dtype='int64')
+    conteos = cubo['conteo'].to_numpy(dtype='int64')
+
+    def acumulado(valores):
+        # Fila 0 = antes del primer día, para que el rango [i, j) sea acum[j] - acum[i]
+        por_dia = np.zeros(len(dias), dtype='int64')
+        np.add.at(por_dia, dia_idx, valores)
+        return np.concatenate([[0], np.cumsum(por_dia)])
+
+    # Gastos por categoría (las categorías nulas cuentan en los totales, no aquí)
+    gastos = cubo[es_gasto & cubo['categoria'].notna().to_numpy()]
+    categorias, cat_idx = np.unique(gastos['categoria'].astype(str).to_numpy(), return_inverse=True)
+    gasto_dia_idx = np.searchsorted(dias, gastos['fecha'].to_numpy())
+    shape = (len(dias), len(categorias))
+    gastos_cat = np.zeros(shape, dtype='int64')
+    conteo_cat = np.zeros(shape, dtype='int64')
+    np.add.at(gastos_cat, (gasto_dia_idx, cat_idx), gastos['monto'].to_numpy(dtype='int64'))
+    np.add.at(conteo_cat, (gasto_dia_idx, cat_idx), gastos['conteo'].to_numpy(dtype='int64'))
+    ceros = np.zeros((1, len(categorias)), dtype='int64')
+
+    return {
+        "dias": dias,
+        "categorias": categorias.tolist(),
+        "ingresos": acumulado(np.where(es_ingreso, montos, 0)),
+        "gastos": acumulado(np.where(es_gasto, montos, 0)),
+        "conteo": acumulado(conteos),
+        "gastos_categoria": np.concatenate([ceros, np.cumsum(gastos_cat, axis=0)]),
+        "conteo_categoria": np.concatenate([ceros, np.cumsum(conteo_cat, axis=0)]),
+    }
+
+def _range_bounds(indice, start=None, end=None):
+    """Posiciones [i, j) de los días dentro de [start, end] (búsqueda binaria)."""
+    dias = indice["dias"]
+    i = 0 if start is None else int(np.searchsorted(dias, dates_to_days(start), side='left'))
+    j = len(dias) if end is None else int(np.searchsorted(dias, dates_to_days(end), side='right'))
+    return i, j
+
+def _range_summary(rollup, i, j, start_str=None, end_str=None):
+    """Resumen de los días en posiciones [i, j) del índice, por diferencias de acumulados."""
+    indice = rollup["indice"]
+    gastos_cat = indice["gastos_categoria"][j] - indice["gastos_categoria"][i]
+    presentes = np.flatnonzero(indice["conteo_categoria"][j] - indice["conteo_categoria"][i])
+    # Mayor gasto primero (mismo orden que el resumen histórico)
+    presentes = presentes[np.argsort(-gastos_cat[presentes], kind='stable')]
+    recientes = _recent_sample(rollup["recientes_por_dia"], rollup["dias_con_recientes"], start_str, end_str)
+
+    return _build_summary(
+        cents_to_amounts(int(indice["ingresos"][j] - indice["ingresos"][i])),
+        cents_to_amounts(int(indice["gastos"][j] - indice["gastos"][i])),
+        {indice["categorias"][c]: cents_to_amounts(int(gastos_cat[c])) for c in presentes},
+        int(indice["conteo"][j] - indice["conteo"][i]),
+        format_days(indice["dias"][i]),
+        format_days(indice["dias"][j - 1]),
+        [{k: v for k, v in row.items() if k != 'categoria'} for row in recientes]
+    )
+
+def _recent_sample(recientes_por_dia, dias, start=None, end=None):
+    """
+    Las transacciones más recientes dentro de [start, end] (fechas
+    'YYYY-MM-DD'), recorriendo los días hacia atrás desde `end`.
+    `dias` es la lista ordenada de llaves de `recientes_por_dia`.
+    """
+    sample = []
+    i = len(dias) if end is None else bisect.bisect_right(dias, end)
+    while i > 0 and len(sample) < RECENT_SAMPLE_SIZE:
+        i -= 1
+        if start is not None and dias[i] < start:
+            break
+        sample.extend(recientes_por_dia[dias[i]][:RECENT_SAMPLE_SIZE - len(sample)])
+    return sample
+
+def summary_from_rollup(rollup, start=None, end=None):
+    """
+    Deriva el resumen financiero del rollup, sin tocar las filas originales.
+    Sin rango regresa exactamente el mismo diccionario que el resumen
+    histórico; con start/end (fechas inclusivas) resume sólo ese periodo
+    con dos búsquedas binarias y diferencias de sumas acumuladas.
+    """
+    if rollup is None:
+        return {"error": "No hay datos"}
+
+    if start is None and end is None:
+        recientes = rollup["recientes"]
+        return _build_summary(
+            cents_to_amounts(rollup["total_ingresos"]),
+            cents_to_amounts(rollup["total_gastos"]),
+            _amounts_by_key(rollup["gastos_por_categoria"]),
+            rollup["conteo"],
+            rollup["fecha_primera"],
+            rollup["fecha_ultima"],
+            [{k: v for k, v in row.items() if k != 'categoria'} for row in recientes]
+        )
+
+    i, j = _range_bounds(rollup["indice"], start, end)
+    if i >= j:
+        return {"error": "No hay datos en el rango de fechas"}
+
+    start_str = None if start is None else format_days(dates_to_days(start))
+    end_str = None if end is None else format_days(dates_to_days(end))
+    return _range_summary(rollup, i, j, start_str, end_str)
+
+SUMMARY_PERIODS = ("week", "month")
+
+def summary_series(rollup, period, start=None, end=None):
+    """
+    Serie de resúmenes por semana (inicia en lunes) o mes dentro de
+    [start, end], en una sola llamada. Cada elemento tiene la forma de
+    get_financial_summary más "periodo" (fecha de inicio). Los periodos sin
+    transacciones se omiten.
+    """
+    if rollup is None:
+        return []
+    indice = rollup["indice"]
+    i, j = _range_bounds(indice, start, end)
+    if i >= j:
+        return []
+
+    # Cortes donde cambia el periodo entre días consecutivos con datos
+    buckets = _timeline_bucket(indice["dias"][i:j], period)
+    cortes = np.flatnonzero(np.diff(buckets)) + 1
+    inicios = np.concatenate([[0], cortes]) + i
+    finales = np.concatenate([cortes, [j - i]]) + i
+
+    series = []
+    for bucket, a, b in zip(buckets[inicios - i], inicios, finales):
+        # La muestra de recientes se limita al periodo (y al rango pedido)
+        start_str = format_days(indice["dias"][a])
+        end_str = format_days(indice["dias"][b - 1])
+        series.append({"periodo": format_days(bucket), **_range_summary(rollup, a, b, start_str, end_str)})
+    return series
+
+def simulate_summary(rollup, params):
+    """
+    Calcula el resumen simulado directamente del rollup, sin copiar
+    el DataFrame. Regresa la misma forma que get_financial_summary(
+    apply_simulation(df, params)), con costo independiente del historial.
+
+    - Reducir un % una categoría de gasto escala su suma por el factor.
+    - Aumentar un monto fijo por transacción de un ingreso suma
+      monto * conteo de esas transacciones.
+    """
+    if rollup is None:
+        return {"error": "No hay datos"}
+
+    print(f"Iniciando simulación con params: {params.model_dump_json()}")
+
+    total_ingresos = cents_to_amounts(rollup["total_ingresos"])
+    total_gastos = cents_to_amounts(rollup["total_gastos"])
+    gastos_por_categoria = {
+        categoria: cents_to_amounts(suma)
+        for (tipo, categoria), (suma, _) in rollup["por_categoria"].items()
+        if tipo == 'gasto'
+    }
+    recientes = [dict(row) for row in rollup["recientes"]]
+
+    # --- 1. Simular reducción de gastos ---
+    if params.category_to_reduce and params.reduction_percentage:
+        reduction_factor = (1 - (params.reduction_percentage / 100.0))
+        suma = cents_to_amounts(rollup["por_categoria"].get(('gasto', params.category_to_reduce), (0, 0))[0])
+
+        total_gastos -= suma * (1 - reduction_factor)
+        if params.category_to_reduce in gastos_por_categoria:
+            gastos_por_categoria[params.category_to_reduce] = suma * reduction_factor
+        for row in recientes:
+            if row['categoria'] == params.category_to_reduce and row['tipo'] == 'gasto':
+                row['monto'] = row['monto'] * reduction_factor
+
+        print(f"Simulación: Reduciendo '{params.category_to_reduce}' en {params.reduction_percentage}%")
+
+    # --- 2. Simular aumento de ingresos ---
+    if params.income_to_increase and params.increase_amount:
+        _, conteo = rollup["por_descripcion"].get(('ingreso', params.income_to_increase), (0, 0))
+
+        # Asumimos que el aumento es por CADA transacción de ese tipo
+        total_ingresos += conteo * params.increase_amount
+        for row in recientes:
+            if row['descripcion'] == params.income_to_increase and row['tipo'] == 'ingreso':
+                row['monto'] = row['monto'] + params.increase_amount
+
+        print(f"Simulación: Aumentando '{params.income_to_increase}' en ${params.increase_amount}")
+
+    for row in recientes:
+        del row['categoria']
+
+    return _build_summary(
+        total_ingresos,
+        total_gastos,
+        dict(sorted(gastos_por_categoria.items(), key=lambda item: item[1], reverse=True)),
+        rollup["conteo"],
+        rollup["fecha_primera"],
+        rollup["fecha_ultima"],
+        recientes
+    )
+
+def simulate_sweep(rollup, categories, reduction_percentages,
+                   income_to_increase=None, increase_amounts=(0.0,),
+                   target_savings_rate=None, top_n=5):
+    """
+    Evalúa todo un barrido de escenarios (categorías × % de reducción ×
+    aumentos de ingreso) en una sola operación vectorizada de NumPy.
+
+    Regresa las superficies de flujo neto y tasa de ahorro con forma
+    [categoria][porcentaje][aumento] y, si se indica `target_savings_rate`,
+    los `top_n` escenarios que alcanzan la meta con el menor ajuste total.
+    """
+    if rollup is None:
+        return {"error": "No hay datos"}
+
+    # Ejes vacíos = "sin cambio" en esa dimensión
+    categories = list(categories) or [None]
+    reduction_percentages = list(reduction_percentages) or [0.0]
+    increase_amounts = list(increase_amounts) or [0.0]
+
+    sumas_categoria = cents_to_amounts(np.array([
+        rollup["por_categoria"].get(('gasto', categoria), (0, 0))[0]
+        for categoria in categories
+    ], dtype='int64'))
+    porcentajes = np.asarray(reduction_percentages, dtype=float)
+    aumentos = np.asarray(increase_amounts, dtype=float)
+    conteo_ingreso = 0
+    if income_to_increase:
+        conteo_ingreso = rollup["por_descripcion"].get(('ingreso', income_to_increase), (0, 0))[1]
+
+    # Ejes: [categoria, porcentaje, aumento]
+    ahorro_gastos = sumas_categoria[:, None, None] * (porcentajes[None, :, None] / 100.0)
+    aumento_ingresos = conteo_ingreso * aumentos[None, None, :]
+
+    total_gastos = cents_to_amounts(rollup["total_gastos"]) - ahorro_gastos
+    total_ingresos = cents_to_amounts(rollup["total_ingresos"]) + aumento_ingresos
+    flujo_neto = total_ingresos - total_gastos
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tasa_ahorro = np.where(total_ingresos > 0, flujo_neto / total_ingresos * 100, 0.0)
+    flujo_neto, tasa_ahorro = np.broadcast_arrays(flujo_neto, tasa_ahorro)
+
+    result = {
+        "categories": categories,
+        "reduction_percentages": porcentajes.tolist(),
+        "income_to_increase": income_to_increase,
+        "increase_amounts": aumentos.tolist(),
+        "scenario_count": int(flujo_neto.size),
+        "flujo_neto_total": np.round(flujo_neto, 2).tolist(),
+        "tasa_ahorro_pct": np.round(tasa_ahorro, 2).tolist(),
+    }
+
+    if target_savings_rate is not None:
+        ajuste_total = np.broadcast_to(ahorro_gastos + aumento_ingresos, flujo_neto.shape).ravel()
+        tasa_plana = tasa_ahorro.ravel()
+        alcanzan = tasa_plana >= target_savings_rate
+        if alcanzan.any():
+            # Entre los que alcanzan la meta, el que pide el menor ajuste
+            candidatos = np.flatnonzero(alcanzan)
+            orden = candidatos[np.argsort(ajuste_total[candidatos], kind='stable')]
+        else:
+            # Si ninguno la alcanza, los más cercanos
+            orden = np.argsort(-tasa_plana, kind='stable')
+
+        best = []
+        for flat_index in orden[:top_n]:
+            c, p, a = np.unravel_index(flat_index, flujo_neto.shape)
+            best.append({
+                "category_to_reduce": categories[c],
+                "reduction_percentage": float(porcentajes[p]),
+                "income_to_increase": income_to_increase,
+                "increase_amount": float(aumentos[a]),
+                "flujo_neto_total": round(float(flujo_neto[c, p, a]), 2),
+                "tasa_ahorro_pct": round(float(tasa_ahorro[c, p, a]), 2),
+                "meets_target": bool(alcanzan[flat_index]),
+            })
+        result["target_savings_rate"] = target_savings_rate
+        result["best_scenarios"] = best
+
+    return result
+
+def filter_transactions(df, descripciones=None, tipo=None, start=None, end=None, after_index=None):
+    """
+    Filtra transacciones por descripción, tipo ('gasto', 'ingreso' o 'both')
+    y rango de fechas (inclusivo). `after_index` sirve para paginar: sólo
+    regresa filas cuyo índice sea mayor. `df` usa el esquema compacto
+    ('fecha' como número de día).
+    """
+    mask = pd.Series(True, index=df.index)
+    if descripciones:
+        mask &= df['descripcion'].isin(descripciones)
+    if tipo and tipo != 'both':
+        mask &= df['tipo'] == tipo
+    if start is not None:
+        mask &= df['fecha'] >= dates_to_days(start)
+    if end is not None:
+        mask &= df['fecha'] <= dates_to_days(end)
+    if after_index is not None:
+        mask &= df.index > after_index
+    return df[mask]
+
+TIMELINE_GRANULARITIES = ("day", "week", "month")
+
+def _timeline_bucket(dias, granularity):
+    """
+    Día de inicio del periodo (día, semana que empieza en lunes o mes),
+    como número de día.
+    """
+    dias = np.asarray(dias, dtype='int32')
+    if granularity == "week":
+        # El día 0 (1970-01-01) fue jueves
+        return dias - (dias + 3) % 7
+    if granularity == "month":
+        return dates_to_days(data_loader.days_to_dates(dias).astype('datetime64[M]'))
+    return dias
+
+def _daily_rollup(df):
+    # 'fecha' ya es el número de día
+    return (df.groupby(['fecha', 'descripcion', 'tipo'], observed=True)['monto']
+            .agg(monto='sum', conteo='count')
+            .reset_index())
+
+def _rollups_from_daily(daily):
+    rollups = {"day": daily}
+    for granularity in ("week", "month"):
+        rollups[granularity] = (daily.assign(fecha=_timeline_bucket(daily['fecha'], granularity))
+                                .groupby(['fecha', 'descripcion', 'tipo'], observed=True)[['monto', 'conteo']]
+                                .sum()
+                                .reset_index())
+    return rollups
+
+def build_timeline_rollups(df):
+    """
+    Precalcula (al cargar los datos) los totales por fecha, descripción y
+    tipo en granularidad diaria, semanal y mensual. Su tamaño depende de los
+    días y descripciones distintas, no del número de transacciones.
+    """
+    if df.empty:
+        return None
+    return _rollups_from_daily(_daily_rollup(df))
+
+def update_timeline_rollups(rollups, new_df):
+    """
+    Regresa rollups nuevos que incluyen las transacciones de `new_df`, sin
+    volver a recorrer el historial completo (sólo el rollup diario).
+    """
+    if rollups is None:
+        return build_timeline_rollups(new_df)
+    if new_df.empty:
+        return rollups
+    daily = (data_loader.concat_transactions([rollups["day"], _daily_rollup(new_df)])
+             .groupby(['fecha', 'descripcion', 'tipo'], observed=True)[['monto', 'conteo']]
+             .sum()
+             .reset_index())
+    return _rollups_from_daily(daily)
+
+def timeline_options(rollups):
+    """Opciones para los filtros de la línea del tiempo."""
+    daily = rollups["day"]
+    return {
+        "descripciones": sorted(daily['descripcion'].dropna().astype(str).unique().tolist()),
+        "fecha_min": format_days(daily['fecha'].min()),
+        "fecha_max": format_days(daily['fecha'].max()),
+    }
+
+def timeline_points(rollups, granularity="day", descripciones=None, tipo=None, start=None, end=None):
+    """
+    Puntos de la línea del tiempo ya agregados para los filtros pedidos.
+    Con granularidad semanal/mensual, start/end se comparan contra el
+    inicio de cada periodo.
+    """
+    points = filter_transactions(
+        rollups[granularity],
+        descripciones=descripciones,
+        tipo=tipo,
+        start=None if start is None else data_loader.days_to_dates(_timeline_bucket([dates_to_days(start)], granularity))[0],
+        end=end
+    ).sort_values(['fecha', 'descripcion'])
+    points = points.assign(fecha=format_days(points['fecha']), monto=np.round(cents_to_amounts(points['monto']), 2))
+    return points.to_dict('records')
+
+# --- Consultas tipadas (el modelo las llama vía function calling) ---
+# El primer parámetro es la estructura en memoria de donde se sirve la
+# consulta (rollup, rollups de la línea del tiempo o transacciones); el
+# resto son los argumentos que elige el modelo. Regresan dicts/listas
+# serializables a JSON, con montos en pesos.
+
+def _text_mask(column, text):
+    """
+    Filas cuyo texto es `text` sin distinguir mayúsculas. En columnas
+    categóricas se compara contra las categorías (pocas) y se filtra por
+    código, sin convertir cada fila a texto.
+    """
+    if not isinstance(column.dtype, pd.CategoricalDtype):
+        return (column.astype(str).str.casefold() == text.casefold()).to_numpy()
+    codes = np.flatnonzero(column.cat.categories.astype(str).str.casefold() == text.casefold())
+    return np.isin(column.cat.codes.to_numpy(), codes)
+
+def _daily_range(rollups, start=None, end=None):
+    """Filas del rollup diario dentro de [start, end] (está ordenado por fecha)."""
+    daily = rollups["day"]
+    fechas = daily['fecha'].to_numpy()
+    i = 0 if start is None else int(np.searchsorted(fechas, dates_to_days(start), side='left'))
+    j = len(fechas) if end is None else int(np.searchsorted(fechas, dates_to_days(end), side='right'))
+    return daily.iloc[i:j]
+
+def query_range_totals(rollup, start: Optional[date] = None, end: Optional[date] = None) -> dict:
+    """
+    Totales de ingresos, gastos, flujo neto, tasa de ahorro y número de
+    transacciones entre start y end (inclusivos), con el gasto por categoría.
+    """
+    summary = summary_from_rollup(rollup, start=start, end=end)
+    summary.pop("transacciones_recientes_sample", None)
+    return summary
+
+def query_top_merchants(rollups, start: Optional[date] = None, end: Optional[date] = None,
+                        tipo: Literal['gasto', 'ingreso'] = 'gasto', limit: int = 5) -> list:
+    """
+    Comercios/descripciones con mayor monto total entre start y end, con su
+    número de transacciones. tipo: 'gasto' o 'ingreso'.
+    """
+    rows = _daily_range(rollups, start, end)
+    rows = rows[rows['tipo'] == tipo]
+    totals = (rows.groupby('descripcion', observed=True)[['monto', 'conteo']].sum()
+              .sort_values('monto', ascending=False)
+              .head(max(1, min(int(limit), 50))))
+    return [
+        {"descripcion": descripcion, "total": cents_to_amounts(int(row['monto'])), "conteo": int(row['conteo'])}
+        for descripcion, row in totals.iterrows()
+    ]
+
+def query_merchant_totals(rollups, descripcion: str, start: Optional[date] = None,
+                          end: Optional[date] = None) -> dict:
+    """
+    Total gastado/recibido en un comercio o descripción (ej. "Walmart")
+    entre start y end, por tipo y por mes.
+    """
+    rows = _daily_range(rollups, start, end)
+    rows = rows[_text_mask(rows['descripcion'], descripcion)]
+    if rows.empty:
+        return {"descripcion": descripcion, "error": "No hay transacciones de esa descripción en el rango."}
+    por_tipo = rows.groupby('tipo', observed=True)[['monto', 'conteo']].sum()
+    meses = rows.assign(mes=format_days(_timeline_bucket(rows['fecha'], "month")))
+    por_mes = meses.groupby(['mes', 'tipo'], observed=True)['monto'].sum()
+    return {
+        "descripcion": str(rows['descripcion'].iloc[0]),
+        "por_tipo": {
+            tipo: {"total": cents_to_amounts(int(row['monto'])), "conteo": int(row['conteo'])}
+            for tipo, row in por_tipo.iterrows()
+        },
+        "por_mes": [
+            {"mes": mes, "tipo": tipo, "total": cents_to_amounts(int(monto))}
+            for (mes, tipo), monto in por_mes.items()
+        ],
+    }
+
+def query_category_trend(rollup, categoria: str, period: Literal['week', 'month'] = 'month',
+                         start: Optional[date] = None, end: Optional[date] = None) -> list:
+    """
+    Gasto de una categoría por semana o mes entre start y end (los periodos
+    sin gasto en la categoría aparecen con total 0).
+    """
+    if rollup is None:
+        return []
+    indice = rollup["indice"]
+    categorias = {c.casefold(): n for n, c in enumerate(indice["categorias"])}
+    columna = categorias.get(categoria.casefold())
+    if columna is None:
+        return [{"error": f"Categoría desconocida: {categoria}"}]
+    i, j = _range_bounds(indice, start, end)
+    if i >= j:
+        return []
+    buckets = _timeline_bucket(indice["dias"][i:j], period)
+    cortes = np.flatnonzero(np.diff(buckets)) + 1
+    inicios = np.concatenate([[0], cortes]) + i
+    finales = np.concatenate([cortes, [j - i]]) + i
+    gastos = indice["gastos_categoria"][:, columna]
+    conteos = indice["conteo_categoria"][:, columna]
+    return [
+        {
+            "periodo": format_days(bucket),
+            "total": cents_to_amounts(int(gastos[b] - gastos[a])),
+            "conteo": int(conteos[b] - conteos[a]),
+        }
+        for bucket, a, b in zip(buckets[inicios - i], inicios, finales)
+    ]
+
+def query_transactions(df, descripcion: Optional[str] = None, categoria: Optional[str] = None,
+                       tipo: Optional[Literal['gasto', 'ingreso']] = None,
+                       start: Optional[date] = None, end: Optional[date] = None,
+                       min_monto: Optional[float] = None, limit: int = 5) -> list:
+    """
+    Busca transacciones individuales (las de mayor monto primero) por
+    descripción, categoría, tipo, rango de fechas y monto mínimo. Cada una
+    incluye su "id".
+    """
+    # Una sola máscara sobre las columnas compactas; sólo se copian las
+    # filas que se regresan
+    mask = np.ones(len(df), dtype=bool)
+    if tipo:
+        mask &= (df['tipo'] == tipo).to_numpy()
+    if start is not None:
+        mask &= df['fecha'].to_numpy() >= dates_to_days(start)
+    if end is not None:
+        mask &= df['fecha'].to_numpy() <= dates_to_days(end)
+    if descripcion:
+        mask &= _text_mask(df['descripcion'], descripcion)
+    if categoria:
+        mask &= _text_mask(df['categoria'], categoria)
+    montos = df['monto'].to_numpy()
+    if min_monto is not None:
+        mask &= montos >= int(data_loader.amounts_to_cents(min_monto))
+
+    limit = max(1, min(int(limit), 50))
+    positions = np.flatnonzero(mask)
+    if len(positions) > limit:
+        # Los `limit` mayores sin ordenar todo; en empate, las primeras filas
+        # (como nlargest)
+        valores = montos[positions]
+        corte = np.partition(valores, len(valores) - limit)[len(valores) - limit]
+        mayores = positions[valores > corte]
+        positions = np.concatenate([mayores, positions[valores == corte][:limit - len(mayores)]])
+    positions = positions[np.lexsort((positions, -montos[positions]))]
+    records = data_loader.public_transactions(df.iloc[positions])
+    records = records.assign(id=records.index, fecha=records['fecha'].dt.strftime('%Y-%m-%d'))
+    return records.to_dict('records')
+
+def query_transaction(df, transaction_id: int) -> dict:
+    """Una transacción por su id."""
+    if transaction_id not in df.index:
+        return {"error": f"No existe la transacción {transaction_id}."}
+    record = data_loader.public_transactions(df.loc[[transaction_id]])
+    record = record.assign(id=record.index, fecha=record['fecha'].dt.strftime('%Y-%m-%d'))
+    return record.to_dict('records')[0]
+
 def apply_simulation(df, params):
     """
     Aplica cambios simulados a una *copia* del DataFrame.
@@ -43,7 +697,8 @@ def apply_simulation(df, params):
     params: Es el objeto SimulationRequest con los cambios.
     """
     # ¡MUY IMPORTANTE! Copiamos el DF para no alterar el original (GLOBAL_DF)
-    df_sim = df.copy()
+    # (en el esquema original: los montos simulados dejan de ser centavos exactos)
+    df_sim = data_loader.public_transactions(df)
     
     print(f"Iniciando simulación con params: {params.model_dump_json()}")
 
@@ -71,4 +726,4 @@ def apply_simulation(df, params):
         
         print(f"Simulación: Aumentando '{params.income_to_increase}' en ${params.increase_amount}")
 
-    return df_sim
\ No newline at end of file
+    return data_loader.compact_transactions(df_sim)
\ No newline at end of file
@@ -1,6 +1,8 @@
 import os
 import shutil
 
+from data_loader import detect_encoding, repair_mojibake
+
 # Path to the CSV file (same directory as this script)
 csv_name = 'finanzas_personales.xlsx - in.csv'
 script_dir = os.path.dirname(__file__)
@@ -15,17 +17,32 @@ bak_path = csv_path + '.bak'
 shutil.copyfile(csv_path, bak_path)
 print(f'Backup created at: {bak_path}')
 
-# read, replace, write
-with open(csv_path, 'r', encoding='utf-8') as f:
-    data = f.read()
+# read line by line, repair any double-encoded UTF-8 (e.g. 'NÃ³mina' -> 'Nómina'),
+# and write the result as UTF-8; memory use does not depend on the file size
+def rewrite(encoding):
+    changed = 0
+    with open(csv_path, 'r', encoding=encoding, newline='') as src, \
+            open(tmp_path, 'w', encoding='utf-8', newline='') as dst:
+        for line in src:
+            fixed = repair_mojibake(line)
+            if fixed != line:
+                changed += 1
+            dst.write(fixed)
+    return changed
 
-new = data.replace('EducaciÃ³n', 'Educacion')
-new = new.replace('NÃ³mina', 'Nomina')
-new = new.replace('lÃ­nea', 'linea')
+encoding = detect_encoding(csv_path)
+tmp_path = csv_path + '.tmp'
+try:
+    changed = rewrite(encoding)
+except UnicodeDecodeError:
+    # Parecía UTF-8 por su primer MB, pero más adelante no lo es: se reintenta
+    # como latin1 en lugar de reemplazar los caracteres
+    encoding = 'latin1'
+    changed = rewrite(encoding)
 
-if new == data:
-    print('No replacements necessary (no matching strings found).')
+if changed == 0 and encoding in ('utf-8', 'utf-8-sig'):
+    os.remove(tmp_path)
+    print('No replacements necessary (no double-encoded text found).')
 else:
-    with open(csv_path, 'w', encoding='utf-8') as f:
-        f.write(new)
-    print('Replacements applied successfully.')
+    os.replace(tmp_path, csv_path)
+    print(f'Repaired {changed} lines (source encoding: {encoding}); file saved as UTF-8.')
@@ -1,17 +1,251 @@
-import google.generativeai as genai
-import json
-from dotenv import load_dotenv
+import asyncio
 import os
+import random
+
+from dotenv import load_dotenv
+import llm_client
+import llm_tools
+import metrics
+import prompt_context
+import response_cache
+
+# El SDK de Google es opcional: sin él (o con LLM_BACKEND=fake) el servidor
+# arranca igual, p. ej. para pruebas de carga sin red
+try:
+    import google.generativeai as genai
+    from google.api_core import exceptions as google_exceptions
+except ImportError:
+    genai = None
+    google_exceptions = None
 
 load_dotenv()
 
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-model = genai.GenerativeModel('gemini-2.5-flash') # O el modelo que prefieras
+# "gemini" (default) o "fake" (modelo local sin red, ver FakeBackend)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+
+# Comportamiento del modelo falso
+FAKE_LLM_LATENCY_SECONDS = float(os.getenv("FAKE_LLM_LATENCY_SECONDS", "0.8"))
+FAKE_LLM_JITTER_SECONDS = float(os.getenv("FAKE_LLM_JITTER_SECONDS", "0.3"))
+FAKE_LLM_TOKENS_PER_SECOND = float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", "60"))
+FAKE_LLM_RESPONSE_TOKENS = int(os.getenv("FAKE_LLM_RESPONSE_TOKENS", "120"))
+FAKE_LLM_ERROR_RATE = float(os.getenv("FAKE_LLM_ERROR_RATE", "0"))
+
+
+class LLMBackend:
+    """
+    Proveedor del modelo de IA. Las funciones de este módulo sólo usan esta
+    interfaz (a través de llm_client.AsyncLLMClient), así que cambiar de
+    proveedor no toca los endpoints.
+
+    - generate(parts): corrutina que regresa el texto completo.
+    - stream(parts): async generator de fragmentos de texto.
+    - tool_step_fn(system_prompt): regresa step(history) -> ModelTurn para
+      el ciclo de herramientas de llm_tools.
+    - is_retryable(error): si vale la pena reintentar el error.
+    """
+    name = "base"
+
+    async def generate(self, parts):
+        raise NotImplementedError
+
+    async def stream(self, parts):
+        raise NotImplementedError
+        yield
+
+    def tool_step_fn(self, system_prompt):
+        raise NotImplementedError
+
+    def is_retryable(self, error):
+        return True
+
+
+def _to_gemini_contents(history):
+    """Historial genérico de llm_tools a contenidos de Gemini."""
+    contents = []
+    for message in history:
+        if message["role"] == "user":
+            contents.append(genai.protos.Content(role="user", parts=[genai.protos.Part(text=message["text"])]))
+        elif message["role"] == "model":
+            contents.append(genai.protos.Content(role="model", parts=[
+                genai.protos.Part(function_call=genai.protos.FunctionCall(name=call.name, args=call.args))
+                for call in message["calls"]
+            ]))
+        else:
+            part = genai.protos.Part(function_response=genai.protos.FunctionResponse(
+                name=message["name"], response=message["response"]
+            ))
+            # Respuestas consecutivas de herramientas van en un mismo turno
+            if contents and contents[-1].role == "user" and contents[-1].parts[0].function_response.name:
+                contents[-1].parts.append(part)
+            else:
+                contents.append(genai.protos.Content(role="user", parts=[part]))
+    return contents
+
+_TOOLS = [{"function_declarations": llm_tools.TOOL_DECLARATIONS}]
+
+
+class GeminiBackend(LLMBackend):
+    """Gemini con el SDK google-generativeai (llamadas nativas asíncronas)."""
+    name = "gemini"
+
+    def __init__(self, model_name=GEMINI_MODEL, api_key=None):
+        self.model = None
+        self._transient_errors = ()
+        if genai is None:
+            # El servidor arranca; las llamadas a la IA regresan su mensaje de error
+            print("Advertencia: google-generativeai no está instalado; el asistente de IA no estará disponible.")
+            return
+        genai.configure(api_key=api_key or os.getenv("GOOGLE_API_KEY"))
+        self.model = genai.GenerativeModel(model_name)
+        # Errores de la API de Google que vale la pena reintentar
+        self._transient_errors = (
+            google_exceptions.ResourceExhausted,
+            google_exceptions.ServiceUnavailable,
+            google_exceptions.DeadlineExceeded,
+            google_exceptions.InternalServerError,
+        )
+
+    def _require_model(self):
+        if self.model is None:
+            raise llm_client.LLMError("El paquete google-generativeai no está instalado.")
+
+    async def generate(self, parts):
+        self._require_model()
+        # Llamada nativa asíncrona: no bloquea el event loop de uvicorn
+        response = await self.model.generate_content_async(parts)
+        return response.text
+
+    async def stream(self, parts):
+        self._require_model()
+        response = await self.model.generate_content_async(parts, stream=True)
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+    def tool_step_fn(self, system_prompt):
+        if self.model is None:
+            async def unavailable(history):
+                self._require_model()
+            return unavailable
+        # Las instrucciones (con las métricas generales) van como system_instruction
+        tools_model = genai.GenerativeModel(self.model.model_name, system_instruction=system_prompt, tools=_TOOLS)
+
+        async def step(history):
+            response = await tools_model.generate_content_async(_to_gemini_contents(history))
+            parts = response.candidates[0].content.parts
+            calls = [llm_tools.ToolCall(part.function_call.name, dict(part.function_call.args))
+                     for part in parts if part.function_call.name]
+            if calls:
+                return llm_tools.ModelTurn(calls=calls)
+            return llm_tools.ModelTurn(text="".join(part.text for part in parts))
+        return step
 
-def get_ai_recommendation(user_question, financial_context):
+    def is_retryable(self, error):
+        return isinstance(error, self._transient_errors)
 
-    # Convertimos el contexto de Python a un string JSON legible
-    context_str = json.dumps(financial_context, indent=2, ensure_ascii=False)
+
+class FakeLLMError(llm_client.LLMError):
+    """Error transitorio inyectado por FakeBackend."""
+
+
+class FakeBackend(LLMBackend):
+    """
+    Modelo local sin red para pruebas de carga y desarrollo.
+
+    Cada llamada espera `latency` ± `jitter` segundos antes del primer
+    token y luego emite `response_tokens` palabras a `tokens_per_second`
+    (en streaming, fragmento por fragmento). Con probabilidad `error_rate`
+    falla con FakeLLMError (reintentable). Con herramientas, la primera
+    ronda pide query_range_totals y la segunda responde, como un modelo
+    real que consulta una vez.
+    """
+    name = "fake"
+
+    def __init__(self, latency=FAKE_LLM_LATENCY_SECONDS, jitter=FAKE_LLM_JITTER_SECONDS,
+                 tokens_per_second=FAKE_LLM_TOKENS_PER_SECOND, response_tokens=FAKE_LLM_RESPONSE_TOKENS,
+                 error_rate=FAKE_LLM_ERROR_RATE, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self.calls = 0
+
+    async def _first_token(self):
+        self.calls += 1
+        await asyncio.sleep(max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter)))
+        if self._random.random() < self.error_rate:
+            raise FakeLLMError("Error simulado del modelo falso.")
+
+    def _tokens(self, parts):
+        prompt_chars = sum(len(str(part)) for part in parts)
+        words = ["Respuesta", "simulada", f"({prompt_chars}", "caracteres", "de", "prompt)."]
+        filler = ("Revisa tus gastos principales y considera ajustar tu presupuesto mensual.").split()
+        while len(words) < self.response_tokens:
+            words.extend(filler)
+        return [word + " " for word in words[:self.response_tokens]]
+
+    async def generate(self, parts):
+        await self._first_token()
+        tokens = self._tokens(parts)
+        if self.tokens_per_second > 0:
+            await asyncio.sleep(len(tokens) / self.tokens_per_second)
+        return "".join(tokens).strip()
+
+    async def stream(self, parts):
+        await self._first_token()
+        delay = 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0
+        for token in self._tokens(parts):
+            if delay:
+                await asyncio.sleep(delay)
+            yield token
+
+    def tool_step_fn(self, system_prompt):
+        async def step(history):
+            if not any(message["role"] == "tool" for message in history):
+                await self._first_token()
+                return llm_tools.ModelTurn(calls=[llm_tools.ToolCall("query_range_totals", {})])
+            responses = [message["response"] for message in history if message["role"] == "tool"]
+            return llm_tools.ModelTurn(text=await self.generate([system_prompt, *map(str, responses)]))
+        return step
+
+
+def make_backend(name=None):
+    """Crea el backend configurado (LLM_BACKEND)."""
+    name = name or LLM_BACKEND
+    if name == "fake":
+        return FakeBackend()
+    if name == "gemini":
+        return GeminiBackend()
+    raise ValueError(f"LLM_BACKEND desconocido: {name}")
+
+
+def use_backend(new_backend):
+    """Cambia el backend en caliente (ej. pruebas de carga); regresa el cliente nuevo."""
+    global backend, llm
+    backend = new_backend
+    llm = llm_client.AsyncLLMClient(
+        backend.generate,
+        stream_fn=backend.stream,
+        is_retryable=backend.is_retryable,
+    )
+    return llm
+
+backend = None
+llm = None
+use_backend(make_backend())
+
+def _record_prompt(kind, parts):
+    """Tamaño aproximado (tokens) del prompt enviado al modelo."""
+    tokens = sum(prompt_context.estimate_tokens(str(part)) for part in parts)
+    metrics.PROMPT_TOKENS.observe(tokens, kind=kind)
+
+def _build_recommendation_prompt(financial_context):
+
+    # JSON compacto: sin sangría ni espacios (menos tokens de entrada)
+    context_str = prompt_context.compact_json(financial_context)
     
     system_prompt = f"""
     Eres un "CFO Virtual" de Banorte, un asesor financiero experto, 
@@ -32,30 +266,138 @@ def get_ai_recommendation(user_question, financial_context):
     calido, conciso y ofrece recomendaciones accionables. Si el usuario te
     pide que le hables de cierta forma sigue sus ordenes si es coherente.
     """
+    return system_prompt
+
+def _recommendation_cache_key(user_question, financial_context):
+    return response_cache.make_key(
+        "ask",
+        response_cache.normalize_question(user_question),
+        response_cache.context_fingerprint(financial_context)
+    )
+
+async def cached_recommendation(user_question, financial_context):
+    """
+    La respuesta a esta pregunta si ya está en caché (sin llamar al modelo),
+    o None. No cuenta en las estadísticas: get_ai_recommendation sí.
+    """
+    return await response_cache.CACHE.apeek(_recommendation_cache_key(user_question, financial_context))
+
+async def get_ai_recommendation(user_question, financial_context):
+    cache_key = _recommendation_cache_key(user_question, financial_context)
+    cached = await response_cache.CACHE.aget(cache_key)
+    if cached is not None:
+        return cached
+
+    with metrics.span("prompt_build"):
+        system_prompt = _build_recommendation_prompt(financial_context)
+    _record_prompt("ask", [system_prompt, user_question])
     
     try:
-        # Genera la respuesta
-        response = model.generate_content([system_prompt, user_question])
-        return response.text
+        # Genera la respuesta (los errores no se guardan en caché)
+        answer = await llm.generate([system_prompt, user_question])
+        await response_cache.CACHE.aset(cache_key, answer)
+        return answer
     
-    except Exception as e:
+    except llm_client.LLMError as e:
         print(f"Error al llamar a la API de Gemini: {e}")
         return "Hubo un error al procesar tu solicitud con el asistente de IA."
     
-def get_ai_simulation_analysis(context_real, context_simulado):
+async def stream_ai_recommendation(user_question, financial_context):
     """
-    Genera un análisis de IA comparando el escenario real vs. el simulado.
+    Igual que get_ai_recommendation, pero produce la respuesta en fragmentos
+    conforme Gemini los genera. Lanza llm_client.LLMError si falla.
     """
+    cache_key = _recommendation_cache_key(user_question, financial_context)
+    cached = await response_cache.CACHE.aget(cache_key)
+    if cached is not None:
+        yield cached
+        return
+
+    with metrics.span("prompt_build"):
+        system_prompt = _build_recommendation_prompt(financial_context)
+    _record_prompt("ask_stream", [system_prompt, user_question])
+    chunks = []
+    async for chunk in llm.stream([system_prompt, user_question]):
+        chunks.append(chunk)
+        yield chunk
+    # Sólo se guarda si la respuesta se completó
+    await response_cache.CACHE.aset(cache_key, "".join(chunks))
+    
+def _build_tools_prompt(base_context):
+    return f"""
+    Eres un "CFO Virtual" de Banorte, un asesor financiero experto, 
+    amable y profesional. Tu objetivo es ayudar a un usuario a tomar 
+    mejores decisiones financieras.
     
-    # Convertir los diccionarios de contexto a texto JSON legible
-    context_real_str = json.dumps(context_real, indent=2, ensure_ascii=False)
-    context_simulado_str = json.dumps(context_simulado, indent=2, ensure_ascii=False)
+    NUNCA inventes cifras. Abajo están las métricas generales del usuario;
+    para cualquier dato más específico (periodos, comercios, categorías,
+    transacciones) usa las funciones disponibles, que consultan sus datos
+    exactos. Las fechas van en formato YYYY-MM-DD.
+    
+    Métricas generales:
+    {prompt_context.compact_json(base_context)}
+    
+    Por default, sé claro, calido, conciso y ofrece recomendaciones
+    accionables. Si el usuario te pide que le hables de cierta forma sigue
+    sus ordenes si es coherente.
+    """
+
+def _tools_cache_key(user_question, snapshot):
+    return response_cache.make_key(
+        "ask_tools",
+        response_cache.normalize_question(user_question),
+        snapshot.fingerprint
+    )
+
+async def cached_tools_answer(user_question, snapshot):
+    """La respuesta (con herramientas) si ya está en caché, o None; sin contar en las estadísticas."""
+    return await response_cache.CACHE.apeek(_tools_cache_key(user_question, snapshot))
+
+async def get_ai_answer_with_tools(user_question, snapshot, step=None):
+    """
+    Responde una pregunta dejando que el modelo consulte los datos con
+    function calling (ver llm_tools) en lugar de mandarle el contexto
+    completo. `step` permite usar otro modelo (ej. llm_tools.FakeToolModel);
+    en ese caso no se usa la caché de respuestas.
+    Regresa (respuesta, llamadas) con las llamadas a herramientas hechas.
+    """
+    use_cache = step is None
+    cache_key = _tools_cache_key(user_question, snapshot)
+    cached = await response_cache.CACHE.aget(cache_key) if use_cache else None
+    if cached is not None:
+        return cached, []
+
+    base_context = {key: snapshot.context[key] for key in prompt_context.BASE_KEYS if key in snapshot.context}
+    if step is None:
+        # Cada ronda pasa por el semáforo, el timeout y los reintentos de llm
+        with metrics.span("prompt_build"):
+            system_prompt = _build_tools_prompt(base_context)
+        _record_prompt("ask_tools", [system_prompt, user_question])
+        model_step = backend.tool_step_fn(system_prompt)
+        step = lambda history: llm.generate(history, generate_fn=model_step)
+
+    try:
+        answer, calls = await llm_tools.run_tool_loop(step, user_question, snapshot)
+    except llm_client.LLMError as e:
+        print(f"Error al llamar a la API de Gemini (herramientas): {e}")
+        return "Hubo un error al procesar tu solicitud con el asistente de IA.", []
+    for call, _ in calls:
+        print(f"Herramienta llamada por el modelo: {call.name}({call.args})")
+    if use_cache:
+        await response_cache.CACHE.aset(cache_key, answer)
+    return answer, calls
+
+def _build_simulation_prompt(context_real, context_simulado):
+    # Sólo las métricas base del escenario real y lo que cambió en el simulado
+    simulacion, tokens = prompt_context.simulation_context(context_real, context_simulado)
+    print(f"Contexto de la simulación para el modelo: ~{tokens} tokens")
     
     system_prompt = f"""
     Eres un "CFO Virtual" de Banorte, un asesor financiero experto.
     Tu tarea es analizar el impacto de una simulación financiera para el usuario.
     
-    Compara el "Contexto Real" con el "Contexto Simulado" que te proporciono.
+    Te doy las métricas del "Contexto Real" y, en "Cambios", sólo los valores
+    que son distintos en el escenario simulado (real vs. simulado).
     
     Explica claramente qué cambió (ej. "Veo que simulaste reducir tus gastos en 'Restaurantes' en un 20%...") 
     y cuál es el impacto directo en métricas clave como el "flujo_neto_total" 
@@ -64,19 +406,123 @@ def get_ai_simulation_analysis(context_real, context_simulado):
     Termina con una recomendación breve y accionable sobre si esta simulación
     parece ser un buen plan para el usuario. Sé directo y alentador.
     
+    --- CONTEXTO REAL Y CAMBIOS ---
+    {prompt_context.compact_json(simulacion)}
+    -------------------------------
+    """
+    return system_prompt
+
+def _simulation_cache_key(context_real, context_simulado):
+    return response_cache.make_key(
+        "simulate",
+        response_cache.context_fingerprint(context_real),
+        response_cache.context_fingerprint(context_simulado)
+    )
+
+async def cached_simulation_analysis(context_real, context_simulado):
+    """
+    El análisis de esta simulación si ya está en caché (sin llamar al
+    modelo), o None. Un acierto cuenta en las estadísticas (quien lo usa ya
+    no llama a get_ai_simulation_analysis); un fallo lo cuenta ésta.
+    """
+    return await response_cache.CACHE.apeek(_simulation_cache_key(context_real, context_simulado), count_hit=True)
+
+async def get_ai_simulation_analysis(context_real, context_simulado):
+    """
+    Genera un análisis de IA comparando el escenario real vs. el simulado.
+    El contexto simulado se deriva de los parámetros de la simulación, así que
+    su huella identifica la simulación sobre esta versión de los datos.
+    Lanza LLMError (con un mensaje para el usuario) si falla el modelo, para
+    que el trabajo en segundo plano termine en estado "error".
+    """
+    cache_key = _simulation_cache_key(context_real, context_simulado)
+    cached = await response_cache.CACHE.aget(cache_key)
+    if cached is not None:
+        return cached
+    
+    with metrics.span("prompt_build"):
+        system_prompt = _build_simulation_prompt(context_real, context_simulado)
+    _record_prompt("simulate", [system_prompt])
+    
+    try:
+        # Usamos el modelo ya definido (ej. 'gemini-pro')
+        analysis = await llm.generate([system_prompt]) # El prompt ya contiene todo
+        await response_cache.CACHE.aset(cache_key, analysis)
+        return analysis
+    except llm_client.LLMError as e:
+        print(f"Error al llamar a la API de Gemini para simulación: {e}")
+        raise llm_client.LLMError("Hubo un error al procesar el análisis de la simulación.") from e
+
+def _build_sweep_prompt(context_real, resumen_barrido):
+    context_real_compacto, tokens = prompt_context.summary_context(context_real)
+    context_real_str = prompt_context.compact_json(context_real_compacto)
+    barrido_str = prompt_context.compact_json(resumen_barrido)
+    print(f"Contexto del barrido para el modelo: ~{tokens + prompt_context.estimate_tokens(barrido_str)} tokens")
+
+    system_prompt = f"""
+    Eres un "CFO Virtual" de Banorte, un asesor financiero experto.
+    El usuario evaluó muchos escenarios a la vez: reducir distintas categorías
+    de gasto en varios porcentajes y/o aumentar un ingreso en varios montos.
+    
+    Explica qué palancas tienen más impacto en la "tasa_ahorro_promedio_pct",
+    cuáles escenarios alcanzan la meta de ahorro (si hay una) y cuál parece
+    el plan más realista. Sé breve, directo y alentador.
+    
     --- CONTEXTO REAL ---
     {context_real_str}
     ---------------------
     
-    --- CONTEXTO SIMULADO ---
-    {context_simulado_str}
-    -----------------------
+    --- RESUMEN DEL BARRIDO DE ESCENARIOS ---
+    {barrido_str}
+    -----------------------------------------
     """
-    
+    return system_prompt
+
+def _sweep_summary(sweep_result):
+    """
+    Lo que se manda al modelo de un barrido: no las superficies completas,
+    sólo los ejes, la mejor tasa de ahorro por categoría y los mejores escenarios.
+    """
+    mejor_tasa_por_categoria = {
+        str(categoria): max(max(fila) for fila in superficie)
+        for categoria, superficie in zip(sweep_result["categories"], sweep_result["tasa_ahorro_pct"])
+    }
+    return {
+        "reduction_percentages": sweep_result["reduction_percentages"],
+        "income_to_increase": sweep_result["income_to_increase"],
+        "increase_amounts": sweep_result["increase_amounts"],
+        "mejor_tasa_ahorro_por_categoria": mejor_tasa_por_categoria,
+        "target_savings_rate": sweep_result.get("target_savings_rate"),
+        "best_scenarios": sweep_result.get("best_scenarios"),
+    }
+
+def _sweep_cache_key(context_real, resumen_barrido):
+    return response_cache.make_key(
+        "sweep",
+        response_cache.context_fingerprint(context_real),
+        response_cache.context_fingerprint(resumen_barrido)
+    )
+
+async def cached_sweep_analysis(context_real, sweep_result):
+    """El análisis de este barrido si ya está en caché, o None; sin contar en las estadísticas."""
+    return await response_cache.CACHE.apeek(_sweep_cache_key(context_real, _sweep_summary(sweep_result)))
+
+async def get_ai_sweep_analysis(context_real, sweep_result):
+    """Genera un solo análisis de IA para todo un barrido de escenarios (ver _sweep_summary)."""
+    resumen_barrido = _sweep_summary(sweep_result)
+    cache_key = _sweep_cache_key(context_real, resumen_barrido)
+    cached = await response_cache.CACHE.aget(cache_key)
+    if cached is not None:
+        return cached
+
+    with metrics.span("prompt_build"):
+        system_prompt = _build_sweep_prompt(context_real, resumen_barrido)
+    _record_prompt("sweep", [system_prompt])
+
     try:
-        # Usamos el modelo ya definido (ej. 'gemini-pro')
-        response = model.generate_content([system_prompt]) # El prompt ya contiene todo
-        return response.text
-    except Exception as e:
-        print(f"Error al llamar a la API de Gemini para simulación: {e}")
-        return "Hubo un error al procesar el análisis de la simulación."
+        analysis = await llm.generate([system_prompt])
+        await response_cache.CACHE.aset(cache_key, analysis)
+        return analysis
+    except llm_client.LLMError as e:
+        print(f"Error al llamar a la API de Gemini para el barrido: {e}")
+        return "Hubo un error al procesar el análisis del barrido de escenarios."
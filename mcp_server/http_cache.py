@@ -0,0 +1,235 @@
+import asyncio
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from dotenv import load_dotenv
+from fastapi import Response
+
+import metrics
+
+load_dotenv()
+
+# Codificador JSON rápido y compresión brotli son opcionales
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Memoria máxima para respuestas ya serializadas (todas sus variantes)
+RESPONSE_BYTES_CACHE_MB = float(os.getenv("RESPONSE_BYTES_CACHE_MB", "64"))
+# Cuerpos más chicos que esto no se comprimen (no vale la pena)
+MIN_COMPRESS_BYTES = 1024
+
+_ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+
+def encode_json(content):
+    """Serializa a bytes JSON (orjson si está instalado; si no, json estándar)."""
+    if orjson is not None:
+        return orjson.dumps(content, default=_json_default,
+                            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    # Mismo formato que JSONResponse de Starlette
+    return json.dumps(content, ensure_ascii=False, default=_json_default,
+                      separators=(",", ":")).encode("utf-8")
+
+
+def _compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+
+def negotiate_encoding(accept_encoding):
+    """Elige br, gzip o identity según el header Accept-Encoding (respeta q=0)."""
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+    for encoding in _ENCODINGS:
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return "identity"
+
+
+class EncodedEntry:
+    """Una respuesta serializada y sus variantes comprimidas (creadas bajo demanda)."""
+
+    def __init__(self, etag, body):
+        self.etag = etag
+        self.bodies = {"identity": body}
+        self._lock = threading.Lock()
+
+    def encoding_for(self, encoding):
+        """La codificación que se usará: identity para cuerpos chicos."""
+        if encoding != "identity" and len(self.bodies["identity"]) < MIN_COMPRESS_BYTES:
+            return "identity"
+        return encoding
+
+    def body(self, encoding):
+        """(cuerpo, bytes agregados): comprime la variante si aún no existe."""
+        with self._lock:
+            if encoding in self.bodies:
+                return self.bodies[encoding], 0
+            with metrics.span("compression"):
+                body = self.bodies[encoding] = _compress(self.bodies["identity"], encoding)
+        return body, len(body)
+
+    @property
+    def size(self):
+        return sum(len(b) for b in self.bodies.values())
+
+
+class EncodedResponseCache:
+    """
+    Respuestas de lectura ya serializadas (y comprimidas), con desalojo LRU
+    por bytes. La llave incluye usuario y versión del snapshot, así que una
+    versión nueva de los datos nunca sirve bytes viejos.
+    """
+
+    def __init__(self, max_bytes=int(RESPONSE_BYTES_CACHE_MB * 1024 * 1024)):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        # Bytes de todas las variantes de las entradas en caché
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        metrics.CACHE_REQUESTS.inc(cache="responses", result="miss" if entry is None else "hit")
+        return entry
+
+    def build(self, key, etag, build):
+        """Serializa `build()` y lo guarda. Bloquea: llamar fuera del event loop."""
+        # Se serializa fuera del lock; si dos peticiones coinciden gana la última
+        content = build()
+        with metrics.span("serialization"):
+            entry = EncodedEntry(etag, encode_json(content))
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.size
+            self._entries[key] = entry
+            self._bytes += entry.size
+            self._prune()
+        return entry
+
+    def body(self, key, entry, encoding):
+        """
+        Cuerpo de `entry` en `encoding`. Una variante comprimida nueva cuenta
+        contra el presupuesto de memoria. Puede comprimir: fuera del event loop.
+        """
+        body, added = entry.body(encoding)
+        if added:
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    self._bytes += added
+                    self._prune()
+        return body
+
+    def _prune(self):
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "json_encoder": "orjson" if orjson is not None else "json",
+                "encodings": list(_ENCODINGS),
+            }
+
+
+CACHE = EncodedResponseCache()
+
+
+def _variant_etag(etag, encoding):
+    # ETag fuerte: cada codificación es una representación distinta
+    return f'"{etag}"' if encoding == "identity" else f'"{etag}-{encoding}"'
+
+
+def _matching_tag(if_none_match, etag):
+    """La etiqueta de If-None-Match que corresponde a esta respuesta, o None."""
+    if not if_none_match:
+        return None
+    if if_none_match.strip() == "*":
+        return _variant_etag(etag, "identity")
+    candidates = {_variant_etag(etag, e) for e in ("identity", *_ENCODINGS)}
+    for tag in if_none_match.split(","):
+        if tag.strip() in candidates:
+            return tag.strip()
+    return None
+
+
+async def json_response(request, snapshot, build):
+    """
+    Respuesta JSON de lectura servida desde bytes pre-serializados.
+
+    `build()` produce el contenido y sólo se llama la primera vez para
+    esta versión de los datos y estos parámetros. Incluye ETag (derivado de
+    la versión del snapshot) y responde 304 a If-None-Match. El cálculo, la
+    serialización y la compresión corren en un hilo para no bloquear el
+    event loop (ej. /all_transactions completo).
+    """
+    params = sorted(request.query_params.multi_items())
+    key = (snapshot.user_id, snapshot.version, request.url.path, tuple(params))
+    digest = hashlib.sha1(repr((request.url.path, params)).encode("utf-8")).hexdigest()[:12]
+    etag = f"{snapshot.fingerprint[:16]}-{snapshot.version}-{digest}"
+
+    headers = {"Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+    matched = _matching_tag(request.headers.get("if-none-match"), etag)
+    if matched:
+        metrics.CACHE_REQUESTS.inc(cache="responses", result="not_modified")
+        headers["ETag"] = matched
+        return Response(status_code=304, headers=headers)
+
+    entry = CACHE.get(key)
+    if entry is None:
+        entry = await asyncio.to_thread(CACHE.build, key, etag, build)
+    encoding = entry.encoding_for(negotiate_encoding(request.headers.get("accept-encoding")))
+    if encoding in entry.bodies:
+        body = entry.bodies[encoding]
+    else:
+        body = await asyncio.to_thread(CACHE.body, key, entry, encoding)
+    headers["ETag"] = _variant_etag(etag, encoding)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -0,0 +1,199 @@
+import asyncio
+import contextvars
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+from dotenv import load_dotenv
+
+import metrics
+
+load_dotenv()
+
+# Análisis de IA que corren a la vez en segundo plano
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "4"))
+# Trabajos en espera como máximo; más allá se rechazan de inmediato
+ANALYSIS_QUEUE_MAX = int(os.getenv("ANALYSIS_QUEUE_MAX", "100"))
+# Cuánto tiempo se conserva un trabajo (y su resultado) después de crearse
+JOB_TTL_SECONDS = float(os.getenv("JOB_TTL_SECONDS", "900"))
+JOB_STORE_MAX_ENTRIES = int(os.getenv("JOB_STORE_MAX_ENTRIES", "2000"))
+
+JOBS_COUNTER = metrics.Counter("mcp_jobs", "Trabajos en segundo plano terminados, por tipo y estado.",
+                               ("kind", "status"))
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    user_id: str
+    key: Any = None
+    status: str = "pending"  # pending, running, done, error
+    result: Any = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    # Se marca al terminar (para quien espera por SSE)
+    done_event: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    @property
+    def finished(self):
+        return self.status in ("done", "error")
+
+    def public(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobStore:
+    """
+    Trabajos en segundo plano (ej. el análisis de IA de una simulación) y
+    sus resultados, con vencimiento por TTL y número máximo de entradas.
+
+    Los trabajos corren en un pool acotado de `workers` tareas del event
+    loop que consumen una cola de a lo más `queue_max` trabajos. Son por
+    proceso: con varios workers de uvicorn el cliente debe consultar el
+    mismo proceso (o esperar el resultado por SSE en la misma conexión).
+    """
+
+    def __init__(self, workers=ANALYSIS_WORKERS, queue_max=ANALYSIS_QUEUE_MAX,
+                 ttl_seconds=JOB_TTL_SECONDS, max_entries=JOB_STORE_MAX_ENTRIES):
+        self.workers = workers
+        self.queue_max = queue_max
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._jobs = OrderedDict()
+        # Trabajos sin terminar por llave (para unir peticiones idénticas)
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._queue = None
+        self._loop = None
+        self._tasks = []
+
+    def _ensure_workers(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        # Primer trabajo (o un event loop nuevo): se crea el pool
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=self.queue_max)
+        # Contexto vacío: si no, los workers heredan los contextvars de la
+        # petición que los creó (ej. su lista de Server-Timing) y cada trabajo
+        # seguiría agregando etapas a esa lista para siempre
+        self._tasks = [loop.create_task(self._worker(), context=contextvars.Context())
+                       for _ in range(self.workers)]
+
+    async def _worker(self):
+        while True:
+            job, make_coro = await self._queue.get()
+            job.status = "running"
+            try:
+                job.result = await make_coro()
+                job.status = "done"
+            except Exception as e:
+                print(f"Error en el trabajo {job.kind} {job.id}: {e}")
+                job.error = str(e)
+                job.status = "error"
+            finally:
+                self._finish(job)
+                JOBS_COUNTER.inc(kind=job.kind, status=job.status)
+                self._queue.task_done()
+
+    def _finish(self, job):
+        job.finished_at = time.time()
+        job.done_event.set()
+        with self._lock:
+            if job.key is not None and self._in_flight.get(job.key) is job:
+                del self._in_flight[job.key]
+
+    def _prune(self):
+        cutoff = time.time() - self.ttl_seconds
+        while self._jobs:
+            oldest = next(iter(self._jobs.values()))
+            if oldest.created_at >= cutoff and len(self._jobs) <= self.max_entries:
+                break
+            self._jobs.popitem(last=False)
+
+    def _add(self, job):
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        return job
+
+    def submit(self, kind, user_id, make_coro, key=None):
+        """
+        Encola `make_coro()` (una corrutina nueva al empezar) y regresa el
+        Job. Con `key`, in_flight(key) lo encuentra mientras no termine. Si
+        la cola está llena, el trabajo queda en error de inmediato.
+        Llamar desde el event loop.
+        """
+        self._ensure_workers()
+        job = self._add(Job(id=secrets.token_urlsafe(12), kind=kind, user_id=user_id, key=key))
+        try:
+            self._queue.put_nowait((job, make_coro))
+        except asyncio.QueueFull:
+            self._reject(job, "Hay demasiados análisis en espera; intenta de nuevo en unos segundos.")
+            return job
+        if key is not None:
+            with self._lock:
+                self._in_flight[key] = job
+        return job
+
+    def _reject(self, job, error):
+        job.status = "error"
+        job.error = error
+        self._finish(job)
+        JOBS_COUNTER.inc(kind=job.kind, status="rejected")
+
+    def in_flight(self, key):
+        """El trabajo sin terminar registrado con `key`, o None."""
+        with self._lock:
+            return self._in_flight.get(key)
+
+    def completed(self, kind, user_id, result):
+        """Registra un trabajo ya resuelto (ej. el resultado estaba en caché)."""
+        job = Job(id=secrets.token_urlsafe(12), kind=kind, user_id=user_id, status="done", result=result)
+        job.finished_at = job.created_at
+        job.done_event.set()
+        return self._add(job)
+
+    def rejected(self, kind, user_id, error):
+        """Registra un trabajo que no se aceptó (ej. límite de ritmo), con su motivo."""
+        job = self._add(Job(id=secrets.token_urlsafe(12), kind=kind, user_id=user_id))
+        self._reject(job, error)
+        return job
+
+    def get(self, job_id, user_id=None):
+        """El trabajo, o None si no existe, ya venció o es de otro usuario."""
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(job_id)
+        if job is None or (user_id is not None and job.user_id != user_id):
+            return None
+        return job
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return {
+            "jobs": len(jobs),
+            "pending": sum(j.status == "pending" for j in jobs),
+            "running": sum(j.status == "running" for j in jobs),
+            "workers": self.workers,
+            "queue_max": self.queue_max,
+            "ttl_seconds": self.ttl_seconds,
+        }
+
+
+JOBS = JobStore()
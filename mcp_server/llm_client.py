@@ -0,0 +1,188 @@
+import asyncio
+import os
+import random
+import time
+
+from dotenv import load_dotenv
+
+import metrics
+
+load_dotenv()
+
+# Configuración por variables de entorno (con valores por defecto razonables)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_BACKOFF_SECONDS = float(os.getenv("LLM_BACKOFF_SECONDS", "0.5"))
+
+
+class LLMError(Exception):
+    """Error al obtener una respuesta del modelo de IA."""
+
+
+class LLMTimeoutError(LLMError):
+    """El modelo no respondió dentro del tiempo límite."""
+
+
+class ClientDisconnectedError(Exception):
+    """El cliente HTTP cerró la conexión antes de recibir la respuesta."""
+
+
+class AsyncLLMClient:
+    """
+    Capa asíncrona sobre el modelo de IA.
+
+    - Limita cuántas llamadas al modelo corren a la vez (semáforo).
+    - Aplica un tiempo límite a cada intento.
+    - Reintenta los errores transitorios con backoff exponencial + jitter.
+
+    generate_fn: corrutina que recibe la lista de partes del prompt y
+    regresa el texto de la respuesta.
+    stream_fn: (opcional) async generator que recibe las mismas partes y
+    produce la respuesta en fragmentos de texto.
+    is_retryable: función que decide si una excepción amerita reintento.
+    """
+
+    def __init__(self, generate_fn, stream_fn=None, max_concurrency=LLM_MAX_CONCURRENCY,
+                 timeout=LLM_TIMEOUT_SECONDS, max_retries=LLM_MAX_RETRIES,
+                 backoff_base=LLM_BACKOFF_SECONDS, is_retryable=None):
+        self._generate_fn = generate_fn
+        self._stream_fn = stream_fn
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.is_retryable = is_retryable or (lambda e: True)
+        # Llamadas esperando lugar en el semáforo o en curso
+        self.queue_depth = 0
+
+    def _backoff_delay(self, attempt):
+        delay = self.backoff_base * (2 ** (attempt - 1))
+        return delay + random.uniform(0, delay)
+
+    async def generate(self, parts, generate_fn=None):
+        """
+        Genera una respuesta completa. Lanza LLMError si se agotan los intentos.
+        `generate_fn` reemplaza la función del cliente para esta llamada (ej. un
+        paso con herramientas) sin salirse del semáforo ni de los reintentos.
+        """
+        generate_fn = generate_fn or self._generate_fn
+        self.queue_depth += 1
+        try:
+            return await self._generate(parts, generate_fn)
+        finally:
+            self.queue_depth -= 1
+
+    async def _generate(self, parts, generate_fn):
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                await asyncio.sleep(self._backoff_delay(attempt))
+            try:
+                # El tiempo en cola no cuenta contra el timeout, sólo la llamada
+                with metrics.span("llm_queue"):
+                    await self._semaphore.acquire()
+                try:
+                    with metrics.span("llm"):
+                        return await asyncio.wait_for(generate_fn(parts), self.timeout)
+                finally:
+                    self._semaphore.release()
+            except asyncio.TimeoutError:
+                last_error = LLMTimeoutError(f"Sin respuesta después de {self.timeout}s")
+                metrics.LLM_ERRORS.inc(error="LLMTimeoutError")
+            except Exception as e:
+                last_error = e
+                metrics.LLM_ERRORS.inc(error=type(e).__name__)
+                if not self.is_retryable(e):
+                    break
+            print(f"Intento {attempt + 1} de llamada al modelo fallido: {last_error}")
+
+        _raise_llm_error(last_error)
+
+    async def stream(self, parts):
+        """
+        Genera la respuesta fragmento por fragmento (async generator).
+
+        El timeout aplica a la espera de cada fragmento. Sólo se reintenta si
+        el error ocurre antes de emitir el primer fragmento; a mitad de la
+        respuesta ya no es posible repetirla sin duplicar texto.
+        """
+        if self._stream_fn is None:
+            raise LLMError("Este cliente no soporta respuestas en streaming.")
+
+        self.queue_depth += 1
+        try:
+            async for chunk in self._stream(parts):
+                yield chunk
+        finally:
+            self.queue_depth -= 1
+
+    async def _stream(self, parts):
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                await asyncio.sleep(self._backoff_delay(attempt))
+            emitted = False
+            try:
+                with metrics.span("llm_queue"):
+                    await self._semaphore.acquire()
+                try:
+                    chunks = self._stream_fn(parts)
+                    started = time.perf_counter()
+                    try:
+                        while True:
+                            try:
+                                chunk = await asyncio.wait_for(chunks.__anext__(), self.timeout)
+                            except StopAsyncIteration:
+                                return
+                            if not emitted:
+                                # Tiempo hasta el primer fragmento
+                                metrics.STAGE_SECONDS.observe(time.perf_counter() - started, stage="llm_first_token")
+                            emitted = True
+                            yield chunk
+                    finally:
+                        await chunks.aclose()
+                        metrics.STAGE_SECONDS.observe(time.perf_counter() - started, stage="llm")
+                finally:
+                    self._semaphore.release()
+            except asyncio.TimeoutError:
+                last_error = LLMTimeoutError(f"Sin respuesta después de {self.timeout}s")
+                metrics.LLM_ERRORS.inc(error="LLMTimeoutError")
+            except Exception as e:
+                last_error = e
+                metrics.LLM_ERRORS.inc(error=type(e).__name__)
+                if not self.is_retryable(e):
+                    break
+            if emitted:
+                break
+            print(f"Intento {attempt + 1} de streaming del modelo fallido: {last_error}")
+
+        _raise_llm_error(last_error)
+
+
+def _raise_llm_error(error):
+    if isinstance(error, LLMError):
+        raise error
+    raise LLMError(str(error)) from error
+
+
+async def run_until_disconnected(request, coro, poll_interval=0.5):
+    """
+    Ejecuta `coro` mientras el cliente siga conectado.
+
+    Si el cliente se desconecta, cancela la tarea (liberando el lugar en el
+    semáforo del modelo) y lanza ClientDisconnectedError.
+    """
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                raise ClientDisconnectedError()
+    finally:
+        if not task.done():
+            task.cancel()
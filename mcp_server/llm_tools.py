@@ -0,0 +1,213 @@
+import asyncio
+import datetime
+import inspect
+import json
+import os
+import sys
+import typing
+from dataclasses import dataclass, field
+
+from dotenv import load_dotenv
+
+import financial_logic
+
+load_dotenv()
+
+# 1 = /ask deja que el modelo consulte los datos con function calling.
+# Opt-in: por default /ask manda el contexto acotado a la pregunta, igual
+# que /ask/stream, así que ambos responden con los mismos datos.
+LLM_TOOL_CALLING = os.getenv("LLM_TOOL_CALLING", "0") == "1"
+# Máximo de rondas modelo -> herramientas antes de exigir una respuesta
+LLM_TOOL_MAX_STEPS = int(os.getenv("LLM_TOOL_MAX_STEPS", "4"))
+
+# Consultas que el modelo puede llamar. El primer parámetro de cada una
+# dice de qué estructura del snapshot se sirve.
+TOOL_FUNCTIONS = (
+    financial_logic.query_range_totals,
+    financial_logic.query_top_merchants,
+    financial_logic.query_merchant_totals,
+    financial_logic.query_category_trend,
+    financial_logic.query_transactions,
+    financial_logic.query_transaction,
+)
+
+_SOURCES = {
+    "rollup": lambda snapshot: snapshot.rollup,
+    "rollups": lambda snapshot: snapshot.timeline,
+    "df": lambda snapshot: snapshot.df,
+}
+
+_JSON_TYPES = {str: "string", int: "integer", float: "number", bool: "boolean", datetime.date: "string"}
+
+
+@dataclass
+class ToolCall:
+    name: str
+    args: dict = field(default_factory=dict)
+
+
+@dataclass
+class ModelTurn:
+    """Un turno del modelo: texto final o llamadas a herramientas."""
+    text: str = ""
+    calls: list = field(default_factory=list)
+
+
+def _unwrap_optional(annotation):
+    if typing.get_origin(annotation) is typing.Union:
+        args = [a for a in typing.get_args(annotation) if a is not type(None)]
+        if len(args) == 1:
+            return args[0]
+    return annotation
+
+
+def _param_schema(annotation):
+    annotation = _unwrap_optional(annotation)
+    if typing.get_origin(annotation) is typing.Literal:
+        return {"type": "string", "enum": list(typing.get_args(annotation))}
+    schema = {"type": _JSON_TYPES.get(annotation, "string")}
+    if annotation is datetime.date:
+        schema["description"] = "Fecha YYYY-MM-DD"
+    return schema
+
+
+def _bound_parameters(fn):
+    """Parámetros que elige el modelo (todos menos el primero, que es la fuente)."""
+    hints = typing.get_type_hints(fn)
+    params = list(inspect.signature(fn).parameters.values())[1:]
+    return [(p, hints.get(p.name, str)) for p in params]
+
+
+def function_declaration(fn):
+    """Declaración de la función (nombre, descripción y parámetros en JSON Schema)."""
+    properties = {}
+    required = []
+    for param, annotation in _bound_parameters(fn):
+        properties[param.name] = _param_schema(annotation)
+        if param.default is inspect.Parameter.empty:
+            required.append(param.name)
+    return {
+        "name": fn.__name__,
+        "description": " ".join(inspect.getdoc(fn).split()),
+        "parameters": {"type": "object", "properties": properties, "required": required},
+    }
+
+
+TOOL_DECLARATIONS = [function_declaration(fn) for fn in TOOL_FUNCTIONS]
+_TOOLS_BY_NAME = {fn.__name__: fn for fn in TOOL_FUNCTIONS}
+
+
+def _coerce(value, annotation):
+    """Convierte un argumento del modelo al tipo anotado (los enteros llegan como float)."""
+    if value is None:
+        return None
+    annotation = _unwrap_optional(annotation)
+    if annotation is datetime.date:
+        return datetime.date.fromisoformat(str(value)[:10])
+    if annotation is int:
+        return int(value)
+    if annotation is float:
+        return float(value)
+    if typing.get_origin(annotation) is typing.Literal and value not in typing.get_args(annotation):
+        raise ValueError(f"valor no permitido: {value}")
+    return value if annotation is not str else str(value)
+
+
+def call_tool(snapshot, call):
+    """
+    Ejecuta una llamada del modelo contra el snapshot. Los errores (nombre o
+    argumentos inválidos) se regresan como {"error": ...} para que el modelo
+    pueda corregirse. El resultado siempre es un dict.
+    """
+    fn = _TOOLS_BY_NAME.get(call.name)
+    if fn is None:
+        return {"error": f"Herramienta desconocida: {call.name}"}
+    source_name = next(iter(inspect.signature(fn).parameters))
+    source = _SOURCES[source_name](snapshot)
+    if source is None:
+        return {"error": "Los datos no están cargados."}
+    kwargs = {}
+    try:
+        for param, annotation in _bound_parameters(fn):
+            if param.name in call.args:
+                kwargs[param.name] = _coerce(call.args[param.name], annotation)
+            elif param.default is inspect.Parameter.empty:
+                return {"error": f"Falta el parámetro {param.name}"}
+        result = fn(source, **kwargs)
+    except (TypeError, ValueError, KeyError, IndexError) as e:
+        return {"error": f"Argumentos inválidos para {call.name}: {e}"}
+    # La respuesta de una función debe ser un objeto JSON
+    return result if isinstance(result, dict) else {"result": result}
+
+
+async def run_tool_loop(step, question, snapshot, max_steps=LLM_TOOL_MAX_STEPS):
+    """
+    Ciclo de function calling independiente del proveedor.
+
+    `step(history)` es una corrutina que recibe el historial y regresa un
+    ModelTurn. El historial es una lista de dicts: {"role": "user", "text"},
+    {"role": "model", "calls": [ToolCall]} y {"role": "tool", "name",
+    "response"}. Regresa (texto, llamadas) donde llamadas es la lista de
+    (ToolCall, resultado) ejecutadas.
+    """
+    history = [{"role": "user", "text": question}]
+    trace = []
+    for _ in range(max_steps):
+        turn = await step(history)
+        if not turn.calls:
+            return turn.text, trace
+        history.append({"role": "model", "calls": turn.calls})
+        for call in turn.calls:
+            # Fuera del event loop: una consulta sobre muchas filas no
+            # detiene las demás peticiones
+            result = await asyncio.to_thread(call_tool, snapshot, call)
+            trace.append((call, result))
+            history.append({"role": "tool", "name": call.name, "response": result})
+    # Se agotaron las rondas: un último turno sin ejecutar más herramientas
+    history.append({"role": "user", "text": "Responde ya con la información obtenida."})
+    turn = await step(history)
+    return turn.text or "No pude completar la consulta con los datos disponibles.", trace
+
+
+class FakeToolModel:
+    """
+    Modelo falso para probar el ciclo de herramientas sin red.
+
+    `script` es una lista de turnos en orden: una lista de ToolCall (o de
+    tuplas (nombre, args)) para pedir herramientas, o un texto final. El
+    texto puede ser una función que recibe las respuestas de herramientas
+    del historial y regresa el texto. Registra cada historial recibido en
+    `histories`.
+    """
+
+    def __init__(self, script):
+        self.script = list(script)
+        self.histories = []
+
+    async def __call__(self, history):
+        self.histories.append(list(history))
+        if not self.script:
+            return ModelTurn(text="")
+        item = self.script.pop(0)
+        if isinstance(item, list):
+            return ModelTurn(calls=[c if isinstance(c, ToolCall) else ToolCall(*c) for c in item])
+        if callable(item):
+            item = item([m["response"] for m in history if m["role"] == "tool"])
+        return ModelTurn(text=item)
+
+
+if __name__ == "__main__":
+    # Demostración local con el modelo falso:
+    # python llm_tools.py [archivo.csv]
+    import data_store
+
+    snapshot = data_store.load_file(sys.argv[1] if len(sys.argv) > 1 else None)
+    fake = FakeToolModel([
+        [("query_merchant_totals", {"descripcion": "Walmart", "start": "2024-03-01", "end": "2024-03-31"})],
+        lambda responses: f"Resultado: {json.dumps(responses[-1], ensure_ascii=False)}",
+    ])
+    answer, calls = asyncio.run(run_tool_loop(fake, "¿Cuánto gasté en Walmart en marzo?", snapshot))
+    for call, result in calls:
+        print(call.name, call.args, "->", json.dumps(result, ensure_ascii=False)[:300])
+    print(answer)
+    print(json.dumps(TOOL_DECLARATIONS, ensure_ascii=False, indent=2))
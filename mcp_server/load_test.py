@@ -0,0 +1,260 @@
+"""
+Generador de carga para el servidor MCP.
+
+    # Contra un servidor corriendo (ej. LLM_BACKEND=fake RATE_LIMIT_PER_MINUTE=0 uvicorn main:app --workers 4)
+    python load_test.py --url http://127.0.0.1:8000 --concurrency 50 --duration 30
+
+    # En el mismo proceso (ASGI, sin red), con el modelo falso
+    python load_test.py --in-process --csv datos.csv --concurrency 50 --duration 30
+
+Cada usuario virtual elige un endpoint según `--mix` (pesos), espera la
+respuesta y repite. Al final reporta, por endpoint y en total, peticiones
+por segundo, errores y latencias p50/p95/p99. En modo --in-process también
+mide el retraso del event loop (un loop bloqueado por trabajo síncrono se
+ve como retraso alto aunque el modelo falso sólo haga sleeps).
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import time
+
+# Porcentajes y preguntas variados para no medir sólo respuestas en caché
+QUESTIONS = (
+    "¿En qué gasto más?",
+    "¿Cuánto gasté en Walmart en marzo?",
+    "¿Cómo voy con mi ahorro este mes?",
+    "¿Cuánto gasté en restaurantes el mes pasado?",
+    "Dame un consejo para ahorrar más",
+    "¿Cuáles son mis ingresos en 2024?",
+)
+CATEGORIES = ("Restaurantes", "Supermercado", "Transporte", "Entretenimiento", "Ropa")
+
+DEFAULT_MIX = "summary=4,all_transactions=2,simulate=1,ask=1"
+
+
+def _summary(rng, n):
+    return "GET", "/api/v1/summary", None
+
+
+def _all_transactions(rng, n):
+    return "GET", "/api/v1/all_transactions?limit=500", None
+
+
+def _simulate(rng, n):
+    return "POST", "/api/v1/simulate", {
+        "category_to_reduce": rng.choice(CATEGORIES),
+        "reduction_percentage": float(rng.randint(5, 50)),
+        "income_to_increase": None,
+        "increase_amount": None,
+    }
+
+
+def _ask(rng, n):
+    # El número hace única la pregunta: cada /ask llega al modelo
+    return "POST", "/api/v1/ask", {"question": f"{rng.choice(QUESTIONS)} (#{n})"}
+
+
+ENDPOINTS = {
+    "summary": _summary,
+    "all_transactions": _all_transactions,
+    "simulate": _simulate,
+    "ask": _ask,
+}
+
+
+def parse_mix(text):
+    """'summary=4,ask=1' -> {"summary": 4.0, "ask": 1.0}"""
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise ValueError(f"Endpoint desconocido en --mix: {name} (opciones: {', '.join(ENDPOINTS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    # Rango más cercano
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _latency_stats(latencies, elapsed):
+    return {
+        "requests": len(latencies),
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": _ms(percentile(latencies, 50)),
+        "p95_ms": _ms(percentile(latencies, 95)),
+        "p99_ms": _ms(percentile(latencies, 99)),
+        "max_ms": _ms(max(latencies) if latencies else None),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+async def _loop_lag_probe(samples, stop, interval=0.01):
+    """Registra cuánto tarda el event loop en despertar después de `interval`."""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - started - interval)
+
+
+async def run_load(client, mix, concurrency, duration, seed=0, lag_samples=None):
+    """
+    Corre `concurrency` usuarios virtuales durante `duration` segundos.
+    Regresa el reporte (dict) con estadísticas por endpoint y totales.
+    """
+    rng = random.Random(seed)
+    names, weights = list(mix), list(mix.values())
+    results = {name: {"latencies": [], "errors": 0, "status": {}} for name in names}
+    counter = iter(range(1 << 62))
+    deadline = time.perf_counter() + duration
+
+    async def user(index):
+        # Cada usuario virtual es un cliente distinto para el límite de ritmo
+        headers = {"X-Client-Id": f"load-test-{seed}-{index}"}
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            method, url, body = ENDPOINTS[name](rng, next(counter))
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, url, json=body, headers=headers)
+                status = response.status_code
+                await response.aread()
+            except Exception as e:
+                status = type(e).__name__
+            latency = time.perf_counter() - started
+            result = results[name]
+            result["status"][str(status)] = result["status"].get(str(status), 0) + 1
+            if status == 200:
+                result["latencies"].append(latency)
+            else:
+                result["errors"] += 1
+
+    stop = asyncio.Event()
+    probe = asyncio.ensure_future(_loop_lag_probe(lag_samples, stop)) if lag_samples is not None else None
+    started = time.perf_counter()
+    await asyncio.gather(*(user(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    if probe is not None:
+        stop.set()
+        await probe
+
+    report = {"concurrency": concurrency, "duration_s": round(elapsed, 2), "endpoints": {}}
+    all_latencies = []
+    for name, result in results.items():
+        all_latencies += result["latencies"]
+        report["endpoints"][name] = {
+            **_latency_stats(result["latencies"], elapsed),
+            "errors": result["errors"],
+            "status": result["status"],
+        }
+    report["total"] = {
+        **_latency_stats(all_latencies, elapsed),
+        "errors": sum(r["errors"] for r in results.values()),
+    }
+    if lag_samples:
+        report["event_loop_lag"] = {
+            "p50_ms": _ms(percentile(lag_samples, 50)),
+            "p99_ms": _ms(percentile(lag_samples, 99)),
+            "max_ms": _ms(max(lag_samples)),
+        }
+    return report
+
+
+def print_report(report):
+    print(f"\nConcurrencia {report['concurrency']}, {report['duration_s']}s")
+    print(f"{'endpoint':18s} {'req':>7s} {'req/s':>8s} {'err':>5s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s}")
+    rows = [*report["endpoints"].items(), ("TOTAL", report["total"])]
+    for name, stats in rows:
+        print(f"{name:18s} {stats['requests']:7d} {stats['rps']:8.1f} {stats['errors']:5d} "
+              f"{_fmt(stats['p50_ms']):>9s} {_fmt(stats['p95_ms']):>9s} {_fmt(stats['p99_ms']):>9s}")
+    for name, stats in report["endpoints"].items():
+        failed = {status: n for status, n in stats["status"].items() if status != "200"}
+        if failed:
+            print(f"  {name}: respuestas con error {failed}")
+    if "event_loop_lag" in report:
+        lag = report["event_loop_lag"]
+        print(f"Retraso del event loop: p50 {lag['p50_ms']} ms, p99 {lag['p99_ms']} ms, máx {lag['max_ms']} ms")
+
+
+def _fmt(value):
+    return "-" if value is None else f"{value:.1f}"
+
+
+def _in_process_client(args):
+    """Cliente ASGI contra main.app en este proceso, con el backend falso."""
+    import httpx
+
+    os.environ.setdefault("DATA_WATCH", "0")
+    os.environ["DATA_BACKGROUND_LOAD"] = "0"
+    os.environ.setdefault("LLM_BACKEND", "fake")
+    # Los usuarios virtuales no hacen pausas como una persona: sin límite de
+    # ritmo por default (RATE_LIMIT_PER_MINUTE lo activa para probarlo)
+    os.environ.setdefault("RATE_LIMIT_PER_MINUTE", "0")
+    import data_store
+    import gemini_client
+    import main
+
+    gemini_client.use_backend(gemini_client.FakeBackend(seed=args.seed))
+    if args.csv:
+        data_store.load_file(args.csv)
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://load-test",
+                             timeout=args.timeout)
+
+
+async def main_async(args):
+    try:
+        import httpx
+    except ImportError:
+        print("El generador de carga necesita httpx (pip install httpx).")
+        return None
+
+    mix = parse_mix(args.mix)
+    if args.in_process:
+        client = _in_process_client(args)
+        lag_samples = []
+    else:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits)
+        lag_samples = None
+    async with client:
+        if args.warmup:
+            await run_load(client, mix, min(args.concurrency, 4), args.warmup, seed=args.seed + 1)
+        return await run_load(client, mix, args.concurrency, args.duration, seed=args.seed, lag_samples=lag_samples)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prueba de carga del servidor MCP.")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--in-process", action="store_true",
+                        help="llamar a main.app en este proceso (ASGI) con LLM_BACKEND=fake")
+    parser.add_argument("--csv", help="con --in-process: archivo de transacciones a cargar")
+    parser.add_argument("--concurrency", type=int, default=20, help="usuarios virtuales simultáneos")
+    parser.add_argument("--duration", type=float, default=20.0, help="segundos de carga")
+    parser.add_argument("--warmup", type=float, default=2.0, help="segundos de calentamiento (no se reportan)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="pesos por endpoint, ej. " + DEFAULT_MIX)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="guardar el reporte en JSON")
+    args = parser.parse_args()
+
+    report = asyncio.run(main_async(args))
+    if report is None:
+        sys.exit(1)
+    print_report(report)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Reporte guardado en {args.out}")
@@ -1,23 +1,78 @@
-from fastapi import FastAPI
-from pydantic import BaseModel
-from typing import Optional
+from fastapi import Depends, FastAPI, Header, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
+from datetime import date
+import admission
+import asyncio
+import base64
+import io
+import json
+import os
+import threading
 import data_loader
+import data_store
+import data_watcher
 import financial_logic
 import gemini_client
+import http_cache
+import jobs
+import llm_client
+import llm_tools
+import metrics
+import prompt_context
+import response_cache
 
 app = FastAPI(
     title="Servidor MCP Financiero - Reto Banorte",
-    description="Analiza datos, ejecuta cálculos y responde con IA."
+    description="Analiza datos, ejecuta cálculos y responde con IA.",
+    # Las respuestas JSON miden su serialización (ver /metrics)
+    default_response_class=metrics.TimedJSONResponse
 )
+# Duración y tamaño por ruta, y header Server-Timing opcional
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Cargar los datos en un hilo de fondo: el servidor responde (health,
+# readiness) de inmediato y los endpoints de datos esperan a estar listos.
+DATA_BACKGROUND_LOAD = os.getenv("DATA_BACKGROUND_LOAD", "0") == "1"
+
+def reload_data():
+    """
+    Carga (o recarga) los datos y publica un snapshot nuevo.
+    Las respuestas de IA cacheadas con datos anteriores quedan invalidadas.
+    """
+    try:
+        snapshot = data_store.load_file()
+    except Exception as e:
+        if data_store.current().loaded:
+            # En una recarga fallida se sigue sirviendo la versión anterior
+            print(f"Error al recargar datos, se conserva la versión anterior: {e}")
+            return data_store.current()
+        print(f"Error crítico al cargar datos: {e}")
+        snapshot = data_store.fail("No se pudieron cargar los datos iniciales.")
+    response_cache.CACHE.bind_context(snapshot.fingerprint)
+    return snapshot
+
+# Recargar automáticamente cuando cambie el archivo de datos (watchdog)
+DATA_WATCH = os.getenv("DATA_WATCH", "1") == "1"
+DATA_WATCHER = None
+
+def _start_data_watcher():
+    global DATA_WATCHER
+    try:
+        watcher = data_watcher.DataFileWatcher(data_loader.DATA_FILE, reload_data)
+        watcher.start()
+        DATA_WATCHER = watcher
+    except Exception as e:
+        print(f"No se pudo iniciar la vigilancia del archivo de datos: {e}")
 
 # Cargar datos una vez al iniciar el servidor
-try:
-    GLOBAL_DF = data_loader.load_user_data()
-    GLOBAL_CONTEXT = financial_logic.get_financial_summary(GLOBAL_DF)
-except Exception as e:
-    print(f"Error crítico al cargar datos: {e}")
-    GLOBAL_DF = None
-    GLOBAL_CONTEXT = {"error": "No se pudieron cargar los datos iniciales."}
+if DATA_BACKGROUND_LOAD:
+    threading.Thread(target=reload_data, name="data-loader", daemon=True).start()
+else:
+    reload_data()
+if DATA_WATCH:
+    _start_data_watcher()
 
 # Modelo de entrada para las preguntas del chat
 class ChatRequest(BaseModel):
@@ -29,92 +84,693 @@ class SimulationRequest(BaseModel):
     income_to_increase: Optional[str] = None
     increase_amount: Optional[float] = None
 
+class SweepRequest(BaseModel):
+    categories: List[str] = []
+    reduction_percentages: List[float] = []
+    income_to_increase: Optional[str] = None
+    increase_amounts: List[float] = []
+    target_savings_rate: Optional[float] = None
+    top_n: int = 5
+    include_ai_analysis: bool = False
+
+class TransactionIn(BaseModel):
+    fecha: date
+    descripcion: str = Field(min_length=1)
+    categoria: str = Field(min_length=1)
+    monto: float = Field(allow_inf_nan=False)
+    tipo: Literal['gasto', 'ingreso']
+
+# Máximo de transacciones por petición de ingesta masiva
+MAX_BULK_TRANSACTIONS = 10_000
+
+class BulkTransactionsRequest(BaseModel):
+    transactions: List[TransactionIn] = Field(min_length=1, max_length=MAX_BULK_TRANSACTIONS)
+
+# Filas por bloque al transmitir transacciones (ndjson / arrow)
+TRANSACTIONS_CHUNK_ROWS = 5000
+
+# Límite de escenarios por barrido (evita peticiones gigantes)
+MAX_SWEEP_SCENARIOS = 100_000
+
+# Identificador de usuario/cuenta: letras, números y . _ @ -
+USER_ID_PATTERN = r"^[A-Za-z0-9._@-]{1,64}$"
+
+def get_user_id(
+    user_id: Optional[str] = Query(None, pattern=USER_ID_PATTERN),
+    x_user_id: Optional[str] = Header(None, pattern=USER_ID_PATTERN)
+):
+    """
+    Usuario al que se limita la petición: query param `user_id` o header
+    `X-User-Id`. Sin ninguno se usa el usuario default (el archivo de datos).
+    """
+    return user_id or x_user_id or data_store.DEFAULT_USER_ID
+
+async def user_snapshot(user_id):
+    """
+    Snapshot del usuario. Si no está en memoria, su partición se carga en un
+    hilo para no bloquear el event loop.
+    """
+    snapshot = data_store.cached(user_id)
+    if snapshot is None:
+        snapshot = await asyncio.to_thread(data_store.current, user_id)
+    return snapshot
+
+def missing_data(snapshot):
+    """
+    None si el usuario tiene transacciones; si no, la misma respuesta de
+    error en todos los endpoints de datos: el aviso de carga mientras se lee
+    el archivo, o 404 si la partición está vacía o el usuario no existe.
+    Va antes de cualquier llamada al modelo.
+    """
+    if snapshot.has_data:
+        return None
+    if not snapshot.loaded and snapshot.meta.get("status") in ("loading", "error"):
+        return {"error": "Los datos no están cargados."}
+    return JSONResponse(status_code=404, content={"error": "No hay datos para este usuario."})
+
+def sse_event(event, data):
+    """Formatea un evento server-sent events (SSE)."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.get("/api/v1/health")
+async def health():
+    """Liveness: el proceso está arriba (no depende de que haya datos)."""
+    return {"status": "ok"}
+
+@app.get("/api/v1/ready")
+async def ready(response: Response):
+    """
+    Readiness: 200 cuando los datos están cargados, 503 mientras cargan o si
+    la carga falló. Incluye la versión y cómo se cargaron los datos.
+    """
+    snapshot = data_store.current()
+    if not snapshot.loaded:
+        response.status_code = 503
+    return {"ready": snapshot.loaded, "version": snapshot.version, **snapshot.meta}
+
+@app.get("/api/v1/data_status")
+async def data_status():
+    """Versión del snapshot vigente, cuándo y cómo se cargó, y estado de la recarga automática."""
+    snapshot = data_store.current()
+    return {
+        "version": snapshot.version,
+        "loaded": snapshot.loaded,
+        **snapshot.meta,
+        "watcher": DATA_WATCHER.status() if DATA_WATCHER else {"watching": False},
+        "users": data_store.stats()
+    }
+
+@app.get("/api/v1/data_version")
+async def data_version(user_id: str = Depends(get_user_id)):
+    """
+    Versión y huella de los datos del usuario. Es barata: los clientes la
+    consultan para saber cuándo invalidar lo que tienen en caché.
+    """
+    snapshot = await user_snapshot(user_id)
+    return {
+        "user_id": snapshot.user_id,
+        "version": snapshot.version,
+        "fingerprint": snapshot.fingerprint[:16],
+        "loaded": snapshot.loaded
+    }
+
 @app.get("/api/v1/summary")
-async def get_summary():
+async def get_summary(
+    http_request: Request,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    period: Optional[str] = None,
+    user_id: str = Depends(get_user_id)
+):
     """
     Endpoint para el dashboard.
     Retorna el resumen financiero completo (cálculos complejos).
+    Con start/end (YYYY-MM-DD) resume sólo ese rango de fechas.
+    Con period ("week" o "month") regresa además la serie de resúmenes por
+    periodo dentro del rango: {"summary": ..., "period": ..., "series": [...]}.
+    La respuesta lleva ETag y se sirve ya serializada mientras los datos no cambien.
     """
-    if GLOBAL_CONTEXT is None:
-        return {"error": "Los datos no están cargados."}
-    return GLOBAL_CONTEXT
+    snapshot = await user_snapshot(user_id)
+    missing = missing_data(snapshot)
+    if missing is not None:
+        return missing
+    if period is not None and period not in financial_logic.SUMMARY_PERIODS:
+        return {"error": f"Periodo no soportado: {period}"}
+
+    def build():
+        with metrics.span("summary"):
+            if start is None and end is None:
+                summary = snapshot.context
+            else:
+                summary = financial_logic.summary_from_rollup(snapshot.rollup, start=start, end=end)
+            if period is None:
+                return summary
+            return {
+                "summary": summary,
+                "period": period,
+                "series": financial_logic.summary_series(snapshot.rollup, period, start=start, end=end)
+            }
+
+    return await http_cache.json_response(http_request, snapshot, build)
+
+def llm_admission(http_request, user_id, key=None, cached=False):
+    """
+    Rechazo (tupla de admission.check) para una petición que puede llegar al
+    modelo, o None si se acepta. Una respuesta ya en caché (`cached`) o una
+    petición que se une a un cálculo idéntico en curso (`key` en FLIGHTS) no
+    llama al modelo: no cuenta contra el límite de ritmo ni contra la cola.
+    """
+    if cached or (key is not None and key in admission.FLIGHTS):
+        return None
+    return admission.check(admission.client_key(http_request, user_id), gemini_client.llm.queue_depth)
 
 @app.post("/api/v1/ask")
-async def ask_cfo(request: ChatRequest):
+async def ask_cfo(request: ChatRequest, http_request: Request, user_id: str = Depends(get_user_id)):
     """
     Endpoint para el asistente conversacional.
-    Recibe una pregunta, la combina con el contexto y consulta a Gemini.
+    Recibe una pregunta y consulta a Gemini con el contexto acotado a la
+    pregunta, igual que /ask/stream. Con LLM_TOOL_CALLING=1 el modelo pide
+    en su lugar los datos que necesita con function calling y la respuesta
+    incluye las herramientas llamadas.
+    La llamada al modelo es asíncrona y se cancela si el cliente se desconecta.
+    Preguntas iguales simultáneas (misma versión de los datos) comparten una
+    sola llamada al modelo.
     """
-    if GLOBAL_CONTEXT is None:
-        return {"error": "Los datos no están cargados."}
+    snapshot = await user_snapshot(user_id)
+    missing = missing_data(snapshot)
+    if missing is not None:
+        return missing
     
     print(f"Pregunta recibida: {request.question}")
-    
+
     # Aquí se ejecuta el "Model Context Protocol"
-    # 1. Contexto: GLOBAL_CONTEXT
+    # 1. Contexto: lo relevante para la pregunta, dentro del presupuesto de
+    #    tokens. Con LLM_TOOL_CALLING=1: métricas generales, y el modelo
+    #    consulta lo demás con function calling (llm_tools).
     # 2. Modelo: gemini_client
     # 3. Pregunta: request.question
+    if llm_tools.LLM_TOOL_CALLING:
+        cached = await gemini_client.cached_tools_answer(request.question, snapshot)
+    else:
+        with metrics.span("prompt_build"):
+            financial_context, context_tokens = prompt_context.build_question_context(request.question, snapshot)
+        print(f"Contexto para el modelo: ~{context_tokens} tokens")
+        cached = await gemini_client.cached_recommendation(request.question, financial_context)
+
+    key = ("ask", snapshot.user_id, snapshot.version,
+           response_cache.normalize_question(request.question), llm_tools.LLM_TOOL_CALLING)
+    rejected = llm_admission(http_request, user_id, key, cached=cached is not None)
+    if rejected is not None:
+        return admission.rejection(*rejected)
+
+    async def ask():
+        if llm_tools.LLM_TOOL_CALLING:
+            return await gemini_client.get_ai_answer_with_tools(request.question, snapshot)
+        ai_response = await gemini_client.get_ai_recommendation(
+            user_question=request.question,
+            financial_context=financial_context
+        )
+        return ai_response, context_tokens
     
-    ai_response = gemini_client.get_ai_recommendation(
-        user_question=request.question,
-        financial_context=GLOBAL_CONTEXT
-    )
+    try:
+        ai_response = await llm_client.run_until_disconnected(
+            http_request, admission.FLIGHTS.run(key, ask, kind="ask"))
+    except llm_client.ClientDisconnectedError:
+        print("Cliente desconectado, se canceló la llamada a Gemini.")
+        return Response(status_code=499)
     
-    return {"user_question": request.question, "ai_answer": ai_response}
+    if llm_tools.LLM_TOOL_CALLING:
+        ai_response, calls = ai_response
+        return {
+            "user_question": request.question,
+            "ai_answer": ai_response,
+            "tool_calls": [{"name": call.name, "args": call.args} for call, _ in calls]
+        }
+    ai_response, context_tokens = ai_response
+    return {"user_question": request.question, "ai_answer": ai_response, "context_tokens": context_tokens}
+
+@app.post("/api/v1/ask/stream")
+async def ask_cfo_stream(request: ChatRequest, http_request: Request, user_id: str = Depends(get_user_id)):
+    """
+    Variante en streaming del asistente conversacional.
+    Reenvía la respuesta de Gemini como server-sent events conforme se genera:
+    eventos 'token' con {"text": ...}, y al final 'done' (con los tokens
+    aproximados del contexto enviado) o 'error'.
+    """
+    snapshot = await user_snapshot(user_id)
+    missing = missing_data(snapshot)
+    if missing is not None:
+        return missing
+
+    print(f"Pregunta recibida (stream): {request.question}")
+    with metrics.span("prompt_build"):
+        financial_context, context_tokens = prompt_context.build_question_context(request.question, snapshot)
+    print(f"Contexto para el modelo: ~{context_tokens} tokens")
+    # Cada stream es su propia llamada al modelo (no se comparte), pero sí
+    # cuenta contra el límite de ritmo y la profundidad de la cola
+    cached = await gemini_client.cached_recommendation(request.question, financial_context)
+    rejected = llm_admission(http_request, user_id, cached=cached is not None)
+    if rejected is not None:
+        return admission.rejection(*rejected)
+
+    async def event_stream():
+        try:
+            async for chunk in gemini_client.stream_ai_recommendation(
+                user_question=request.question,
+                financial_context=financial_context
+            ):
+                yield sse_event("token", {"text": chunk})
+            yield sse_event("done", {"context_tokens": context_tokens})
+        except llm_client.LLMError as e:
+            print(f"Error al llamar a la API de Gemini (stream): {e}")
+            yield sse_event("error", {"error": "Hubo un error al procesar tu solicitud con el asistente de IA."})
+
+    # Si el cliente se desconecta, Starlette cancela el generador y con ello
+    # la llamada a Gemini.
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.post("/api/v1/simulate")
-async def simulate_scenario(request: SimulationRequest):
+async def simulate_scenario(
+    request: SimulationRequest,
+    http_request: Request,
+    wait_for_analysis: bool = False,
+    user_id: str = Depends(get_user_id)
+):
     """
     Endpoint para simulación.
-    Recalcula el resumen financiero basado en parámetros 
-    y pide a Gemini que compare los escenarios.
+    Recalcula el resumen financiero basado en parámetros y responde de
+    inmediato con ambos escenarios. El análisis de Gemini corre en segundo
+    plano: la respuesta trae "analysis_job" ({"job_id", "status"}) para
+    consultarlo en /api/v1/jobs/{job_id} (o esperarlo por SSE en
+    /api/v1/jobs/{job_id}/events). Si ya estaba en caché viene en
+    "ai_analysis". Con wait_for_analysis=true espera el análisis, como antes.
+    Simulaciones iguales simultáneas comparten el mismo trabajo. Si el
+    cliente excede su límite o el modelo está saturado, los números se
+    devuelven igual y el trabajo queda en error con el motivo.
     """
-    if GLOBAL_DF is None or GLOBAL_CONTEXT is None:
-        return {"error": "Los datos no están cargados."}
+    snapshot = await user_snapshot(user_id)
+    missing = missing_data(snapshot)
+    if missing is not None:
+        return missing
         
     print(f"Simulación recibida: {request.model_dump_json()}")
 
     try:
-        # 1. Aplicar cambios al DataFrame (usando la nueva función)
-        df_simulado = financial_logic.apply_simulation(GLOBAL_DF, request)
-        
-        # 2. Calcular nuevo resumen (re-usando la función existente)
-        context_simulado = financial_logic.get_financial_summary(df_simulado)
-        
-        # 3. Pedir a Gemini que compare (Protocolo de Modelo)
-        #    Compara el contexto REAL (GLOBAL_CONTEXT) con el SIMULADO
-        ai_analysis = gemini_client.get_ai_simulation_analysis(
-            context_real=GLOBAL_CONTEXT,
-            context_simulado=context_simulado
-        )
-        
-        # 4. Devolver todo para el frontend
-        return {
-            "simulation_params": request.model_dump(),
-            "original_summary": GLOBAL_CONTEXT,
-            "simulated_summary": context_simulado,
-            "ai_analysis": ai_analysis
-        }
-        
+        # 1-2. Calcular el resumen simulado a partir de los agregados
+        #      (sin copiar ni recorrer el DataFrame completo)
+        with metrics.span("simulation"):
+            context_simulado = financial_logic.simulate_summary(snapshot.rollup, request)
     except Exception as e:
         print(f"Error grave durante la simulación: {e}")
         return {"error": f"Ocurrió un error al procesar la simulación: {e}"}
+
+    # 3. Pedir a Gemini que compare (Protocolo de Modelo) en segundo plano:
+    #    compara el contexto REAL (snapshot.context) con el SIMULADO
+    key = ("simulate", snapshot.user_id, snapshot.version, request.model_dump_json())
+    cached = await gemini_client.cached_simulation_analysis(snapshot.context, context_simulado)
+    job = jobs.JOBS.in_flight(key)
+    if cached is not None:
+        job = jobs.JOBS.completed("simulation_analysis", snapshot.user_id, cached)
+    elif job is not None:
+        admission.COALESCED.inc(kind="simulate")
+    else:
+        rejected = llm_admission(http_request, user_id)
+        if rejected is not None:
+            job = jobs.JOBS.rejected("simulation_analysis", snapshot.user_id, rejected[1])
+        else:
+            job = jobs.JOBS.submit(
+                "simulation_analysis",
+                snapshot.user_id,
+                lambda: gemini_client.get_ai_simulation_analysis(
+                    context_real=snapshot.context,
+                    context_simulado=context_simulado
+                ),
+                key=key
+            )
+
+    if wait_for_analysis and not job.finished:
+        try:
+            # Si el cliente se va, el análisis sigue y queda en el job
+            await llm_client.run_until_disconnected(http_request, job.done_event.wait())
+        except llm_client.ClientDisconnectedError:
+            print("Cliente desconectado antes del análisis de la simulación.")
+            return Response(status_code=499)
+
+    # 4. Devolver los números ya (y el análisis si está listo)
+    return {
+        "simulation_params": request.model_dump(),
+        "original_summary": snapshot.context,
+        "simulated_summary": context_simulado,
+        "ai_analysis": job.result if job.status == "done" else None,
+        "analysis_job": {"job_id": job.id, "status": job.status, "error": job.error}
+    }
+
+@app.get("/api/v1/jobs/{job_id}")
+async def get_job(job_id: str, response: Response, user_id: str = Depends(get_user_id)):
+    """
+    Estado y resultado de un trabajo en segundo plano (ej. el análisis de IA
+    de una simulación): status pending, running, done o error. Los trabajos
+    vencen después de JOB_TTL_SECONDS.
+    """
+    job = jobs.JOBS.get(job_id, user_id)
+    if job is None:
+        response.status_code = 404
+        return {"error": "El trabajo no existe o ya venció."}
+    return job.public()
+
+# Cada cuánto se manda un comentario SSE mientras el trabajo sigue corriendo
+JOB_EVENTS_KEEPALIVE_SECONDS = 15
+
+@app.get("/api/v1/jobs/{job_id}/events")
+async def get_job_events(job_id: str, user_id: str = Depends(get_user_id)):
+    """
+    El resultado de un trabajo como server-sent events: un evento 'status'
+    mientras corre y al final 'done' (o 'error') con el trabajo completo.
+    """
+    job = jobs.JOBS.get(job_id, user_id)
+    if job is None:
+        return Response(status_code=404)
+
+    async def event_stream():
+        if not job.finished:
+            yield sse_event("status", {"job_id": job.id, "status": job.status})
+        while not job.finished:
+            try:
+                await asyncio.wait_for(job.done_event.wait(), JOB_EVENTS_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+        yield sse_event("done" if job.status == "done" else "error", job.public())
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
     
+@app.post("/api/v1/simulate/sweep")
+async def simulate_sweep(request: SweepRequest, http_request: Request, user_id: str = Depends(get_user_id)):
+    """
+    Endpoint para análisis de sensibilidad.
+    Evalúa todas las combinaciones categorías × % de reducción × aumentos de
+    ingreso en un solo cálculo vectorizado. El análisis de IA es opcional y
+    se pide una sola vez para todo el barrido.
+    """
+    snapshot = await user_snapshot(user_id)
+    missing = missing_data(snapshot)
+    if missing is not None:
+        return missing
+
+    scenario_count = (max(len(request.categories), 1)
+                      * max(len(request.reduction_percentages), 1)
+                      * max(len(request.increase_amounts), 1))
+    if scenario_count > MAX_SWEEP_SCENARIOS:
+        return {"error": f"El barrido tiene {scenario_count} escenarios; el máximo es {MAX_SWEEP_SCENARIOS}."}
+
+    print(f"Barrido de simulación recibido: {scenario_count} escenarios")
+
+    try:
+        with metrics.span("simulation"):
+            sweep = financial_logic.simulate_sweep(
+                snapshot.rollup,
+                request.categories,
+                request.reduction_percentages,
+                income_to_increase=request.income_to_increase,
+                increase_amounts=request.increase_amounts,
+                target_savings_rate=request.target_savings_rate,
+                top_n=request.top_n
+            )
+
+        ai_analysis = None
+        if request.include_ai_analysis:
+            key = ("sweep", snapshot.user_id, snapshot.version, request.model_dump_json())
+            cached = await gemini_client.cached_sweep_analysis(snapshot.context, sweep)
+            rejected = llm_admission(http_request, user_id, key, cached=cached is not None)
+            if rejected is not None:
+                return admission.rejection(*rejected)
+            ai_analysis = await llm_client.run_until_disconnected(
+                http_request,
+                admission.FLIGHTS.run(key, lambda: gemini_client.get_ai_sweep_analysis(
+                    context_real=snapshot.context,
+                    sweep_result=sweep
+                ), kind="sweep")
+            )
+
+        return {
+            "original_summary": snapshot.context,
+            "sweep": sweep,
+            "ai_analysis": ai_analysis
+        }
+
+    except llm_client.ClientDisconnectedError:
+        print("Cliente desconectado, se canceló el análisis del barrido.")
+        return Response(status_code=499)
+    except Exception as e:
+        print(f"Error grave durante el barrido de simulación: {e}")
+        return {"error": f"Ocurrió un error al procesar el barrido: {e}"}
+
+def _encode_cursor(index_value):
+    return base64.urlsafe_b64encode(str(index_value).encode()).decode()
+
+def _decode_cursor(cursor):
+    return int(base64.urlsafe_b64decode(cursor.encode()).decode())
+
+def _records_chunk(df_chunk):
+    """Convierte un bloque de filas (esquema compacto) a registros JSON-compatibles."""
+    chunk = data_loader.public_transactions(df_chunk)
+    if 'fecha' in chunk.columns:
+        # Convertimos fecha a string para que JSON funcione
+        chunk['fecha'] = chunk['fecha'].dt.strftime('%Y-%m-%d')
+    return chunk
+
+def _ndjson_stream(df):
+    for start in range(0, len(df), TRANSACTIONS_CHUNK_ROWS):
+        chunk = _records_chunk(df.iloc[start:start + TRANSACTIONS_CHUNK_ROWS])
+        lines = chunk.to_json(orient='records', lines=True, force_ascii=False)
+        # Según la versión de pandas, la última línea puede no traer salto
+        yield lines if lines.endswith("\n") else lines + "\n"
+
+def _drain(buffer):
+    data = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return data
+
+def _arrow_stream(df):
+    import pyarrow as pa
+
+    # Se transmite el esquema original (fecha, monto float, texto), no el compacto.
+    # El esquema se infiere del primer bloque; columnas sin valores quedan como texto
+    schema = pa.Schema.from_pandas(
+        data_loader.public_transactions(df.iloc[:TRANSACTIONS_CHUNK_ROWS]), preserve_index=False
+    )
+    for i, field in enumerate(schema):
+        if pa.types.is_null(field.type):
+            schema = schema.set(i, field.with_type(pa.string()))
+    buffer = io.BytesIO()
+    with pa.ipc.new_stream(buffer, schema) as writer:
+        for start in range(0, len(df), TRANSACTIONS_CHUNK_ROWS):
+            batch = pa.RecordBatch.from_pandas(
+                data_loader.public_transactions(df.iloc[start:start + TRANSACTIONS_CHUNK_ROWS]),
+                schema=schema, preserve_index=False
+            )
+            writer.write_batch(batch)
+            yield _drain(buffer)
+    yield _drain(buffer)
+
 @app.get("/api/v1/all_transactions")
-async def get_all_transactions():
+async def get_all_transactions(
+    http_request: Request,
+    descripcion: Optional[List[str]] = Query(None),
+    tipo: Optional[str] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    columns: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    cursor: Optional[str] = None,
+    output_format: str = Query("json", alias="format"),
+    user_id: str = Depends(get_user_id)
+):
     """
     Endpoint para el dashboard de línea de tiempo.
-    Retorna TODAS las transacciones para las gráficas.
+    Retorna las transacciones para las gráficas, filtradas en el servidor.
+
+    - Filtros: descripcion (repetible), tipo, start/end (YYYY-MM-DD).
+    - columns: proyección separada por comas (ej. "fecha,monto,tipo").
+    - limit/cursor: paginación; la respuesta incluye "next_cursor".
+    - format: "json" (default), "ndjson" o "arrow" (Arrow IPC stream). Los
+      dos últimos se escriben por bloques; el cursor va en X-Next-Cursor.
+      El formato json lleva ETag y se sirve ya serializado (y comprimido).
+
+    Sin parámetros regresa la lista completa, igual que antes.
     """
-    if GLOBAL_DF is None:
-        return {"error": "Los datos no están cargados."}
-    
-    # Devolvemos todas las transacciones
-    all_data = GLOBAL_DF.copy()
-    
-    # Convertimos fecha a string para que JSON funcione
-    # (¡IMPORTANTE! Si no, da error 500)
-    all_data['fecha'] = all_data['fecha'].dt.strftime('%Y-%m-%d')
-    
-    # Usamos .to_dict('records') para que sea un JSON array
-    return all_data.to_dict('records')
\ No newline at end of file
+    snapshot = await user_snapshot(user_id)
+    missing = missing_data(snapshot)
+    if missing is not None:
+        return missing
+    df = snapshot.df
+    if output_format not in ("json", "ndjson", "arrow"):
+        return {"error": f"Formato no soportado: {output_format}"}
+
+    selected_columns = list(df.columns)
+    if columns:
+        selected_columns = [c.strip() for c in columns.split(",") if c.strip()]
+        unknown = [c for c in selected_columns if c not in df.columns]
+        if unknown:
+            return {"error": f"Columnas desconocidas: {', '.join(unknown)}"}
+
+    try:
+        after_index = _decode_cursor(cursor) if cursor else None
+    except ValueError:
+        return {"error": "Cursor inválido."}
+
+    def select():
+        with metrics.span("query"):
+            filtered = financial_logic.filter_transactions(
+                df,
+                descripciones=descripcion,
+                tipo=tipo,
+                start=start,
+                end=end,
+                after_index=after_index
+            )
+        next_cursor = None
+        if limit is not None:
+            if len(filtered) > limit:
+                next_cursor = _encode_cursor(filtered.index[limit - 1])
+            filtered = filtered.iloc[:limit]
+        return filtered[selected_columns], next_cursor
+
+    if output_format == "json":
+        def build():
+            filtered, next_cursor = select()
+            # Usamos .to_dict('records') para que sea un JSON array
+            records = _records_chunk(filtered).to_dict('records')
+            if limit is None:
+                return records
+            return {"items": records, "next_cursor": next_cursor}
+
+        return await http_cache.json_response(http_request, snapshot, build)
+
+    # El filtro recorre todo el historial: fuera del event loop, igual que
+    # en json (los bloques se generan después en el threadpool de Starlette)
+    filtered, next_cursor = await asyncio.to_thread(select)
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    if output_format == "ndjson":
+        return StreamingResponse(_ndjson_stream(filtered), media_type="application/x-ndjson", headers=headers)
+    return StreamingResponse(_arrow_stream(filtered), media_type="application/vnd.apache.arrow.stream", headers=headers)
+
+@app.get("/api/v1/timeline/options")
+async def get_timeline_options(http_request: Request, user_id: str = Depends(get_user_id)):
+    """Descripciones disponibles y rango de fechas para los filtros de la línea del tiempo."""
+    snapshot = await user_snapshot(user_id)
+    missing = missing_data(snapshot)
+    if missing is not None:
+        return missing
+    return await http_cache.json_response(
+        http_request, snapshot, lambda: financial_logic.timeline_options(snapshot.timeline)
+    )
+
+@app.get("/api/v1/timeline")
+async def get_timeline(
+    http_request: Request,
+    granularity: str = "day",
+    descripcion: Optional[List[str]] = Query(None),
+    tipo: Optional[str] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    user_id: str = Depends(get_user_id)
+):
+    """
+    Endpoint para la gráfica de línea del tiempo.
+    Retorna los totales por fecha, descripción y tipo ya agregados
+    (granularity: day, week o month), servidos desde rollups precalculados.
+    """
+    snapshot = await user_snapshot(user_id)
+    missing = missing_data(snapshot)
+    if missing is not None:
+        return missing
+    if granularity not in financial_logic.TIMELINE_GRANULARITIES:
+        return {"error": f"Granularidad no soportada: {granularity}"}
+
+    def build():
+        with metrics.span("timeline"):
+            points = financial_logic.timeline_points(
+                snapshot.timeline,
+                granularity=granularity,
+                descripciones=descripcion,
+                tipo=tipo,
+                start=start,
+                end=end
+            )
+        return {"granularity": granularity, "points": points}
+
+    return await http_cache.json_response(http_request, snapshot, build)
+
+def _ingest(transactions, user_id):
+    if user_id == data_store.DEFAULT_USER_ID:
+        # Sus filas vienen del archivo de datos: una ingesta quedaría sólo en
+        # la memoria de este worker y se perdería en la siguiente recarga
+        return JSONResponse(status_code=409, content={
+            "error": "El usuario default se sirve desde el archivo de datos y no acepta transacciones "
+                     "nuevas; agrégalas al archivo o indica un user_id."
+        })
+    new_df = data_loader.transactions_from_records([t.model_dump() for t in transactions])
+    snapshot = data_store.append(new_df, user_id)
+    print(f"Transacciones ingeridas para {user_id}: {len(new_df)} (versión {snapshot.version})")
+    return {
+        "accepted": len(new_df),
+        "version": snapshot.version,
+        "conteo_transacciones": snapshot.context.get("conteo_transacciones")
+    }
+
+@app.post("/api/v1/transactions")
+async def ingest_transaction(transaction: TransactionIn, user_id: str = Depends(get_user_id)):
+    """
+    Agrega una transacción nueva sin reiniciar el servidor.
+    El resumen, los rollups y la línea del tiempo se actualizan de forma
+    incremental y se publican juntos como un snapshot nuevo. Las filas se
+    guardan en la partición del usuario; el usuario default (el archivo de
+    datos) responde 409.
+    """
+    return await asyncio.to_thread(_ingest, [transaction], user_id)
+
+@app.post("/api/v1/transactions/bulk")
+async def ingest_transactions_bulk(request: BulkTransactionsRequest, user_id: str = Depends(get_user_id)):
+    """
+    Agrega varias transacciones en una sola actualización. Si alguna no es
+    válida se rechaza todo el lote (422) y no se modifica nada.
+    """
+    return await asyncio.to_thread(_ingest, request.transactions, user_id)
+
+@app.get("/api/v1/cache_stats")
+async def get_cache_stats():
+    """
+    Contadores de la caché de respuestas de IA (hits, misses, tamaño), en
+    "responses" los de las respuestas de lectura ya serializadas, en "jobs"
+    los de los trabajos en segundo plano y en "llm" la carga del modelo.
+    """
+    return {
+        **response_cache.CACHE.stats(),
+        "responses": http_cache.CACHE.stats(),
+        "jobs": jobs.JOBS.stats(),
+        "llm": {
+            "queue_depth": gemini_client.llm.queue_depth,
+            "max_queue_depth": admission.LLM_MAX_QUEUE_DEPTH,
+            "in_flight": len(admission.FLIGHTS)
+        }
+    }
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Métricas en formato Prometheus: duración y tamaño de las respuestas por
+    ruta, duración de cada etapa interna (carga de datos, resumen,
+    simulación, armado del prompt, espera y llamada al modelo,
+    serialización), tokens de los prompts, aciertos de caché y errores del
+    modelo. Son por proceso: con varios workers, Prometheus debe leer cada uno.
+    """
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,222 @@
+import contextvars
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+from fastapi.responses import JSONResponse
+
+load_dotenv()
+
+# Header Server-Timing: "request" (default) = sólo si la petición trae
+# X-Server-Timing: 1; "always" = en todas; "off" = nunca
+SERVER_TIMING = os.getenv("SERVER_TIMING", "request")
+
+# Buckets en segundos: desde cálculos sub-milisegundo hasta llamadas al modelo
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES_BUCKETS = tuple(256 * 4 ** i for i in range(10))  # 256 B .. 64 MB
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 1500, 2500, 5000, 10000, 25000)
+
+
+def _labels_text(labelnames, values):
+    if not labelnames:
+        return ""
+    pairs = []
+    for name, value in zip(labelnames, values):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Contador con etiquetas, en formato de texto de Prometheus."""
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f"{self.name}_total{_labels_text(self.labelnames, key)} {_number(value)}"
+
+
+class Histogram:
+    """Histograma con buckets acumulados, suma y conteo por combinación de etiquetas."""
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=TIME_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._series = {}  # etiquetas -> [conteos por bucket, suma, conteo]
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, ([*s[0]], s[1], s[2])) for key, s in self._series.items())
+        names = (*self.labelnames, "le")
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                yield f"{self.name}_bucket{_labels_text(names, (*key, _number(bound)))} {cumulative}"
+            yield f"{self.name}_sum{_labels_text(self.labelnames, key)} {_number(total)}"
+            yield f"{self.name}_count{_labels_text(self.labelnames, key)} {count}"
+
+
+REGISTRY = []
+
+REQUEST_SECONDS = Histogram(
+    "mcp_http_request_duration_seconds", "Duración de las peticiones HTTP.", ("method", "route", "status"))
+RESPONSE_BYTES = Histogram(
+    "mcp_http_response_size_bytes", "Tamaño del cuerpo de las respuestas HTTP.", ("route",), BYTES_BUCKETS)
+STAGE_SECONDS = Histogram(
+    "mcp_stage_duration_seconds",
+    "Duración de cada etapa interna (data_load, summary, simulation, prompt_build, llm, serialization...).",
+    ("stage",))
+PROMPT_TOKENS = Histogram(
+    "mcp_llm_prompt_tokens", "Tokens aproximados de cada prompt enviado al modelo.", ("kind",), TOKEN_BUCKETS)
+CACHE_REQUESTS = Counter(
+    "mcp_cache_requests", "Consultas a las cachés por resultado (hit, miss, not_modified).", ("cache", "result"))
+LLM_ERRORS = Counter(
+    "mcp_llm_errors", "Intentos fallidos de llamada al modelo, por tipo de error.", ("error",))
+
+# Etapas registradas durante la petición en curso (para Server-Timing)
+_TIMINGS = contextvars.ContextVar("mcp_timings", default=None)
+
+
+@contextmanager
+def span(stage):
+    """
+    Mide un bloque de código como etapa `stage`. Funciona en código síncrono
+    y asíncrono; las etapas de la petición en curso van también a su
+    header Server-Timing.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        timings = _TIMINGS.get()
+        if timings is not None:
+            timings.append((stage, elapsed))
+
+
+def render():
+    """Todas las métricas en el formato de texto de Prometheus (0.0.4)."""
+    lines = []
+    for metric in REGISTRY:
+        name = f"{metric.name}_total" if metric.kind == "counter" else metric.name
+        lines.append(f"# HELP {name} {metric.help}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+def server_timing_header(timings, total):
+    """Etapas repetidas se suman (ej. varias rondas de llm)."""
+    merged = {}
+    for stage, elapsed in timings:
+        merged[stage] = merged.get(stage, 0.0) + elapsed
+    entries = [f"{stage};dur={elapsed * 1000:.2f}" for stage, elapsed in merged.items()]
+    entries.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(entries)
+
+
+class TimedJSONResponse(JSONResponse):
+    """JSONResponse que mide la serialización como etapa."""
+
+    def render(self, content):
+        with span("serialization"):
+            return super().render(content)
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI: duración y tamaño de cada respuesta por ruta (la
+    plantilla, no la URL, para no multiplicar series) y el header
+    Server-Timing con las etapas medidas con span().
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._routes = None
+
+    def _route(self, scope):
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if self._routes is None:
+            self._routes = {getattr(r, "endpoint", None): r.path for r in scope["app"].routes}
+        return self._routes.get(endpoint, "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = []
+        token = _TIMINGS.set(timings)
+        started = time.perf_counter()
+        headers = dict(scope.get("headers") or [])
+        want_timing = SERVER_TIMING == "always" or (
+            SERVER_TIMING == "request" and headers.get(b"x-server-timing", b"") in (b"1", b"true"))
+        status = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if want_timing:
+                    value = server_timing_header(timings, time.perf_counter() - started)
+                    message = {**message, "headers": [*message.get("headers", []),
+                                                      (b"server-timing", value.encode("latin-1"))]}
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _TIMINGS.reset(token)
+            route = self._route(scope)
+            REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                    method=scope["method"], route=route, status=str(status))
+            RESPONSE_BYTES.observe(size, route=route)
@@ -0,0 +1,264 @@
+import datetime
+import json
+import os
+import re
+
+from dotenv import load_dotenv
+
+import financial_logic
+from data_loader import cents_to_amounts
+from response_cache import normalize_question
+
+load_dotenv()
+
+# Tokens máximos (aprox.) del contexto financiero que va en cada prompt
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1500"))
+# Aproximación de caracteres por token para texto/JSON en español
+CHARS_PER_TOKEN = 4
+# Periodos mencionados en una pregunta que se resumen como máximo
+MAX_MENTIONED_PERIODS = 6
+
+# Caracteres reservados para la nota de secciones omitidas
+_OMITTED_RESERVE_CHARS = 100
+
+# Métricas que siempre van en el contexto (son pocas y pequeñas)
+BASE_KEYS = (
+    "total_ingresos",
+    "total_gastos",
+    "flujo_neto_total",
+    "tasa_ahorro_promedio_pct",
+    "conteo_transacciones",
+    "fecha_primera_transaccion",
+    "fecha_ultima_transaccion",
+)
+
+_MESES = {
+    "enero": 1, "febrero": 2, "marzo": 3, "abril": 4, "mayo": 5, "junio": 6,
+    "julio": 7, "agosto": 8, "septiembre": 9, "setiembre": 9, "octubre": 10,
+    "noviembre": 11, "diciembre": 12,
+}
+_MES_RE = re.compile(r"\b(" + "|".join(_MESES) + r")\b(?:\s+(?:de\s+|del\s+)?(\d{4}))?")
+_FECHA_RE = re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b")
+_ANIO_RE = re.compile(r"\b(20\d{2})\b")
+
+
+def estimate_tokens(text):
+    """Tokens aproximados de un texto (sin llamar al tokenizador del modelo)."""
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def compact_json(value):
+    """JSON sin sangría ni espacios: la misma información en menos tokens."""
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def _mentions(name, question):
+    name = normalize_question(str(name))
+    return bool(name) and re.search(r"\b" + re.escape(name) + r"\b", question) is not None
+
+
+def _month_range(year, month):
+    start = datetime.date(year, month, 1)
+    next_month = datetime.date(year + month // 12, month % 12 + 1, 1)
+    return start, next_month - datetime.timedelta(days=1)
+
+
+def mentioned_periods(question, last_date):
+    """
+    Rangos de fechas mencionados en la pregunta: fechas YYYY-MM-DD (dos o
+    más forman un rango), meses ("marzo", "marzo de 2024"), años ("2024") y
+    "este mes"/"mes pasado" relativos a la última transacción. Un mes sin
+    año se toma como el más reciente que no sea posterior a `last_date`.
+    Regresa [(etiqueta, inicio, fin), ...].
+    """
+    question = normalize_question(question)
+    periods = []
+
+    fechas = []
+    for y, m, d in _FECHA_RE.findall(question):
+        try:
+            fechas.append(datetime.date(int(y), int(m), int(d)))
+        except ValueError:
+            # Fecha imposible (ej. 2024-02-30): se ignora
+            continue
+    fechas.sort()
+    if len(fechas) == 1:
+        periods.append((str(fechas[0]), fechas[0], fechas[0]))
+    elif fechas:
+        periods.append((f"{fechas[0]} a {fechas[-1]}", fechas[0], fechas[-1]))
+    sin_fechas = _FECHA_RE.sub(" ", question)
+
+    anios_de_meses = set()
+    for nombre, anio in _MES_RE.findall(sin_fechas):
+        month = _MESES[nombre]
+        if anio:
+            year = int(anio)
+            anios_de_meses.add(year)
+        else:
+            year = last_date.year if month <= last_date.month else last_date.year - 1
+        start, end = _month_range(year, month)
+        periods.append((f"{nombre} {year}", start, end))
+
+    for anio in _ANIO_RE.findall(sin_fechas):
+        if int(anio) not in anios_de_meses:
+            year = int(anio)
+            periods.append((anio, datetime.date(year, 1, 1), datetime.date(year, 12, 31)))
+
+    if "este mes" in question or "ultimo mes" in question:
+        start, end = _month_range(last_date.year, last_date.month)
+        periods.append(("este mes", start, end))
+    if "mes pasado" in question or "mes anterior" in question:
+        year, month = (last_date.year, last_date.month - 1) if last_date.month > 1 else (last_date.year - 1, 12)
+        start, end = _month_range(year, month)
+        periods.append(("mes pasado", start, end))
+
+    unique = []
+    for period in periods:
+        if period not in unique:
+            unique.append(period)
+    return unique[:MAX_MENTIONED_PERIODS]
+
+
+def _fill(context, sections, budget):
+    """
+    Agrega a `context` las secciones en orden de prioridad mientras quepan
+    en el presupuesto. Cada sección es (llave, subllave, valor); las que
+    no caben se cuentan en "omitidos". Regresa (contexto, tokens).
+    """
+    omitted = {}
+    # Se cuentan caracteres exactos del JSON compacto y se convierten al final;
+    # se reserva lugar para la nota de "omitidos"
+    max_chars = budget * CHARS_PER_TOKEN - _OMITTED_RESERVE_CHARS
+    chars = len(compact_json(context))
+    for key, subkey, value in sections:
+        # Entrada nueva dentro del contenedor + coma
+        cost = len(compact_json(value)) + 1
+        if subkey is not None:
+            cost += len(compact_json(str(subkey))) + 1
+        if key not in context:
+            # ,"llave":{} o ,"llave":[]
+            cost += len(compact_json(key)) + 3
+        if chars + cost > max_chars:
+            omitted[key] = omitted.get(key, 0) + 1
+            continue
+        if subkey is None:
+            context.setdefault(key, []).append(value)
+        else:
+            context.setdefault(key, {})[subkey] = value
+        chars += cost
+    if omitted:
+        context["omitidos"] = omitted
+    return context, estimate_tokens(compact_json(context))
+
+
+def _general_sections(context):
+    sections = [("top_gastos_categoria", categoria, monto)
+                for categoria, monto in context.get("top_gastos_categoria", {}).items()]
+    sections += [("transacciones_recientes_sample", None, row)
+                 for row in context.get("transacciones_recientes_sample", [])]
+    return sections
+
+
+def summary_context(context, budget=None):
+    """
+    Contexto compacto sin pregunta: métricas base y, mientras quepan, las
+    categorías de mayor gasto y las transacciones recientes.
+    """
+    if "error" in context:
+        return context, estimate_tokens(compact_json(context))
+    base = {key: context[key] for key in BASE_KEYS if key in context}
+    return _fill(base, _general_sections(context), budget or PROMPT_TOKEN_BUDGET)
+
+
+def build_question_context(question, snapshot, budget=None):
+    """
+    Contexto para una pregunta, acotado a `budget` tokens (aprox.).
+
+    Siempre van las métricas base. Después, por prioridad: el resumen de
+    los periodos mencionados, las categorías y comercios mencionados (con
+    su total en cada periodo mencionado) y, si sobra presupuesto, las
+    categorías de mayor gasto y las transacciones recientes. El tamaño no
+    depende de cuánta historia tenga el usuario.
+    Regresa (contexto, tokens).
+    """
+    context = snapshot.context
+    rollup = snapshot.rollup
+    if rollup is None or "error" in context:
+        return context, estimate_tokens(compact_json(context))
+
+    normalized = normalize_question(question)
+    base = {key: context[key] for key in BASE_KEYS if key in context}
+    sections = []
+
+    last_date = datetime.date.fromisoformat(context["fecha_ultima_transaccion"])
+    periods = mentioned_periods(question, last_date)
+    for label, start, end in periods:
+        summary = financial_logic.summary_from_rollup(rollup, start=start, end=end)
+        if "error" not in summary:
+            summary = {key: summary[key] for key in (*BASE_KEYS, "top_gastos_categoria")}
+        sections.append(("periodos_mencionados", label, summary))
+
+    for categoria, monto in context.get("top_gastos_categoria", {}).items():
+        if _mentions(categoria, normalized):
+            _, conteo = rollup["por_categoria"].get(("gasto", categoria), (0, 0))
+            sections.append(("categorias_mencionadas", categoria, {"gasto_total": monto, "conteo": conteo}))
+
+    comercios = {}
+    for (tipo, descripcion), (cents, conteo) in rollup["por_descripcion"].items():
+        if _mentions(descripcion, normalized):
+            comercios.setdefault(descripcion, {})[tipo] = {"total": cents_to_amounts(cents), "conteo": conteo}
+    for descripcion, totales in comercios.items():
+        if periods and snapshot.timeline is not None:
+            totales["por_periodo"] = {
+                label: round(sum(p["monto"] for p in financial_logic.timeline_points(
+                    snapshot.timeline, granularity="day", descripciones=[descripcion], start=start, end=end
+                )), 2)
+                for label, start, end in periods
+            }
+        sections.append(("comercios_mencionados", descripcion, totales))
+
+    sections += _general_sections(context)
+    return _fill(base, sections, budget or PROMPT_TOKEN_BUDGET)
+
+
+def _rounded(value):
+    return round(value, 2) if isinstance(value, float) else value
+
+
+def _same(a, b):
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return abs(a - b) < 0.005
+    return a == b
+
+
+def context_diff(real, simulado):
+    """
+    Sólo lo que cambia entre dos contextos: {llave: {"real": ..., "simulado": ...}}.
+    En diccionarios anidados (ej. gasto por categoría) se compara cada
+    entrada. La muestra de transacciones recientes no se compara.
+    """
+    diff = {}
+    for key in dict.fromkeys([*real, *simulado]):
+        if key == "transacciones_recientes_sample":
+            continue
+        a, b = real.get(key), simulado.get(key)
+        if isinstance(a, dict) and isinstance(b, dict):
+            changed = {k: {"real": _rounded(a.get(k)), "simulado": _rounded(b.get(k))}
+                       for k in dict.fromkeys([*a, *b]) if not _same(a.get(k), b.get(k))}
+            if changed:
+                diff[key] = changed
+        elif not _same(a, b):
+            diff[key] = {"real": _rounded(a), "simulado": _rounded(b)}
+    return diff
+
+
+def simulation_context(real, simulado):
+    """
+    Contexto de una simulación: métricas base del escenario real y sólo los
+    cambios del simulado. Regresa (contexto, tokens).
+    """
+    context = {
+        "real": {key: real[key] for key in BASE_KEYS if key in real},
+        "cambios": context_diff(real, simulado),
+    }
+    return context, estimate_tokens(compact_json(context))
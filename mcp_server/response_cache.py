@@ -0,0 +1,243 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+import metrics
+
+load_dotenv()
+
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "512"))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600"))
+# Directorio para el nivel en disco (opcional). Vacío = sólo memoria.
+RESPONSE_CACHE_DIR = os.getenv("RESPONSE_CACHE_DIR", "")
+
+_FINGERPRINT_FILE = "context.fingerprint"
+
+
+def normalize_question(question):
+    """
+    Normaliza una pregunta para que variaciones triviales (mayúsculas, acentos,
+    espacios, signos de interrogación) compartan entrada.
+    """
+    text = unicodedata.normalize("NFKD", question).casefold()
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = " ".join(text.split())
+    return text.strip("¿?¡!. ")
+
+
+def context_fingerprint(context):
+    """Hash estable de un contexto financiero (dict serializable a JSON)."""
+    raw = json.dumps(context, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def make_key(kind, *parts):
+    """Construye la llave de caché a partir del tipo de llamada y sus partes."""
+    raw = json.dumps([kind, *parts], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Caché de respuestas del modelo con desalojo LRU + TTL.
+
+    El nivel en memoria está acotado a `max_entries`. Si se indica `disk_dir`,
+    las respuestas también se guardan como archivos JSON para sobrevivir a
+    reinicios del servidor (con el mismo límite de entradas). Los archivos
+    se leen y escriben fuera del lock; desde el event loop hay que usar las
+    variantes async (aget, apeek, aset), que los tocan en un hilo.
+    """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+                 ttl_seconds=RESPONSE_CACHE_TTL_SECONDS, disk_dir=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = disk_dir or None
+        self._entries = OrderedDict()  # key -> (expira_en, valor)
+        self._lock = threading.Lock()
+        self._fingerprint = None
+        # Cambia en cada invalidate: una lectura o escritura de disco que
+        # empezó antes no debe revivir entradas borradas
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._fingerprint = self._read_disk_fingerprint()
+
+    # --- Nivel en disco ---
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _read_disk_fingerprint(self):
+        try:
+            with open(os.path.join(self.disk_dir, _FINGERPRINT_FILE), encoding="utf-8") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _disk_get(self, key):
+        try:
+            with open(self._disk_path(key), encoding="utf-8") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if entry["expires_at"] < time.time():
+            self._disk_remove(key)
+            return None
+        return entry["expires_at"], entry["value"]
+
+    def _disk_set(self, key, expires_at, value, generation):
+        # Nombre temporal por hilo: dos escrituras de la misma llave no chocan
+        tmp_path = f"{self._disk_path(key)}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"expires_at": expires_at, "value": value}, f, ensure_ascii=False)
+        os.replace(tmp_path, self._disk_path(key))
+        if generation != self._generation:
+            # Se invalidó mientras escribíamos
+            self._disk_remove(key)
+            return
+        self._disk_prune()
+
+    def _disk_remove(self, key):
+        try:
+            os.remove(self._disk_path(key))
+        except FileNotFoundError:
+            pass
+
+    def _disk_prune(self):
+        files = [e for e in os.scandir(self.disk_dir) if e.name.endswith(".json")]
+        if len(files) <= self.max_entries:
+            return
+        files.sort(key=lambda e: e.stat().st_mtime)
+        for entry in files[:len(files) - self.max_entries]:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    # --- API pública ---
+
+    def get(self, key):
+        """Regresa el valor cacheado o None."""
+        return self._get(key)
+
+    def peek(self, key, count_hit=False):
+        """
+        Como get, pero sin contar el fallo: para revisar antes de admitir una
+        petición que después llamará a get (una sola consulta por petición en
+        las estadísticas). Con `count_hit` cuenta el acierto, para quien usa
+        directamente el valor encontrado y ya no llamará a get.
+        """
+        return self._get(key, count_hit=count_hit, count_miss=False)
+
+    def _memory_get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < now:
+                del self._entries[key]
+                entry = None
+            return entry, self._generation
+
+    def _get(self, key, count_hit=True, count_miss=True):
+        entry, generation = self._memory_get(key)
+        if entry is None and self.disk_dir:
+            entry = self._disk_get(key)
+        with self._lock:
+            if entry is not None and generation == self._generation:
+                self._store(key, entry)
+            elif entry is not None:
+                entry = None
+            if entry is None:
+                if count_miss:
+                    self.misses += 1
+                    metrics.CACHE_REQUESTS.inc(cache="ai", result="miss")
+                return None
+            if count_hit:
+                self.hits += 1
+                metrics.CACHE_REQUESTS.inc(cache="ai", result="hit")
+            return entry[1]
+
+    def set(self, key, value):
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._store(key, (expires_at, value))
+            generation = self._generation
+        if self.disk_dir:
+            self._disk_set(key, expires_at, value, generation)
+
+    async def _in_thread(self, fn, key, *args, **kwargs):
+        # Sin nivel en disco (o con la llave en memoria) no hay I/O: directo
+        if not self.disk_dir or self._memory_get(key)[0] is not None:
+            return fn(key, *args, **kwargs)
+        return await asyncio.to_thread(fn, key, *args, **kwargs)
+
+    async def aget(self, key):
+        """get para el event loop: la lectura de disco corre en un hilo."""
+        return await self._in_thread(self.get, key)
+
+    async def apeek(self, key, count_hit=False):
+        """peek para el event loop."""
+        return await self._in_thread(self.peek, key, count_hit=count_hit)
+
+    async def aset(self, key, value):
+        """set para el event loop: la escritura de disco corre en un hilo."""
+        if not self.disk_dir:
+            return self.set(key, value)
+        return await asyncio.to_thread(self.set, key, value)
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self):
+        """Borra todas las entradas (memoria y disco)."""
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+        if self.disk_dir:
+            for entry in os.scandir(self.disk_dir):
+                if entry.name.endswith(".json"):
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
+
+    def bind_context(self, fingerprint):
+        """
+        Asocia la caché a la versión actual de los datos. Si la huella cambió
+        (recarga de datos), invalida todo lo guardado con la versión anterior.
+        """
+        if fingerprint == self._fingerprint:
+            return
+        self.invalidate()
+        self._fingerprint = fingerprint
+        if self.disk_dir:
+            with open(os.path.join(self.disk_dir, _FINGERPRINT_FILE), "w", encoding="utf-8") as f:
+                f.write(fingerprint)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "disk_dir": self.disk_dir,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+CACHE = ResponseCache(disk_dir=RESPONSE_CACHE_DIR)
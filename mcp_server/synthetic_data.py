@@ -0,0 +1,177 @@
+import argparse
+import datetime
+
+import numpy as np
+import pandas as pd
+
+# Catálogo de gastos: categoría -> (peso de la categoría, comercios, mediana y
+# dispersión del monto log-normal). Dentro de cada categoría los comercios
+# siguen una distribución tipo Zipf (los primeros son los más frecuentes).
+GASTOS = {
+    "Supermercado": (0.22, ["Walmart", "Soriana", "Chedraui", "Costco", "La Comer", "Oxxo"], 850.0, 0.7),
+    "Restaurantes": (0.16, ["Restaurante", "Starbucks", "Taquería", "Vips", "Rappi", "Uber Eats"], 320.0, 0.8),
+    "Transporte": (0.15, ["Uber", "DiDi", "Gasolinera", "Metro", "Caseta"], 180.0, 0.9),
+    "Entretenimiento": (0.09, ["Netflix", "Spotify", "Cinépolis", "Steam", "Disney+"], 220.0, 0.6),
+    "Salud": (0.07, ["Farmacia", "Farmacias Guadalajara", "Consulta médica", "Laboratorio"], 450.0, 0.9),
+    "Educación": (0.04, ["Colegiatura", "Librería", "Curso en línea"], 2500.0, 0.6),
+    "Servicios": (0.10, ["CFE", "Telmex", "Telcel", "Agua", "Gas"], 600.0, 0.5),
+    "Hogar": (0.07, ["Home Depot", "Liverpool", "Mercado Libre", "Amazon"], 900.0, 1.0),
+    "Ropa": (0.06, ["Zara", "Liverpool Ropa", "Coppel", "Shein"], 700.0, 0.7),
+    "Retiro de efectivo": (0.04, ["Cajero Banorte"], 1000.0, 0.5),
+}
+
+# Ingresos: la nómina llega el día 1 de cada mes, una por usuario, con un
+# salario fijo por usuario (mediana y dispersión log-normal entre usuarios);
+# los demás ingresos son esporádicos.
+INGRESOS = {
+    "Salario": (["Nómina mensual"], 25000.0, 0.35),
+    "Honorarios": (["Freelance", "Consultoría"], 4000.0, 0.6),
+    "Otros ingresos": (["Transferencia recibida", "Reembolso", "Intereses"], 600.0, 1.0),
+}
+# Fracción de las demás filas que son ingresos esporádicos (el resto son gastos)
+OTHER_INCOME_FRACTION = 0.02
+# Transacciones de un usuario en un mes: el archivo reúne tantos usuarios
+# como hagan falta para llegar a las filas pedidas
+USER_MONTHLY_TRANSACTIONS = 35
+# Tasa de ahorro esperada: los montos de gasto se escalan para gastar
+# (1 - SAVINGS_RATE) de los ingresos esperados
+SAVINGS_RATE = 0.15
+DAYS_PER_MONTH = 30.4375
+
+COLUMNS = ['fecha', 'descripcion', 'categoria', 'monto', 'tipo']
+
+
+def _zipf_weights(n, s=1.1):
+    weights = 1.0 / np.arange(1, n + 1) ** s
+    return weights / weights.sum()
+
+
+def _flatten(catalog):
+    """(descripciones, categorías, mediana, sigma, peso) por comercio."""
+    rows = []
+    for categoria, (peso, comercios, mediana, sigma) in catalog.items():
+        for comercio, w in zip(comercios, _zipf_weights(len(comercios))):
+            rows.append((comercio, categoria, mediana, sigma, peso * w))
+    descripciones, categorias, medianas, sigmas, pesos = zip(*rows)
+    pesos = np.asarray(pesos)
+    return (np.asarray(descripciones, dtype=object), np.asarray(categorias, dtype=object),
+            np.asarray(medianas), np.asarray(sigmas), pesos / pesos.sum())
+
+
+def _expected(catalog):
+    """Monto esperado por fila del catálogo (media de la log-normal, ponderada)."""
+    _, _, mediana, sigma, pesos = _flatten(catalog)
+    return float((pesos * mediana * np.exp(sigma ** 2 / 2)).sum())
+
+
+def users_for(rows, days):
+    """Usuarios cuyos estados de cuenta suman `rows` filas en `days` días."""
+    return max(1, round(rows / (USER_MONTHLY_TRANSACTIONS * days / DAYS_PER_MONTH)))
+
+
+def salaries_for(users, rng):
+    """Salario mensual de cada usuario (fijo durante todo el periodo)."""
+    _, mediana, sigma = INGRESOS["Salario"]
+    return np.round(mediana * rng.lognormal(0.0, sigma, size=users), 2)
+
+
+def _paydays(start, days):
+    """Días 1 de cada mes dentro de [start, start + days)."""
+    end = start + np.timedelta64(days, 'D')
+    months = np.arange(start.astype('datetime64[M]'), end.astype('datetime64[M]') + 1, dtype='datetime64[M]')
+    firsts = months.astype('datetime64[D]')
+    return firsts[(firsts >= start) & (firsts < end)]
+
+
+def generate_chunk(rows, rng, start, days, salaries):
+    """
+    `rows` transacciones sintéticas con el esquema del CSV (fecha como
+    datetime64, monto float con dos decimales) entre `start` y
+    `start + days`, ordenadas por fecha. `salaries`: salario mensual de
+    cada usuario (ver salaries_for); cada uno recibe su nómina el día 1.
+    """
+    start = np.datetime64(start, 'D')
+    paydays = _paydays(start, days)
+    nomina_fechas = np.repeat(paydays, len(salaries))[:rows]
+    nomina_montos = np.tile(salaries, len(paydays))[:rows]
+    n_nomina = len(nomina_fechas)
+    n_otros = rng.binomial(rows - n_nomina, OTHER_INCOME_FRACTION)
+    n_gastos = rows - n_nomina - n_otros
+
+    # Gastos: más actividad en fin de semana
+    offsets = rng.integers(0, days, size=n_gastos)
+    weekday = (offsets + (start - np.datetime64('1970-01-05', 'D')).astype(int)) % 7
+    retry = (weekday < 5) & (rng.random(n_gastos) < 0.25)
+    offsets[retry] = rng.integers(0, days, size=int(retry.sum()))
+    desc, cat, mediana, sigma, pesos = _flatten(GASTOS)
+    idx = rng.choice(len(desc), size=n_gastos, p=pesos)
+    # Escala según el ingreso esperado del tramo (no el de este bloque en
+    # particular), para que el balance no dependa de cómo se parte el archivo
+    catalogo_otros = {k: (1.0, *v) for k, v in INGRESOS.items() if k != "Salario"}
+    ingreso_esperado = salaries.sum() * days / DAYS_PER_MONTH + n_otros * _expected(catalogo_otros)
+    escala = (1 - SAVINGS_RATE) * ingreso_esperado / max(1, n_gastos) / _expected(GASTOS)
+    montos = escala * mediana[idx] * rng.lognormal(0.0, sigma[idx])
+    gastos = pd.DataFrame({
+        'fecha': start + offsets.astype('timedelta64[D]'),
+        'descripcion': desc[idx],
+        'categoria': cat[idx],
+        'monto': np.round(np.maximum(montos, 1.0), 2),
+        'tipo': 'gasto',
+    })
+
+    # Ingresos: una nómina por usuario el día 1, el resto en cualquier día
+    desc_o, cat_o, mediana_o, sigma_o, pesos_o = _flatten(catalogo_otros)
+    idx_o = rng.choice(len(desc_o), size=n_otros, p=pesos_o)
+    ingresos = pd.DataFrame({
+        'fecha': np.concatenate([nomina_fechas, start + rng.integers(0, days, size=n_otros).astype('timedelta64[D]')]),
+        'descripcion': np.concatenate([np.full(n_nomina, INGRESOS["Salario"][0][0], dtype=object), desc_o[idx_o]]),
+        'categoria': np.concatenate([np.full(n_nomina, "Salario", dtype=object), cat_o[idx_o]]),
+        'monto': np.concatenate([nomina_montos, np.round(mediana_o[idx_o] * rng.lognormal(0.0, sigma_o[idx_o]), 2)]),
+        'tipo': 'ingreso',
+    })
+
+    df = pd.concat([gastos, ingresos], ignore_index=True)
+    return df.sort_values('fecha', kind='stable', ignore_index=True)[COLUMNS]
+
+
+def generate(rows, seed=0, start="2023-01-01", days=730):
+    """DataFrame con `rows` transacciones sintéticas (reproducible con `seed`)."""
+    rng = np.random.default_rng(seed)
+    return generate_chunk(rows, rng, start, days, salaries_for(users_for(rows, days), rng))
+
+
+def write_csv(path, rows, seed=0, start="2023-01-01", days=730, chunk_rows=1_000_000, encoding="utf-8"):
+    """
+    Escribe un CSV sintético por bloques (la memoria no depende de `rows`).
+    Cada bloque cubre un tramo consecutivo del periodo, así que el archivo
+    queda ordenado por fecha como un estado de cuenta real. Los usuarios y
+    sus salarios son los mismos en todos los bloques.
+    """
+    rng = np.random.default_rng(seed)
+    salaries = salaries_for(users_for(rows, days), rng)
+    chunks = max(1, -(-rows // chunk_rows))
+    start_day = np.datetime64(start, 'D')
+    with open(path, 'w', encoding=encoding, newline='') as f:
+        f.write(",".join(COLUMNS) + "\n")
+        for n in range(chunks):
+            chunk_size = rows // chunks + (1 if n < rows % chunks else 0)
+            chunk_start = start_day + (days * n) // chunks
+            chunk_days = max(1, (days * (n + 1)) // chunks - (days * n) // chunks)
+            df = generate_chunk(chunk_size, rng, chunk_start, chunk_days, salaries)
+            df['fecha'] = df['fecha'].dt.strftime('%Y-%m-%d')
+            df.to_csv(f, header=False, index=False, float_format='%.2f')
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera un CSV de transacciones sintéticas.")
+    parser.add_argument("out", help="archivo CSV de salida")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--start", default="2023-01-01")
+    parser.add_argument("--days", type=int, default=730)
+    parser.add_argument("--encoding", default="utf-8", help="ej. latin1 para imitar el archivo original")
+    args = parser.parse_args()
+    started = datetime.datetime.now()
+    write_csv(args.out, args.rows, seed=args.seed, start=args.start, days=args.days, encoding=args.encoding)
+    print(f"{args.rows} transacciones escritas en {args.out} ({(datetime.datetime.now() - started).total_seconds():.1f}s)")
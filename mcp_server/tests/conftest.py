@@ -0,0 +1,32 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Los módulos del servidor se importan planos (ej. `import data_loader`)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Configuración de prueba antes de importar cualquier módulo (leen os.getenv
+# al importarse): modelo falso sin latencia, sin vigilancia del archivo y
+# base de usuarios / snapshots en un directorio temporal
+_TMP = tempfile.mkdtemp(prefix="mcp-tests-")
+os.environ.setdefault("LLM_BACKEND", "fake")
+os.environ.setdefault("FAKE_LLM_LATENCY_SECONDS", "0")
+os.environ.setdefault("FAKE_LLM_JITTER_SECONDS", "0")
+os.environ.setdefault("FAKE_LLM_TOKENS_PER_SECOND", "100000")
+os.environ.setdefault("LLM_BACKOFF_SECONDS", "0.01")
+os.environ.setdefault("DATA_WATCH", "0")
+os.environ.setdefault("DATA_BACKGROUND_LOAD", "0")
+os.environ.setdefault("USER_DB_PATH", os.path.join(_TMP, "transacciones.db"))
+os.environ.setdefault("DATA_SNAPSHOT_DIR", os.path.join(_TMP, "snapshots"))
+
+import data_loader  # noqa: E402
+import synthetic_data  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def transacciones():
+    """Unas 3000 transacciones sintéticas (esquema compacto) en ~8 meses."""
+    df = synthetic_data.generate(3000, seed=7, start="2024-01-01", days=240)
+    return data_loader.compact_transactions(df)
@@ -0,0 +1,151 @@
+import asyncio
+
+import pytest
+
+import admission
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(admission.time, "monotonic", clock)
+    return clock
+
+
+def test_rate_limiter_burst_then_refill(clock):
+    limiter = admission.RateLimiter(per_minute=6, burst=3)  # una ficha cada 10 s
+
+    assert [limiter.acquire("a") for _ in range(3)] == [0, 0, 0]
+    assert limiter.acquire("a") == pytest.approx(10)
+    # Otro cliente tiene su propia cubeta
+    assert limiter.acquire("b") == 0
+
+    clock.now += 4
+    assert limiter.acquire("a") == pytest.approx(6)
+    clock.now += 6
+    assert limiter.acquire("a") == 0
+    assert limiter.acquire("a") > 0
+
+
+def test_rate_limiter_refill_is_capped_at_burst(clock):
+    limiter = admission.RateLimiter(per_minute=60, burst=2)
+    limiter.acquire("a")
+    clock.now += 3600
+    assert [limiter.acquire("a") for _ in range(3)][:2] == [0, 0]
+    assert limiter.acquire("a") > 0
+
+
+def test_rate_limiter_disabled_and_bounded(clock):
+    assert all(admission.RateLimiter(per_minute=0, burst=1).acquire("a") == 0 for _ in range(10))
+
+    limiter = admission.RateLimiter(per_minute=60, burst=1, max_clients=2)
+    for client in ("a", "b", "c"):
+        limiter.acquire(client)
+    assert len(limiter._buckets) == 2
+    # "a" fue el menos reciente: se olvidó y vuelve con la cubeta llena
+    assert limiter.acquire("a") == 0
+
+
+def test_single_flight_shares_one_call():
+    calls = []
+
+    async def main():
+        flights = admission.SingleFlight()
+        release = asyncio.Event()
+
+        async def compute():
+            calls.append(1)
+            await release.wait()
+            return {"ok": len(calls)}
+
+        waiters = [asyncio.ensure_future(flights.run("k", compute)) for _ in range(5)]
+        await asyncio.sleep(0)
+        assert "k" in flights and len(flights) == 1
+        release.set()
+        results = await asyncio.gather(*waiters)
+        assert "k" not in flights
+        # Una llave ya terminada vuelve a calcular
+        assert await flights.run("k", compute) == {"ok": 2}
+        return results
+
+    results = asyncio.run(main())
+    assert results == [{"ok": 1}] * 5
+    assert len(calls) == 2
+
+
+def test_single_flight_shares_the_error():
+    async def main():
+        flights = admission.SingleFlight()
+
+        async def fail():
+            await asyncio.sleep(0)
+            raise RuntimeError("modelo caído")
+
+        return await asyncio.gather(*(flights.run("k", fail) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, RuntimeError) and str(r) == "modelo caído" for r in results)
+
+
+def test_single_flight_cancels_only_when_nobody_waits():
+    async def main():
+        flights = admission.SingleFlight()
+        started = asyncio.Event()
+        cancelled = asyncio.Event()
+
+        async def compute():
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        first = asyncio.ensure_future(flights.run("k", compute))
+        second = asyncio.ensure_future(flights.run("k", compute))
+        await started.wait()
+
+        first.cancel()
+        await asyncio.sleep(0)
+        assert not cancelled.is_set() and "k" in flights
+
+        second.cancel()
+        await asyncio.wait_for(cancelled.wait(), 1)
+        assert "k" not in flights
+
+    asyncio.run(main())
+
+
+def test_check_rejects_full_queue_without_spending_tokens(monkeypatch, clock):
+    limiter = admission.RateLimiter(per_minute=60, burst=1)
+    monkeypatch.setattr(admission, "RATE_LIMITER", limiter)
+    monkeypatch.setattr(admission, "HOST_RATE_LIMITER", admission.RateLimiter(per_minute=60, burst=10))
+
+    status, _, _, reason = admission.check(("h", "c"), queue_depth=admission.LLM_MAX_QUEUE_DEPTH)
+    assert (status, reason) == (503, "queue_full")
+    assert admission.check(("h", "c"), queue_depth=0) is None
+    status, _, retry_after, reason = admission.check(("h", "c"), queue_depth=0)
+    assert (status, reason) == (429, "rate_limit")
+    assert retry_after == pytest.approx(1)
+    assert admission.rejection(status, "Espera", retry_after).headers["Retry-After"] == "1"
+
+
+def test_sessions_share_the_host_budget(monkeypatch, clock):
+    monkeypatch.setattr(admission, "RATE_LIMITER", admission.RateLimiter(per_minute=60, burst=5))
+    host_limiter = admission.RateLimiter(per_minute=60, burst=3)
+    monkeypatch.setattr(admission, "HOST_RATE_LIMITER", host_limiter)
+
+    # Una sesión nueva por petición no da fichas nuevas del host
+    results = [admission.check(("h", f"s{i}"), queue_depth=0) for i in range(5)]
+    assert results[:3] == [None] * 3
+    assert [r[0] for r in results[3:]] == [429, 429]
+    # Otro host tiene su propio tope
+    assert admission.check(("otro", "s0"), queue_depth=0) is None
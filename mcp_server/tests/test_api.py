@@ -0,0 +1,168 @@
+import asyncio
+import json
+
+import httpx
+import pyarrow as pa
+import pytest
+
+import admission
+import data_loader
+import main
+import response_cache
+
+API = "/api/v1"
+
+
+def _request(method, url, **kwargs):
+    async def send():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.request(method, url, **kwargs)
+    return asyncio.run(send())
+
+
+def _ingest(user_id, df):
+    records = data_loader.public_transactions(df)
+    records['fecha'] = records['fecha'].dt.strftime('%Y-%m-%d')
+    response = _request("POST", f"{API}/transactions/bulk", params={"user_id": user_id},
+                        json={"transactions": records.to_dict('records')})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+@pytest.fixture(scope="module")
+def usuario(transacciones):
+    result = _ingest("paginas", transacciones.iloc[:700].reset_index(drop=True))
+    assert result == {"accepted": 700, "version": 1, "conteo_transacciones": 700}
+    return "paginas"
+
+
+def _all_pages(params, limit):
+    items, cursor, pages = [], None, 0
+    while True:
+        page = _request("GET", f"{API}/all_transactions",
+                        params={**params, "limit": limit, **({"cursor": cursor} if cursor else {})}).json()
+        items.extend(page["items"])
+        pages += 1
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return items, pages
+
+
+@pytest.mark.parametrize("filters", [{}, {"tipo": "gasto", "start": "2024-02-01", "end": "2024-05-31"}])
+def test_cursor_pagination_covers_every_row_once(usuario, filters):
+    params = {"user_id": usuario, **filters}
+    full = _request("GET", f"{API}/all_transactions", params=params).json()
+    items, pages = _all_pages(params, limit=64)
+    assert items == full
+    assert pages == len(full) // 64 + 1
+
+
+def test_cursor_is_stable_across_ingest(usuario, transacciones):
+    params = {"user_id": usuario, "limit": 100}
+    first = _request("GET", f"{API}/all_transactions", params=params).json()
+    # Filas nuevas a mitad de la paginación: la siguiente página no se recorre
+    _ingest(usuario, transacciones.iloc[700:705].reset_index(drop=True))
+    second = _request("GET", f"{API}/all_transactions", params={**params, "cursor": first["next_cursor"]}).json()
+    full = _request("GET", f"{API}/all_transactions", params={"user_id": usuario}).json()
+    assert first["items"] + second["items"] == full[:200]
+    assert len(full) == 705
+
+
+def test_invalid_cursor():
+    response = _request("GET", f"{API}/all_transactions", params={"user_id": "paginas", "cursor": "%%%"})
+    assert response.json() == {"error": "Cursor inválido."}
+
+
+@pytest.mark.parametrize("method, path", [
+    ("GET", "/summary"), ("GET", "/all_transactions"), ("GET", "/timeline"),
+    ("POST", "/ask"), ("POST", "/simulate"),
+])
+def test_unknown_user_gets_404(method, path):
+    body = {"question": "¿Cuánto gasté?"} if path == "/ask" else {}
+    response = _request(method, f"{API}{path}", params={"user_id": "fantasma"}, json=body if method == "POST" else None)
+    assert response.status_code == 404
+    assert response.json() == {"error": "No hay datos para este usuario."}
+
+
+def test_rate_limit_only_charges_new_model_calls(usuario, monkeypatch):
+    monkeypatch.setattr(admission, "RATE_LIMITER", admission.RateLimiter(per_minute=1, burst=1))
+    headers = {"X-Client-Id": "sesion-1"}
+
+    def ask(question, headers=headers):
+        return _request("POST", f"{API}/ask", params={"user_id": usuario}, headers=headers,
+                        json={"question": question})
+
+    # La misma pregunta se responde desde caché: no gasta fichas
+    assert [ask("¿Cuánto gasté en Walmart?").status_code for _ in range(3)] == [200, 200, 200]
+    limited = ask("¿Cuál fue mi mayor gasto?")
+    assert limited.status_code == 429
+    assert "Retry-After" in limited.headers
+    assert limited.json()["error"].startswith("Demasiadas consultas")
+    # Otra sesión tiene su propia cubeta
+    assert ask("¿Cuál fue mi mayor gasto?", headers={"X-Client-Id": "sesion-2"}).status_code == 200
+
+
+def test_rotating_client_ids_share_the_host_limit(usuario, monkeypatch):
+    monkeypatch.setattr(admission, "HOST_RATE_LIMITER", admission.RateLimiter(per_minute=1, burst=2))
+    statuses = [
+        _request("POST", f"{API}/ask", params={"user_id": usuario}, headers={"X-Client-Id": f"rota-{i}"},
+                 json={"question": f"¿Cuánto gasté en la semana {i}?"}).status_code
+        for i in range(4)
+    ]
+    assert statuses == [200, 200, 429, 429]
+
+
+def _cache_counts():
+    stats = response_cache.CACHE.stats()
+    return stats["hits"], stats["misses"]
+
+
+def test_each_request_counts_one_cache_lookup(usuario):
+    def ask():
+        return _request("POST", f"{API}/ask", params={"user_id": usuario}, headers={"X-Client-Id": "conteo"},
+                        json={"question": "¿Cuánto gasté en Oxxo?"})
+
+    hits, misses = _cache_counts()
+    assert ask().status_code == 200
+    assert _cache_counts() == (hits, misses + 1)
+    assert ask().status_code == 200
+    assert _cache_counts() == (hits + 1, misses + 1)
+
+    body = {"category_to_reduce": "Ropa", "reduction_percentage": 10}
+    first = _request("POST", f"{API}/simulate", params={"user_id": usuario, "wait_for_analysis": True}, json=body)
+    assert first.json()["analysis_job"]["status"] == "done"
+    assert _cache_counts() == (hits + 1, misses + 2)
+    _request("POST", f"{API}/simulate", params={"user_id": usuario}, json=body)
+    assert _cache_counts() == (hits + 2, misses + 2)
+
+
+@pytest.mark.parametrize("tool_calling", [False, True])
+def test_ask_uses_tools_only_when_enabled(usuario, monkeypatch, tool_calling):
+    monkeypatch.setattr(main.llm_tools, "LLM_TOOL_CALLING", tool_calling)
+    response = _request("POST", f"{API}/ask", params={"user_id": usuario},
+                        headers={"X-Client-Id": f"herramientas-{tool_calling}"},
+                        json={"question": "¿Cuánto gasté en Soriana?"})
+    assert response.status_code == 200
+    assert ("tool_calls" in response.json()) == tool_calling
+    assert ("context_tokens" in response.json()) != tool_calling
+
+
+def test_default_user_rejects_ingest():
+    body = {"fecha": "2024-05-01", "descripcion": "Oxxo", "categoria": "Supermercado", "monto": 50, "tipo": "gasto"}
+    response = _request("POST", f"{API}/transactions", json=body)
+    assert response.status_code == 409
+    assert "archivo de datos" in response.json()["error"]
+
+
+@pytest.mark.parametrize("output_format", ["ndjson", "arrow"])
+def test_streamed_formats_page_like_json(usuario, output_format):
+    params = {"user_id": usuario, "limit": 50, "tipo": "gasto"}
+    page = _request("GET", f"{API}/all_transactions", params=params).json()
+    streamed = _request("GET", f"{API}/all_transactions", params={**params, "format": output_format})
+    assert streamed.headers["X-Next-Cursor"] == page["next_cursor"]
+    if output_format == "ndjson":
+        rows = [json.loads(line) for line in streamed.text.splitlines()]
+    else:
+        rows = pa.ipc.open_stream(streamed.content).read_all().to_pylist()
+    assert [(r["descripcion"], r["monto"]) for r in rows] == [(r["descripcion"], r["monto"]) for r in page["items"]]
@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+import data_loader
+import financial_logic
+
+
+def test_latin1_after_an_ascii_first_megabyte(tmp_path):
+    path = tmp_path / "estado.csv"
+    ascii_rows = 30_000  # más de 1 MB: detect_encoding sólo ve ASCII
+    with open(path, "w", encoding="latin1", newline="") as f:
+        f.write("fecha,descripcion,categoria,monto,tipo\n")
+        for i in range(ascii_rows):
+            f.write(f"2024-01-{i % 28 + 1:02d},Oxxo,Supermercado,{i % 90 + 10}.50,gasto\n")
+        f.write("2024-02-01,Cafetería Ñandú,Restaurantes,120.00,gasto\n")
+        f.write("2024-02-01,Nómina mensual,Salario,25000.00,ingreso\n")
+    assert data_loader.detect_encoding(path) == "utf-8"
+
+    report = {}
+    df = pd.concat(list(data_loader.iter_csv_chunks(path, report, chunk_rows=7_000)))
+    assert report["encoding"] == "latin1"
+    assert report["rows_read"] == ascii_rows + 2 and report["rejected_rows"] == 0
+    assert list(df.index) == list(range(ascii_rows + 2))
+    descripciones = data_loader.public_transactions(df.tail(2))["descripcion"].tolist()
+    assert descripciones == ["Cafetería Ñandú", "Nómina mensual"]
+
+
+def test_derived_snapshot_round_trip(tmp_path, transacciones):
+    rollup = financial_logic.build_rollup(transacciones)
+    derived = {
+        "conteo": len(transacciones),
+        "frame": transacciones,
+        "rollup": rollup,
+        "timeline": financial_logic.build_timeline_rollups(transacciones),
+    }
+    data_loader._write_arrow(tmp_path / "d.derived", derived)
+    loaded = data_loader._read_arrow(tmp_path / "d.derived")
+
+    pd.testing.assert_frame_equal(loaded["frame"], transacciones)
+    assert loaded["rollup"]["por_categoria"] == rollup["por_categoria"]
+    np.testing.assert_array_equal(loaded["rollup"]["indice"]["gastos"], rollup["indice"]["gastos"])
+    assert financial_logic.summary_from_rollup(loaded["rollup"], "2024-03-01", "2024-03-31") == \
+        financial_logic.summary_from_rollup(rollup, "2024-03-01", "2024-03-31")
+    for granularity, frame in derived["timeline"].items():
+        pd.testing.assert_frame_equal(loaded["timeline"][granularity], frame)
+
+
+def test_snapshot_columns_are_memory_mapped(tmp_path, transacciones):
+    path = tmp_path / "d.derived"
+    data_loader._write_arrow(path, {"frame": transacciones, "indice": np.arange(12).reshape(3, 4)})
+    loaded = data_loader._read_arrow(path)
+
+    assert loaded["indice"].shape == (3, 4) and not loaded["indice"].flags.writeable
+    assert not loaded["frame"]["monto"].to_numpy().flags.writeable
+    # Es Arrow IPC: cualquier lector de Arrow lo abre
+    assert pa.ipc.open_file(str(path)).read_all().num_rows == 1
+
+
+def test_truncated_snapshot_is_rejected(tmp_path):
+    path = tmp_path / "d.derived"
+    data_loader._write_arrow(path, {"valores": np.arange(10, dtype="int64")})
+    path.write_bytes(path.read_bytes()[:-64])
+    with pytest.raises(pa.ArrowInvalid):
+        data_loader._read_arrow(path)
+
+
+def test_objects_are_never_unpickled(tmp_path):
+    with pytest.raises(TypeError):
+        data_loader._write_arrow(tmp_path / "d.derived", {"fn": object()})
+
+
+def test_concat_transactions_unifies_categories_and_releases_chunks():
+    first = data_loader.compact_transactions(pd.DataFrame({
+        "fecha": pd.to_datetime(["2024-01-02", "2024-01-03"]), "descripcion": ["Oxxo", None],
+        "categoria": ["Supermercado", "Salud"], "monto": [10.5, 20.0], "tipo": ["gasto", "gasto"],
+    }))
+    second = data_loader.compact_transactions(pd.DataFrame({
+        "fecha": pd.to_datetime(["2024-01-04"]), "descripcion": ["Amazon"],
+        "categoria": ["Hogar"], "monto": [99.99], "tipo": ["ingreso"],
+    })).set_axis(pd.RangeIndex(2, 3))
+    chunks = [first, second]
+
+    df = data_loader.concat_transactions(chunks, release=True)
+    assert chunks == []
+    assert isinstance(df.index, pd.RangeIndex) and list(df.index) == [0, 1, 2]
+    assert df['descripcion'].cat.categories.tolist() == ["Amazon", "Oxxo"]
+    assert df['fecha'].dtype == "int32" and df['monto'].dtype == "int64"
+    public = data_loader.public_transactions(df)
+    assert public['descripcion'].tolist()[::2] == ["Oxxo", "Amazon"] and pd.isna(public['descripcion'][1])
+    assert public['categoria'].tolist() == ["Supermercado", "Salud", "Hogar"]
+    assert public['monto'].tolist() == [10.5, 20.0, 99.99]
+    assert public['tipo'].tolist() == ["gasto", "gasto", "ingreso"]
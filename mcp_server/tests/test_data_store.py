@@ -0,0 +1,68 @@
+import pytest
+
+import data_loader
+import data_store
+import financial_logic
+import user_store
+
+
+def _rows(transacciones, start, stop):
+    return transacciones.iloc[start:stop].reset_index(drop=True)
+
+
+def test_ingest_bumps_version_and_updates_summary(transacciones):
+    first = data_store.append(_rows(transacciones, 0, 1200), "ingesta-a")
+    assert first.version == 1
+    assert first.context["conteo_transacciones"] == 1200
+
+    second = data_store.append(_rows(transacciones, 1200, 1500), "ingesta-a")
+    assert second.version == 2
+    assert user_store.version("ingesta-a") == 2
+    # Índices consecutivos por usuario (la paginación por cursor depende de ellos)
+    assert list(second.df.index) == list(range(1500))
+    # El resumen incremental es el mismo que recalcular todo desde cero
+    expected = financial_logic.get_financial_summary(_rows(transacciones, 0, 1500))
+    for key in ("total_ingresos", "total_gastos", "conteo_transacciones", "top_gastos_categoria",
+                "fecha_primera_transaccion", "fecha_ultima_transaccion"):
+        assert second.context[key] == pytest.approx(expected[key]), key
+
+    # La versión en memoria es la vigente
+    assert data_store.current("ingesta-a") is second
+
+
+def test_partition_survives_reload(transacciones):
+    data_store.append(_rows(transacciones, 0, 50), "ingesta-b")
+    data_store.append(_rows(transacciones, 50, 80), "ingesta-b")
+    df, version = user_store.load_partition("ingesta-b")
+    assert version == 2
+    assert list(df.index) == list(range(80))
+    pd_expected = data_loader.public_transactions(_rows(transacciones, 0, 80))
+    pd_loaded = data_loader.public_transactions(df).reset_index(drop=True)
+    assert (pd_loaded['monto'] == pd_expected['monto']).all()
+    assert (pd_loaded['descripcion'] == pd_expected['descripcion']).all()
+    assert (pd_loaded['fecha'] == pd_expected['fecha']).all()
+
+
+def test_other_worker_writes_are_picked_up(transacciones, monkeypatch):
+    data_store.append(_rows(transacciones, 0, 10), "ingesta-c")
+    # Otro proceso escribe directo en la partición
+    user_store.append("ingesta-c", _rows(transacciones, 10, 15))
+    monkeypatch.setattr(data_store, "DATA_VERSION_CHECK_SECONDS", -1)
+    snapshot = data_store.current("ingesta-c")
+    assert snapshot.version == 2
+    assert snapshot.context["conteo_transacciones"] == 15
+
+
+def test_unknown_user_is_empty_and_not_cached():
+    hot_before = data_store.stats()["hot_users"]
+    snapshot = data_store.current("no-existe")
+    assert not snapshot.has_data
+    assert snapshot.meta["status"] == "empty"
+    assert data_store.stats()["hot_users"] == hot_before
+
+
+def test_default_user_is_not_ingested_in_memory(transacciones):
+    version = data_store.current().version
+    with pytest.raises(ValueError):
+        data_store.append(_rows(transacciones, 0, 5), data_store.DEFAULT_USER_ID)
+    assert data_store.current().version == version
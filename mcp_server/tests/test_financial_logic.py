@@ -0,0 +1,115 @@
+import datetime
+
+import pytest
+
+import data_loader
+import financial_logic
+from main import SimulationRequest
+
+
+@pytest.fixture(scope="module")
+def rollup(transacciones):
+    return financial_logic.build_rollup(transacciones)
+
+
+def _pandas_summary(df, start=None, end=None):
+    """Resumen recalculado directamente de las filas, con pandas."""
+    df = data_loader.public_transactions(df)
+    if start is not None:
+        df = df[df['fecha'] >= str(start)]
+    if end is not None:
+        df = df[df['fecha'] <= str(end)]
+    gastos = df[df['tipo'] == 'gasto']
+    return {
+        "total_ingresos": round(df.loc[df['tipo'] == 'ingreso', 'monto'].sum(), 2),
+        "total_gastos": round(gastos['monto'].sum(), 2),
+        "conteo_transacciones": len(df),
+        "gastos_categoria": gastos.groupby('categoria')['monto'].sum().round(2).to_dict(),
+        "fecha_primera_transaccion": df['fecha'].min().strftime('%Y-%m-%d'),
+        "fecha_ultima_transaccion": df['fecha'].max().strftime('%Y-%m-%d'),
+    }
+
+
+@pytest.mark.parametrize("start, end", [
+    (None, None),
+    (datetime.date(2024, 3, 1), datetime.date(2024, 3, 31)),
+    (datetime.date(2024, 2, 10), None),
+    (None, datetime.date(2024, 5, 17)),
+    (datetime.date(2024, 4, 6), datetime.date(2024, 4, 6)),
+])
+def test_range_summary_matches_pandas(transacciones, rollup, start, end):
+    summary = financial_logic.summary_from_rollup(rollup, start, end)
+    expected = _pandas_summary(transacciones, start, end)
+
+    assert summary["total_ingresos"] == pytest.approx(expected["total_ingresos"], abs=0.005)
+    assert summary["total_gastos"] == pytest.approx(expected["total_gastos"], abs=0.005)
+    assert summary["conteo_transacciones"] == expected["conteo_transacciones"]
+    assert summary["fecha_primera_transaccion"] == expected["fecha_primera_transaccion"]
+    assert summary["fecha_ultima_transaccion"] == expected["fecha_ultima_transaccion"]
+    assert summary["top_gastos_categoria"] == pytest.approx(expected["gastos_categoria"], abs=0.005)
+    # Mayor gasto primero
+    montos = list(summary["top_gastos_categoria"].values())
+    assert montos == sorted(montos, reverse=True)
+
+
+def test_range_without_data(rollup):
+    summary = financial_logic.summary_from_rollup(rollup, datetime.date(2030, 1, 1), datetime.date(2030, 1, 31))
+    assert summary == {"error": "No hay datos en el rango de fechas"}
+
+
+def test_monthly_series_adds_up_to_total(rollup):
+    series = financial_logic.summary_series(rollup, "month")
+    total = financial_logic.summary_from_rollup(rollup)
+    assert [p["periodo"] for p in series] == sorted(p["periodo"] for p in series)
+    assert sum(p["conteo_transacciones"] for p in series) == total["conteo_transacciones"]
+    assert sum(p["total_gastos"] for p in series) == pytest.approx(total["total_gastos"], abs=0.01)
+
+
+@pytest.mark.parametrize("params", [
+    SimulationRequest(),
+    SimulationRequest(category_to_reduce="Restaurantes", reduction_percentage=20),
+    SimulationRequest(income_to_increase="Nómina mensual", increase_amount=1500),
+    SimulationRequest(category_to_reduce="Supermercado", reduction_percentage=35,
+                      income_to_increase="Freelance", increase_amount=250.5),
+    SimulationRequest(category_to_reduce="No existe", reduction_percentage=50),
+])
+def test_simulate_summary_matches_apply_simulation(transacciones, rollup, params):
+    fast = financial_logic.simulate_summary(rollup, params)
+    slow = financial_logic.get_financial_summary(financial_logic.apply_simulation(transacciones, params))
+    # apply_simulation redondea cada fila al centavo; simulate_summary escala
+    # la suma: la diferencia es a lo más medio centavo por fila
+    tolerance = 0.005 * len(transacciones)
+
+    for key in ("total_ingresos", "total_gastos", "flujo_neto_total"):
+        assert fast[key] == pytest.approx(slow[key], abs=tolerance), key
+    assert fast["tasa_ahorro_promedio_pct"] == pytest.approx(slow["tasa_ahorro_promedio_pct"], abs=0.01)
+    for key in ("conteo_transacciones", "fecha_primera_transaccion", "fecha_ultima_transaccion"):
+        assert fast[key] == slow[key], key
+    assert list(fast["top_gastos_categoria"]) == list(slow["top_gastos_categoria"])
+    assert fast["top_gastos_categoria"] == pytest.approx(slow["top_gastos_categoria"], abs=tolerance)
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"descripcion": "WALMART"},
+    {"categoria": "restaurantes", "tipo": "gasto", "start": datetime.date(2024, 2, 1), "end": datetime.date(2024, 4, 30)},
+    {"min_monto": 2000, "limit": 50},
+    {"descripcion": "No existe"},
+    {},
+])
+def test_query_transactions_matches_pandas(transacciones, kwargs):
+    found = financial_logic.query_transactions(transacciones, **kwargs)
+
+    df = data_loader.public_transactions(transacciones)
+    if "descripcion" in kwargs:
+        df = df[df['descripcion'].str.casefold() == kwargs["descripcion"].casefold()]
+    if "categoria" in kwargs:
+        df = df[df['categoria'].str.casefold() == kwargs["categoria"].casefold()]
+    if "tipo" in kwargs:
+        df = df[df['tipo'] == kwargs["tipo"]]
+    if "start" in kwargs:
+        df = df[(df['fecha'] >= str(kwargs["start"])) & (df['fecha'] <= str(kwargs["end"]))]
+    if "min_monto" in kwargs:
+        df = df[df['monto'] >= kwargs["min_monto"]]
+    expected = df.nlargest(kwargs.get("limit", 5), 'monto')
+    assert [r["id"] for r in found] == expected.index.tolist()
+    assert [r["monto"] for r in found] == expected['monto'].tolist()
@@ -0,0 +1,129 @@
+import asyncio
+
+import gemini_client
+import jobs
+import llm_client
+import metrics
+
+
+def _run(make_store, scenario):
+    async def main():
+        return await scenario(make_store())
+    return asyncio.run(main())
+
+
+def test_job_lifecycle_done():
+    async def scenario(store):
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return {"analisis": "ok"}
+
+        job = store.submit("simulate", "ana", work, key=("simulate", "ana", 1))
+        assert job.status == "pending"
+        assert store.in_flight(("simulate", "ana", 1)) is job
+        await asyncio.sleep(0)
+        assert job.status == "running"
+        assert store.stats()["running"] == 1
+
+        release.set()
+        await asyncio.wait_for(job.done_event.wait(), 1)
+        assert job.public()["status"] == "done"
+        assert job.result == {"analisis": "ok"} and job.error is None
+        assert job.finished_at >= job.created_at
+        assert store.in_flight(("simulate", "ana", 1)) is None
+        # Sólo su usuario lo ve
+        assert store.get(job.id, "ana") is job
+        assert store.get(job.id, "otro") is None
+
+    _run(lambda: jobs.JobStore(workers=1), scenario)
+
+
+def test_job_error_path():
+    async def scenario(store):
+        async def work():
+            raise llm_client.LLMError("El modelo no respondió.")
+
+        job = store.submit("simulate", "ana", work, key="k")
+        await asyncio.wait_for(job.done_event.wait(), 1)
+        assert job.status == "error"
+        assert job.error == "El modelo no respondió."
+        assert job.result is None
+        assert store.in_flight("k") is None
+
+    _run(lambda: jobs.JobStore(workers=1), scenario)
+
+
+def test_ai_analysis_failure_marks_the_job_as_error():
+    previous = gemini_client.backend
+    gemini_client.use_backend(gemini_client.FakeBackend(latency=0, jitter=0, error_rate=1, seed=0))
+    try:
+        async def scenario(store):
+            job = store.submit("simulate", "ana", lambda: gemini_client.get_ai_simulation_analysis(
+                {"total_gastos": 100.0}, {"total_gastos": 80.0}))
+            await asyncio.wait_for(job.done_event.wait(), 10)
+            return job
+
+        job = _run(lambda: jobs.JobStore(workers=1), scenario)
+    finally:
+        gemini_client.use_backend(previous)
+    assert job.status == "error"
+    assert job.error == "Hubo un error al procesar el análisis de la simulación."
+
+
+def test_full_queue_rejects_immediately():
+    async def scenario(store):
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+
+        running = store.submit("simulate", "ana", work)
+        await asyncio.sleep(0)
+        queued = store.submit("simulate", "ana", work)
+        rejected = store.submit("simulate", "ana", work, key="k")
+        assert rejected.status == "error" and "demasiados" in rejected.error.lower()
+        assert rejected.done_event.is_set()
+        assert store.in_flight("k") is None
+        release.set()
+        await asyncio.wait_for(queued.done_event.wait(), 1)
+        assert running.status == queued.status == "done"
+
+    _run(lambda: jobs.JobStore(workers=1, queue_max=1), scenario)
+
+
+def test_completed_rejected_and_expiry(monkeypatch):
+    store = jobs.JobStore(ttl_seconds=60, max_entries=2)
+    done = store.completed("simulate", "ana", {"cached": True})
+    assert done.status == "done" and done.done_event.is_set()
+    limited = store.rejected("simulate", "ana", "Demasiadas consultas")
+    assert (limited.status, limited.error) == ("error", "Demasiadas consultas")
+
+    # Más de max_entries: se descarta el más antiguo
+    store.completed("simulate", "ana", None)
+    assert store.get(done.id) is None and store.get(limited.id) is limited
+
+    # Vencido por TTL
+    now = jobs.time.time()
+    monkeypatch.setattr(jobs.time, "time", lambda: now + 61)
+    assert store.get(limited.id) is None
+
+
+def test_workers_do_not_inherit_the_request_context():
+    async def scenario(store):
+        # Como si el primer trabajo lo encolara una petición con Server-Timing
+        timings = []
+        metrics._TIMINGS.set(timings)
+
+        async def work():
+            with metrics.span("llm"):
+                await asyncio.sleep(0)
+
+        for _ in range(5):
+            job = store.submit("simulate", "ana", work)
+            await asyncio.wait_for(job.done_event.wait(), 1)
+            assert job.status == "done"
+        return timings
+
+    assert _run(lambda: jobs.JobStore(workers=2), scenario) == []
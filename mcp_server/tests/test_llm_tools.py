@@ -0,0 +1,100 @@
+import asyncio
+import datetime
+import threading
+
+import pytest
+
+import data_store
+import financial_logic
+import gemini_client
+import llm_tools
+from llm_tools import FakeToolModel, ToolCall
+
+
+@pytest.fixture(scope="module")
+def snapshot(transacciones):
+    return data_store.build_snapshot(transacciones, 1, user_id="herramientas")
+
+
+def _ask(question, snapshot, script):
+    model = FakeToolModel(script)
+    answer, calls = asyncio.run(gemini_client.get_ai_answer_with_tools(question, snapshot, step=model))
+    return answer, calls, model
+
+
+def test_tool_loop_answers_from_exact_queries(snapshot):
+    answer, calls, model = _ask("¿Cuánto gasté en Walmart en marzo?", snapshot, [
+        [("query_merchant_totals", {"descripcion": "walmart", "start": "2024-03-01", "end": "2024-03-31"})],
+        lambda responses: f"Gastaste {responses[-1]['por_tipo']['gasto']['total']}",
+    ])
+
+    expected = financial_logic.query_merchant_totals(
+        snapshot.timeline, "Walmart", datetime.date(2024, 3, 1), datetime.date(2024, 3, 31))
+    assert [(c.name, r) for c, r in calls] == [("query_merchant_totals", expected)]
+    assert answer == f"Gastaste {expected['por_tipo']['gasto']['total']}"
+    # El modelo ve la pregunta, su llamada y la respuesta de la herramienta
+    roles = [m["role"] for m in model.histories[-1]]
+    assert roles == ["user", "model", "tool"]
+
+
+def test_tool_errors_are_returned_to_the_model(snapshot):
+    answer, calls, _ = _ask("?", snapshot, [
+        [("no_existe", {}), ("query_range_totals", {"start": "2024-13-45"}), ("query_transaction", {})],
+        "Lo siento",
+    ])
+    results = [r for _, r in calls]
+    assert results[0] == {"error": "Herramienta desconocida: no_existe"}
+    assert results[1]["error"].startswith("Argumentos inválidos para query_range_totals")
+    assert results[2] == {"error": "Falta el parámetro transaction_id"}
+    assert answer == "Lo siento"
+
+
+def test_several_calls_in_one_turn(snapshot):
+    _, calls, _ = _ask("?", snapshot, [
+        [ToolCall("query_range_totals", {"start": "2024-02-01", "end": "2024-02-29"}),
+         ToolCall("query_transaction", {"transaction_id": "3"})],
+        "listo",
+    ])
+    totals, transaction = (r for _, r in calls)
+    assert totals == financial_logic.query_range_totals(
+        snapshot.rollup, datetime.date(2024, 2, 1), datetime.date(2024, 2, 29))
+    assert transaction["id"] == 3
+
+
+def test_loop_stops_after_max_steps(snapshot):
+    script = [[("query_range_totals", {})]] * (llm_tools.LLM_TOOL_MAX_STEPS + 2)
+    answer, calls, model = _ask("?", snapshot, script)
+    assert len(calls) == llm_tools.LLM_TOOL_MAX_STEPS
+    # Último turno: se le pide responder sin más herramientas
+    assert model.histories[-1][-1] == {"role": "user", "text": "Responde ya con la información obtenida."}
+    assert answer == "No pude completar la consulta con los datos disponibles."
+
+
+def test_declarations_cover_every_tool():
+    names = {d["name"] for d in llm_tools.TOOL_DECLARATIONS}
+    assert names == {fn.__name__ for fn in llm_tools.TOOL_FUNCTIONS}
+    for declaration in llm_tools.TOOL_DECLARATIONS:
+        # La fuente de datos (rollup/df) no es un parámetro para el modelo
+        assert not {"rollup", "rollups", "df"} & set(declaration["parameters"]["properties"])
+
+
+def test_unexpected_tool_errors_go_back_to_the_model(snapshot, monkeypatch):
+    def query_falla(rollup, clave: str) -> dict:
+        return {"valor": rollup["no_existe"][clave]}
+
+    monkeypatch.setitem(llm_tools._TOOLS_BY_NAME, "query_falla", query_falla)
+    answer, calls, _ = _ask("?", snapshot, [[("query_falla", {"clave": "x"})], "sigo"])
+    assert calls[0][1]["error"].startswith("Argumentos inválidos para query_falla")
+    assert answer == "sigo"
+
+
+def test_tools_run_off_the_event_loop(snapshot, monkeypatch):
+    threads = []
+
+    def query_hilo(rollup) -> dict:
+        threads.append(threading.current_thread())
+        return {}
+
+    monkeypatch.setitem(llm_tools._TOOLS_BY_NAME, "query_hilo", query_hilo)
+    _ask("?", snapshot, [[("query_hilo", {})], "listo"])
+    assert threads and threads[0] is not threading.main_thread()
@@ -0,0 +1,19 @@
+import datetime
+
+import prompt_context
+
+ULTIMA = datetime.date(2024, 8, 31)
+
+
+def test_dates_and_months():
+    periods = prompt_context.mentioned_periods("¿Cuánto gasté entre 2024-03-10 y 2024-03-02?", ULTIMA)
+    assert periods[0] == ("2024-03-02 a 2024-03-10", datetime.date(2024, 3, 2), datetime.date(2024, 3, 10))
+
+    (_, inicio, fin), = prompt_context.mentioned_periods("¿y en marzo?", ULTIMA)
+    assert (inicio, fin) == (datetime.date(2024, 3, 1), datetime.date(2024, 3, 31))
+
+
+def test_impossible_dates_are_ignored():
+    assert prompt_context.mentioned_periods("gastos del 2024-02-30", ULTIMA) == []
+    periods = prompt_context.mentioned_periods("del 2024-02-30 al 2024-04-01", ULTIMA)
+    assert periods == [("2024-04-01", datetime.date(2024, 4, 1), datetime.date(2024, 4, 1))]
@@ -0,0 +1,54 @@
+import asyncio
+import os
+import threading
+
+import response_cache
+
+
+def _disk_cache(tmp_path):
+    return response_cache.ResponseCache(max_entries=4, ttl_seconds=60, disk_dir=str(tmp_path))
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    _disk_cache(tmp_path).set("k", {"respuesta": 1})
+    cache = _disk_cache(tmp_path)
+    assert cache.get("k") == {"respuesta": 1}
+    assert cache.stats()["hits"] == 1
+
+
+def test_async_disk_io_runs_in_a_thread_without_the_lock(tmp_path, monkeypatch):
+    cache = _disk_cache(tmp_path)
+    loop_thread = threading.get_ident()
+    seen = []
+
+    def spy(fn):
+        def wrapper(*args):
+            seen.append((fn.__name__, threading.get_ident() != loop_thread, cache._lock.locked()))
+            return fn(*args)
+        return wrapper
+
+    monkeypatch.setattr(cache, "_disk_get", spy(cache._disk_get))
+    monkeypatch.setattr(cache, "_disk_set", spy(cache._disk_set))
+
+    async def run():
+        await cache.aset("k", "v")
+        cache._entries.clear()
+        return await cache.aget("k")
+
+    assert asyncio.run(run()) == "v"
+    assert seen == [("_disk_set", True, False), ("_disk_get", True, False)]
+
+
+def test_invalidate_during_write_drops_the_file(tmp_path, monkeypatch):
+    cache = _disk_cache(tmp_path)
+    real_replace = os.replace
+
+    def replace_then_invalidate(src, dst):
+        real_replace(src, dst)
+        cache.invalidate()
+
+    monkeypatch.setattr(response_cache.os, "replace", replace_then_invalidate)
+    cache.set("k", "v")
+    monkeypatch.setattr(response_cache.os, "replace", real_replace)
+    assert cache.get("k") is None
+    assert not [n for n in os.listdir(tmp_path) if n.endswith(".json")]
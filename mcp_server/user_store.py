@@ -0,0 +1,131 @@
+import os
+import sqlite3
+import sys
+from contextlib import closing
+
+import pandas as pd
+
+import data_loader
+
+# Base de datos embebida con las transacciones de todos los usuarios,
+# particionadas por user_id. Sólo se lee la partición del usuario pedido.
+USER_DB_PATH = os.getenv("USER_DB_PATH", "transacciones.db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS transacciones (
+    user_id     TEXT    NOT NULL,
+    id          INTEGER NOT NULL,  -- consecutivo por usuario (cursor de paginación)
+    fecha       INTEGER NOT NULL,  -- número de día desde 1970-01-01
+    descripcion TEXT,
+    categoria   TEXT,
+    monto       INTEGER NOT NULL,  -- centavos
+    tipo        TEXT    NOT NULL,
+    PRIMARY KEY (user_id, id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_transacciones_user_fecha ON transacciones (user_id, fecha);
+CREATE INDEX IF NOT EXISTS idx_transacciones_user_categoria ON transacciones (user_id, categoria);
+CREATE TABLE IF NOT EXISTS usuarios (
+    user_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+_initialized = set()
+
+def _connect(path=None):
+    path = path or USER_DB_PATH
+    conn = sqlite3.connect(path, timeout=30)
+    if path not in _initialized:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        _initialized.add(path)
+    return conn
+
+def load_partition(user_id, after_id=None, path=None):
+    """
+    Carga las transacciones de un usuario en el esquema compacto de
+    data_loader (índice = id consecutivo del usuario) y su versión.
+    Con `after_id` sólo regresa las filas posteriores a ese id.
+    """
+    with closing(_connect(path)) as conn:
+        # Lectura consistente: filas y versión de la misma transacción
+        conn.execute("BEGIN")
+        df = pd.read_sql_query(
+            "SELECT id, fecha, descripcion, categoria, monto, tipo FROM transacciones "
+            "WHERE user_id = ? AND id > ? ORDER BY id",
+            conn, params=(user_id, -1 if after_id is None else int(after_id)), index_col='id'
+        )
+        row = conn.execute("SELECT version FROM usuarios WHERE user_id = ?", (user_id,)).fetchone()
+        conn.rollback()
+    df.index.name = None
+    df['fecha'] = df['fecha'].astype('int32')
+    df['monto'] = df['monto'].astype('int64')
+    for column in data_loader.TEXT_COLUMNS:
+        df[column] = df[column].astype('category')
+    return df[data_loader.COLUMNS], (row[0] if row else 0)
+
+def version(user_id, path=None):
+    """Versión de la partición del usuario (0 si no tiene transacciones)."""
+    with closing(_connect(path)) as conn:
+        row = conn.execute("SELECT version FROM usuarios WHERE user_id = ?", (user_id,)).fetchone()
+    return row[0] if row else 0
+
+def append(user_id, new_df, path=None):
+    """
+    Guarda transacciones nuevas (esquema compacto) en la partición del
+    usuario. Regresa el DataFrame con los ids asignados y la nueva versión.
+    """
+    with closing(_connect(path)) as conn, conn:
+        # BEGIN IMMEDIATE: dos escrituras del mismo usuario no reciben los mismos ids
+        conn.execute("BEGIN IMMEDIATE")
+        last_id = conn.execute(
+            "SELECT COALESCE(MAX(id), -1) FROM transacciones WHERE user_id = ?", (user_id,)
+        ).fetchone()[0]
+        new_df = new_df.set_axis(pd.RangeIndex(last_id + 1, last_id + 1 + len(new_df)))
+        rows = data_loader.public_transactions(new_df[['descripcion', 'categoria', 'tipo']])
+        conn.executemany(
+            "INSERT INTO transacciones (user_id, id, fecha, descripcion, categoria, monto, tipo) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            zip(
+                [user_id] * len(new_df),
+                new_df.index.tolist(),
+                new_df['fecha'].astype('int64').tolist(),
+                rows['descripcion'].tolist(),
+                rows['categoria'].tolist(),
+                new_df['monto'].astype('int64').tolist(),
+                rows['tipo'].tolist(),
+            )
+        )
+        conn.execute(
+            "INSERT INTO usuarios (user_id, version) VALUES (?, 1) "
+            "ON CONFLICT(user_id) DO UPDATE SET version = version + 1",
+            (user_id,)
+        )
+        new_version = conn.execute("SELECT version FROM usuarios WHERE user_id = ?", (user_id,)).fetchone()[0]
+    return new_df, new_version
+
+def import_csv(user_id, csv_path, path=None):
+    """
+    Importa un estado de cuenta CSV a la partición del usuario, bloque por
+    bloque (la memoria no depende del tamaño del archivo). Regresa el
+    reporte de carga (codificación, filas leídas y rechazadas).
+    """
+    report = {}
+    imported = 0
+    for chunk in data_loader.iter_csv_chunks(csv_path, report):
+        if not chunk.empty:
+            append(user_id, chunk[data_loader.COLUMNS], path)
+            imported += len(chunk)
+    report["imported_rows"] = imported
+    return report
+
+def list_users(path=None):
+    with closing(_connect(path)) as conn:
+        return [row[0] for row in conn.execute("SELECT user_id FROM usuarios ORDER BY user_id")]
+
+if __name__ == "__main__":
+    # Uso: python user_store.py <user_id> <archivo.csv>
+    if len(sys.argv) != 3:
+        print("Uso: python user_store.py <user_id> <archivo.csv>")
+        raise SystemExit(1)
+    print(import_csv(sys.argv[1], sys.argv[2]))